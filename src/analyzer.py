@@ -4,6 +4,9 @@ from google import genai
 from google.genai import types
 import pandas as pd
 import io
+import hashlib
+from src.prompt_builder import build_prompt, build_comparison_prompt
+from src.shared_cache import get_cache
 
 # .envファイルを読み込み、環境変数として設定
 load_dotenv()
@@ -19,82 +22,187 @@ if GEMINI_API_KEY:
 else:
     client = None
 
+# Geminiに渡すためのシステムプロンプト（AIへの役割設定）
+SYSTEM_PROMPT = (
+    "あなたは日本の株式市場の専門家であり、優秀なアナリストです。提供されたデータ（株価チャート画像、指標の要約、財務データ、企業概要）に基づき、"
+    "依頼の構造で日本語の分析レポートを作成してください。トーンは客観的でプロフェッショナルなものにしてください。"
+)
+
+MODEL_NAME = 'gemini-2.5-flash'  # 高速かつマルチモーダル対応のモデル
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', '3600'))  # 同じ入力に対する分析結果を再利用する期間 (秒)
+
+def _build_request(
+    company_name: str,
+    code: str,
+    summary: str,
+    stock_data: pd.DataFrame,
+    financial_data: pd.DataFrame,
+    chart_buffer: io.BytesIO,
+    margin_data: pd.DataFrame = None,
+    sector_data: dict = None
+):
+    """generate_content / generate_content_stream に渡す contents と設定を組み立てる"""
+    # --- 1. プロンプトの組み立て (指標の要約 + 縮小したチャート画像) ---
+    prompt = build_prompt(
+        company_name=company_name,
+        code=code,
+        summary=summary,
+        stock_data=stock_data,
+        financial_data=financial_data,
+        chart_buffer=chart_buffer,
+        margin_data=margin_data,
+        sector_data=sector_data,
+        system_prompt=SYSTEM_PROMPT
+    )
+
+    # --- 2. コンテンツの構築 (画像とテキストの結合) ---
+    contents = []
+    if prompt["image"] is not None:
+        contents.append(types.Part.from_bytes(data=prompt["image"], mime_type='image/png'))
+    contents.append(prompt["text"])
+
+    return contents, _config(), prompt["tokens"]
+
+def _build_comparison_request(items: list):
+    """複数銘柄の比較リクエストの contents と設定を組み立てる (チャートはラベルを付けて銘柄順に並べる)"""
+    prompt = build_comparison_prompt(items, system_prompt=SYSTEM_PROMPT)
+    contents = []
+    for label, png in prompt["images"]:
+        contents.append(label)
+        contents.append(types.Part.from_bytes(data=png, mime_type='image/png'))
+    contents.append(prompt["text"])
+    return contents, _config(), prompt["tokens"]
+
+def _config():
+    return types.GenerateContentConfig(
+        system_instruction=SYSTEM_PROMPT,
+        temperature=0.2  # 客観的な分析のため、低めの温度を設定
+    )
+
+def _cache_key(contents) -> str:
+    """モデル名と contents (テキスト・画像) の内容から共有キャッシュのキーを作る"""
+    digest = hashlib.sha1(MODEL_NAME.encode())
+    for part in contents:
+        if isinstance(part, str):
+            digest.update(part.encode())
+        else:
+            digest.update(part.inline_data.data)
+    return f"ai:{digest.hexdigest()}"
+
+def _generate(contents, config, prompt_tokens: int) -> dict:
+    """Gemini APIを呼び出し、レポート全文を返す (同じ入力の結果は共有キャッシュから返す)"""
+    cache = get_cache()
+    key = _cache_key(contents)
+    cached = cache.get(key)
+    if cached is not None:
+        return {"report": cached, "prompt_tokens": prompt_tokens, "error": None}
+
+    try:
+        response = client.models.generate_content(
+            model=MODEL_NAME,
+            contents=contents,
+            config=config
+        )
+        cache.set(key, response.text, AI_CACHE_TTL)
+        return {"report": response.text, "prompt_tokens": prompt_tokens, "error": None}
+        
+    except Exception as e:
+        return {"error": f"Gemini API実行中にエラーが発生しました: {e}"}
+
+def _generate_stream(contents, config, prompt_tokens: int) -> dict:
+    """
+    Gemini APIをストリーミングで呼び出し、テキスト断片のイテレータを返す。
+    同じ入力の結果が共有キャッシュにあれば全文を1断片として返し、なければ最後まで受信した全文を保存する。
+    """
+    cache = get_cache()
+    key = _cache_key(contents)
+    cached = cache.get(key)
+
+    def stream():
+        if cached is not None:
+            yield cached
+            return
+        received = []
+        for chunk in client.models.generate_content_stream(model=MODEL_NAME, contents=contents, config=config):
+            if chunk.text:
+                received.append(chunk.text)
+                yield chunk.text
+        cache.set(key, ''.join(received), AI_CACHE_TTL)
+
+    return {"stream": stream(), "prompt_tokens": prompt_tokens, "error": None}
+
 def generate_analysis(
     company_name: str, 
     code: str, 
     summary: str, 
     stock_data: pd.DataFrame, 
     financial_data: pd.DataFrame, 
-    chart_buffer: io.BytesIO
+    chart_buffer: io.BytesIO,
+    margin_data: pd.DataFrame = None,
+    sector_data: dict = None
 ) -> dict:
     """
     株価・財務データとチャート画像に基づき、Gemini AIによる分析レポートを生成する。
+    プロンプトは prompt_builder でトークン予算内の要約に圧縮してから送信する。
     """
     
     if not client:
         return {"error": "Gemini APIキーが設定されていないか、クライアントの初期化に失敗しています。"}
 
-    # --- 1. テキストプロンプトの準備 ---
-    
-    # 財務データを整形（最新5年分）
-    financial_text = financial_data.to_markdown(index=False)
-    
-    # 株価データから主要な指標を抽出（最新の終値と過去の平均など）
-    latest_close = stock_data['Close'].iloc[-1]
-    last_90_days_avg = stock_data['Close'].iloc[-90:].mean()
-    
-    # Geminiに渡すためのシステムプロンプト（AIへの役割設定）
-    system_prompt = (
-        "あなたは日本の株式市場の専門家であり、優秀なアナリストです。提供されたデータ（株価チャート画像、財務データ、企業概要）に基づき、"
-        "以下の構造で日本語の分析レポートを作成してください。トーンは客観的でプロフェッショナルなものにしてください。"
+    contents, config, prompt_tokens = _build_request(
+        company_name, code, summary, stock_data, financial_data, chart_buffer, margin_data, sector_data
     )
 
-    # ユーザーからAIへの入力指示
-    user_prompt = f"""
-    ### 銘柄分析レポート作成依頼
+    # --- 3. Gemini APIの呼び出し ---
+    return _generate(contents, config, prompt_tokens)
 
-    **銘柄名:** {company_name} ({code})
-    **企業概要:** {summary}
-    **現在の株価:** {latest_close:.2f} 円
-    **過去90日間の平均株価:** {last_90_days_avg:.2f} 円
+def generate_analysis_stream(
+    company_name: str,
+    code: str,
+    summary: str,
+    stock_data: pd.DataFrame,
+    financial_data: pd.DataFrame,
+    chart_buffer: io.BytesIO,
+    margin_data: pd.DataFrame = None,
+    sector_data: dict = None
+) -> dict:
+    """
+    generate_analysis のストリーミング版。生成されたテキストを断片ごとに返すイテレータを返す。
+    最初の断片はモデルの最初のトークンが届き次第得られるため、全文の生成完了を待たずに表示を始められる。
 
-    **【財務データ (過去5年間の主要指標)】**
-    {financial_text}
+    Returns:
+        {"stream": テキスト断片のイテレータ, "prompt_tokens": 見積もりトークン数, "error": None}
+        イテレーション中のAPIエラーは例外として送出される。
+    """
+    if not client:
+        return {"error": "Gemini APIキーが設定されていないか、クライアントの初期化に失敗しています。"}
+
+    contents, config, prompt_tokens = _build_request(
+        company_name, code, summary, stock_data, financial_data, chart_buffer, margin_data, sector_data
+    )
+    return _generate_stream(contents, config, prompt_tokens)
 
-    **【分析依頼事項】**
-    1.  **株価動向の評価 (テクニカル):** 提供されたチャート画像（ローソク足とRSI）を見て、現在の株価トレンド（上昇/下降/レンジ）と、短期的な売買シグナル（RSIなど）を評価してください。
-    2.  **財務健全性の評価 (ファンダメンタルズ):** 財務データ（売上、利益、EPS、PER、ROE）の推移を見て、企業の成長性、収益性、割安感を評価してください。
-    3.  **総合的な見解:** 上記を踏まえ、この銘柄に対する総合的な投資見解（強気/中立/弱気）と、その理由を簡潔にまとめてください。
+def generate_comparison(items: list) -> dict:
     """
-    
-    # --- 2. コンテンツの構築 (画像とテキストの結合) ---
-    
-    # チャート画像をPIL Image形式でメモリから読み込みます
-    # Note: Gemini APIはBytesIOを直接受け付けるため、画像形式を指定します
-    
-    # Geminiへの入力コンテンツリスト
-    contents = [
-        types.Part.from_bytes(
-            data=chart_buffer.getvalue(),
-            mime_type='image/png'
-        ),
-        user_prompt
-    ]
+    複数銘柄の比較レポートを1回のリクエストで生成する。
+    銘柄ごとに generate_analysis を呼ぶ代わりに、要約とチャートをまとめて送るため、N銘柄でも往復は1回で済む。
 
-    # --- 3. Gemini APIの呼び出し ---
-    
-    try:
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',  # 高速かつマルチモーダル対応のモデル
-            contents=contents,
-            config=types.GenerateContentConfig(
-                system_instruction=system_prompt,
-                temperature=0.2  # 客観的な分析のため、低めの温度を設定
-            )
-        )
-        return {"report": response.text, "error": None}
-        
-    except Exception as e:
-        return {"error": f"Gemini API実行中にエラーが発生しました: {e}"}
+    Args:
+        items: company_name, code, summary, stock_data, financial_data, chart_buffer
+               (任意で margin_data, sector_data) を持つ辞書のリスト
+    """
+    if not client:
+        return {"error": "Gemini APIキーが設定されていないか、クライアントの初期化に失敗しています。"}
+
+    contents, config, prompt_tokens = _build_comparison_request(items)
+    return _generate(contents, config, prompt_tokens)
+
+def generate_comparison_stream(items: list) -> dict:
+    """generate_comparison のストリーミング版 (戻り値は generate_analysis_stream と同じ形式)"""
+    if not client:
+        return {"error": "Gemini APIキーが設定されていないか、クライアントの初期化に失敗しています。"}
+
+    contents, config, prompt_tokens = _build_comparison_request(items)
+    return _generate_stream(contents, config, prompt_tokens)
 
 # テスト用コードは省略
@@ -9,7 +9,13 @@ import time
 import jpholiday
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from src.db_manager import get_connection
+from src.db_manager import get_connection, create_tables, get_code_ids, date_to_day
+from src.company_master import CompanySnapshot
+from src.db_maintenance import run_after_batch
+from src.validator import (
+    ValidationReport, align_header, load_previous_close, quarantine,
+    validate_prices, validate_financials, validate_margin, validate_indices,
+)
 from typing import Union
 
 # .envファイルを読み込み
@@ -17,9 +23,13 @@ load_dotenv()
 KABU_PLUS_USER = os.getenv('KABU_PLUS_USER')
 KABU_PLUS_PASSWORD = os.getenv('KABU_PLUS_PASSWORD')
 
-# 株・プラスのベースURL
-KABU_PLUS_BASE_URL = 'https://csvex.com/kabu.plus/csv/'
+# 株・プラスのベースURL (環境変数で上書き可能。ローカルのスタブサーバーを指す場合など)
+KABU_PLUS_BASE_URL = os.getenv('KABU_PLUS_BASE_URL', 'https://csvex.com/kabu.plus/csv/')
+# 1日分の処理ごとの待機秒数 (サーバー負荷軽減)
+REQUEST_INTERVAL = float(os.getenv('KABU_PLUS_REQUEST_INTERVAL', '1'))
 TIMEOUT = 30
+# バッチ後に軽い保守 (空きページ回収・PRAGMA optimize) を実行するか
+RUN_MAINTENANCE = os.getenv('DB_MAINTENANCE_AFTER_BATCH', '1') == '1'
 ENCODING = 'cp932'
 
 # --- 接続設定 ---
@@ -30,6 +40,7 @@ def make_session_with_retries():
                     status_forcelist=[429, 500, 502, 503, 504],
                     allowed_methods=["GET"])
     s.mount("https://", HTTPAdapter(max_retries=retries))
+    s.mount("http://", HTTPAdapter(max_retries=retries))
     s.headers.update({
         "User-Agent": "StockAnalysisBot/1.0"
     })
@@ -57,13 +68,30 @@ def fetch_csv_as_dataframe(url: str, session: requests.Session, skiprows: int =
     return None
 
 
+def to_compact_keys(df: pd.DataFrame, conn: sqlite3.Connection) -> pd.DataFrame:
+    """
+    code/date 列をコンパクトスキーマのキー (銘柄ID・日番号) に置き換えたDataFrameを返す。
+    """
+    out = df.copy()
+    code_ids = get_code_ids(conn, out['code'].unique())
+    out['code'] = out['code'].map(code_ids)
+    out['date'] = out['date'].map({d: date_to_day(d) for d in out['date'].unique()})
+    return out.rename(columns={'code': 'code_id', 'date': 'day'})
+
+
 # --- 1. 日足株価 & 企業マスタ更新 ---
-def insert_daily_prices(date_str: str, conn: sqlite3.Connection, session: requests.Session):
+def insert_daily_prices(date_str: str, conn: sqlite3.Connection, session: requests.Session,
+                        report: ValidationReport = None, snapshot: CompanySnapshot = None):
+    """
+    株価CSVを取り込み、(検証済みの株価DataFrame, 検証で除外した証券コード) を返す (財務との整合性チェック用)。
+    取り込めなかった場合は (None, 空集合)。
+    """
+    report = report or ValidationReport()
     filename = f"japan-all-stock-prices-2_{date_str}.csv"
     url = f"{KABU_PLUS_BASE_URL}japan-all-stock-prices-2/daily/{filename}"
     
     df = fetch_csv_as_dataframe(url, session, skiprows=0)
-    if df is None: return
+    if df is None: return None, set()
 
     try:
         # DBに格納するカラム（DB名はcamel_case）とCSVヘッダー名のマッピング
@@ -97,42 +125,50 @@ def insert_daily_prices(date_str: str, conn: sqlite3.Connection, session: reques
         df['date'] = date_str 
         df['code'] = df['code'].astype(str)
 
+        # 検証: 売買停止日の '-' やゼロ価格、OHLCの矛盾がある行は除外する
+        for col in ['market', 'industry', 'open', 'high', 'low', 'volume', 'trading_value', 'market_cap_total']:
+            if col not in df.columns:
+                df[col] = None
+        checked = len(df)
+        df, issues = validate_prices(df, load_previous_close(conn, date_str))
+        quarantine(conn, report, '株価', date_str, checked, issues)
+        rejected_codes = set(issues.loc[issues['severity'] == 'reject', 'code'])
+
         # --- A. 企業マスタ (companies) の更新 ---
-        # 毎日更新することで、社名変更や新規上場に対応
-        companies_df = df[['code', 'name', 'market', 'industry']].copy()
-        companies_df.drop_duplicates(subset=['code'], inplace=True)
-        
-        comp_records = [tuple(x) for x in companies_df.where(pd.notnull(companies_df), None).to_numpy()]
-        conn.executemany("""
-            INSERT OR REPLACE INTO companies (code, name, market, industry)
-            VALUES (?, ?, ?, ?)
-        """, comp_records)
+        # 前日までのスナップショットと比較し、社名変更・市場変更・新規上場があった銘柄だけを書き込む
+        snapshot = snapshot or CompanySnapshot.load(conn)
+        changed = snapshot.apply(conn, df, date_str)
 
         # --- B. 日足株価 (daily_prices) の更新 ---
         # 既存カラムに加え、売買代金と時価総額（全銘柄）を追加
         prices_db_cols = ['code', 'date', 'open', 'high', 'low', 'close', 'volume', 'trading_value', 'market_cap_total']
-        prices_df = df[[c for c in prices_db_cols if c in df.columns]].copy()
-        
-        # DBカラムに不足している場合はNoneを追加
-        for col in prices_db_cols:
-            if col not in prices_df.columns:
-                prices_df[col] = None
+        prices_df = df[prices_db_cols].copy()
 
-        price_records = [tuple(row) for row in prices_df.where(pd.notnull(prices_df), None).itertuples(index=False)]
+        # 4本値は10倍した整数で格納する
+        compact_df = to_compact_keys(prices_df, conn)
+        for col in ['open', 'high', 'low', 'close']:
+            compact_df[col] = (compact_df[col] * 10).round()
+
+        price_records = [tuple(row) for row in compact_df.where(pd.notnull(compact_df), None).itertuples(index=False)]
 
         conn.executemany(f"""
-            INSERT OR REPLACE INTO daily_prices ({', '.join(prices_db_cols)}) 
+            INSERT OR REPLACE INTO daily_prices_compact
             VALUES ({', '.join(['?'] * len(prices_db_cols))})
         """, price_records)
         
-        print(f"  -> 株価・企業情報: {len(price_records)}件 処理完了")
+        print(f"  -> 株価・企業情報: {len(price_records)}件 処理完了 (銘柄属性の変更: {changed}件)")
+        return prices_df, rejected_codes
 
     except Exception as e:
         print(f"  -> エラー(株価): {e}")
+        return None, set()
 
 
 # --- 2. 財務指標 ---
-def insert_daily_financials(date_str: str, conn: sqlite3.Connection, session: requests.Session):
+def insert_daily_financials(date_str: str, conn: sqlite3.Connection, session: requests.Session,
+                            prices_df: pd.DataFrame = None, report: ValidationReport = None,
+                            price_rejected_codes: set = None):
+    report = report or ValidationReport()
     filename = f"japan-all-stock-data_{date_str}.csv"
     url = f"{KABU_PLUS_BASE_URL}japan-all-stock-data/daily/{filename}"
     
@@ -183,10 +219,16 @@ def insert_daily_financials(date_str: str, conn: sqlite3.Connection, session: re
         # DB挿入順に並べ替え
         df = df[fin_db_cols]
 
+        # 検証: 値域チェックと、同日の株価CSVとの時価総額の整合性
+        checked = len(df)
+        df, issues = validate_financials(df, prices_df, price_rejected_codes)
+        quarantine(conn, report, '財務指標', date_str, checked, issues)
+
+        df = to_compact_keys(df, conn)
         records = [tuple(row) for row in df.where(pd.notnull(df), None).itertuples(index=False)]
 
         conn.executemany(f"""
-            INSERT OR REPLACE INTO daily_financials ({', '.join(fin_db_cols)}) 
+            INSERT OR REPLACE INTO daily_financials_compact
             VALUES ({', '.join(['?'] * len(fin_db_cols))})
         """, records)
         print(f"  -> 財務指標: {len(records)}件 処理完了")
@@ -196,7 +238,9 @@ def insert_daily_financials(date_str: str, conn: sqlite3.Connection, session: re
 
 
 # --- 3. 信用残 ---
-def insert_weekly_margin(date_str: str, conn: sqlite3.Connection, session: requests.Session):
+def insert_weekly_margin(date_str: str, conn: sqlite3.Connection, session: requests.Session,
+                         report: ValidationReport = None):
+    report = report or ValidationReport()
     # 祝日チェック：週次データが公表される可能性のある市場営業日のみ処理
     download_date = datetime.strptime(date_str, '%Y%m%d').date()
     if jpholiday.is_holiday(download_date): # 祝日チェック
@@ -211,11 +255,9 @@ def insert_weekly_margin(date_str: str, conn: sqlite3.Connection, session: reque
 
     try:
         original_cols = ["SC","公表日","信用取引区分","信用売残","信用売残 前週比","信用買残","信用買残 前週比","貸借倍率", "制度信用売残", "制度信用売残 前週比", "制度信用買残", "制度信用買残 前週比", "一般信用売残", "一般信用売残 前週比", "一般信用買残", "一般信用買残 前週比"]
-        
-        if len(df.columns) == len(original_cols):
-            df.columns = original_cols
-        else:
-            raise KeyError(f"カラム数不一致: CSV({len(df.columns)}) vs 期待値({len(original_cols)})")
+
+        # 列は位置ではなく列名で対応づける (並び替えられたファイルで売残・買残を取り違えないため)
+        df = align_header(df, [original_cols], '信用残')
 
         # --- 日付計算ロジック（祝日対応版）---
         # 1. 公表日（通常火曜など）から、データが指し示す「前週の金曜日」を計算
@@ -262,10 +304,15 @@ def insert_weekly_margin(date_str: str, conn: sqlite3.Connection, session: reque
         
         df = df[margin_db_cols]
 
+        checked = len(df)
+        df, issues = validate_margin(df)
+        quarantine(conn, report, '信用残', found_date_str, checked, issues)
+
+        df = to_compact_keys(df, conn)
         records = [tuple(row) for row in df.where(pd.notnull(df), None).itertuples(index=False)]
 
         conn.executemany(f"""
-            INSERT OR REPLACE INTO weekly_margin ({', '.join(margin_db_cols)}) 
+            INSERT OR REPLACE INTO weekly_margin_compact
             VALUES ({', '.join(['?'] * len(margin_db_cols))})
         """, records)
         print(f"  -> 信用残: {len(records)}件 処理完了 (データ日付: {found_date_str})")
@@ -276,7 +323,9 @@ def insert_weekly_margin(date_str: str, conn: sqlite3.Connection, session: reque
 
 
 # --- 4. 指標データ (東証インデックス、セクター別指数) ---
-def insert_daily_indices(date_str: str, conn: sqlite3.Connection, session: requests.Session):
+def insert_daily_indices(date_str: str, conn: sqlite3.Connection, session: requests.Session,
+                         report: ValidationReport = None):
+    report = report or ValidationReport()
     filename = f"tosho-index-data_{date_str}.csv"
     url = f"{KABU_PLUS_BASE_URL}tosho-index-data/daily/{filename}"
 
@@ -287,16 +336,11 @@ def insert_daily_indices(date_str: str, conn: sqlite3.Connection, session: reque
         # 🌟 ご提示いただいた正しい日本語ヘッダー名を使用
         original_cols = ["SC","指数名","日付","終値","前日比","前日比（％）","前日終値","時価総額（指数用・浮動株ベース）","時価総額前日比（同左）","前日時価総額（同左）","平均時価総額（同左）","基準時価総額","銘柄数","売買単位換算後株式数"]
 
-        # CSVのヘッダー数が合致するか確認
-        if len(df.columns) == len(original_cols):
-            df.columns = original_cols
-        else:
-            # ヘッダーの括弧がない可能性も考慮したチェック
-            alt_original_cols = ["SC","指数名","日付","終値","前日比","前日比（％）","前日終値","時価総額（指数用・浮動株ベース）","時価総額前日比","前日時価総額","平均時価総額","基準時価総額","銘柄数","売買単位換算後株式数"]
-            if len(df.columns) == len(alt_original_cols):
-                df.columns = alt_original_cols
-            else:
-                raise KeyError(f"カラム数不一致: CSV({len(df.columns)}) vs 期待値({len(original_cols)})")
+        # ヘッダーの括弧がない可能性も考慮したチェック
+        alt_original_cols = ["SC","指数名","日付","終値","前日比","前日比（％）","前日終値","時価総額（指数用・浮動株ベース）","時価総額前日比","前日時価総額","平均時価総額","基準時価総額","銘柄数","売買単位換算後株式数"]
+
+        # 列は位置ではなく列名で対応づける (どちらの表記のヘッダーにもない列があればファイルごと不正とみなす)
+        df = align_header(df, [original_cols, alt_original_cols], '業種別指数')
 
         # DBに格納するカラムとCSVヘッダー名のマッピング
         col_map = {
@@ -332,20 +376,29 @@ def insert_daily_indices(date_str: str, conn: sqlite3.Connection, session: reque
         # DB挿入順に並べ替え
         df = df[index_db_cols]
 
-        records = [tuple(row) for row in df.where(pd.notnull(df), None).itertuples(index=False)]
+        checked = len(df)
+        df, issues = validate_indices(df)
+        quarantine(conn, report, '業種別指数', date_str, checked, issues)
+
+        # 指数コードは TEXT のまま、日付のみ日番号に変換する
+        df = df.assign(date=date_to_day(date_str))
+        compact_cols = ['code', 'date', 'name', 'close', 'change_ratio', 'market_cap_index', 'volume', '銘柄数']
+        records = [tuple(row) for row in df[compact_cols].where(pd.notnull(df[compact_cols]), None).itertuples(index=False)]
 
         conn.executemany(f"""
-            INSERT OR REPLACE INTO daily_indices ({', '.join(index_db_cols)}) 
-            VALUES ({', '.join(['?'] * len(index_db_cols))})
+            INSERT OR REPLACE INTO daily_indices_compact
+            VALUES ({', '.join(['?'] * len(compact_cols))})
         """, records)
         print(f"  -> 業種別指数データ: {len(records)}件 処理完了")
         
     except Exception as e:
         print(f"  -> エラー(業種別指数データ): {e}")
 
-def run_daily_batch(start_date_str: str, end_date_str: str):
+def run_daily_batch(start_date_str: str, end_date_str: str, maintenance: bool = RUN_MAINTENANCE):
     """
     指定期間の日次/週次データをダウンロードし、データベースに格納するバッチ処理を実行
+    maintenance が True の場合は、格納後に軽い保守 (空きページ回収・統計更新) を実行する
+    (断片化の計測や整合性チェックは python -m src.db_maintenance で別途行う)
     """
     if not all([KABU_PLUS_USER, KABU_PLUS_PASSWORD]):
         print("❌ エラー: .envファイルにKABU_PLUS_USERまたはKABU_PLUS_PASSWORDが設定されていません。")
@@ -359,7 +412,11 @@ def run_daily_batch(start_date_str: str, end_date_str: str):
     
     dates = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
     
+    report = ValidationReport()
+
     with get_connection() as conn:
+        create_tables(conn)  # quarantine など後から追加したテーブルを既存DBにも作成
+        snapshot = CompanySnapshot.load(conn)
         for date in dates:
             date_str = date.strftime('%Y%m%d')
             
@@ -367,15 +424,21 @@ def run_daily_batch(start_date_str: str, end_date_str: str):
             if date.weekday() >= 5: continue
                 
             print(f"Processing: {date_str}")
-            insert_daily_prices(date_str, conn, session)
-            insert_daily_financials(date_str, conn, session)
-            insert_weekly_margin(date_str, conn, session)
-            insert_daily_indices(date_str, conn, session)
+            prices_df, price_rejected_codes = insert_daily_prices(date_str, conn, session, report, snapshot)
+            insert_daily_financials(date_str, conn, session, prices_df, report, price_rejected_codes)
+            insert_weekly_margin(date_str, conn, session, report)
+            insert_daily_indices(date_str, conn, session, report)
             
-            time.sleep(1) # サーバー負荷軽減
+            time.sleep(REQUEST_INTERVAL) # サーバー負荷軽減
         
+        report.save(conn)
         conn.commit()
-        print("\n=== ✅ 全処理完了 ===")
+        report.print_summary()
+
+    if maintenance:
+        steps = run_after_batch()['steps']
+        print("--- DB保守: " + ', '.join(f"{name} {s['seconds']:.2f}秒 ({s['result']})" for name, s in steps.items()) + " ---")
+    print("\n=== ✅ 全処理完了 ===")
 
 if __name__ == '__main__':
     # 確認のため、直近3日分だけ実行してデータが正しいか確認してください
@@ -0,0 +1,157 @@
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+# srcモジュールをインポートできるようにパスを追加
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.kabu_plus_stub import KabuPlusDataset
+from src import db_manager
+
+# 旧スキーマ (TEXT の code/date、rowid テーブル) とコンパクトスキーマの
+# ファイルサイズ・範囲検索速度を比較するベンチマーク。
+# 旧スキーマのDBをスタブデータから作成し、そのコピーを migrate_to_compact で移行して比較する。
+
+# 移行前のスキーマ (v0) 定義
+LEGACY_DDL = """
+    CREATE TABLE companies (code TEXT PRIMARY KEY, name TEXT, market TEXT, industry TEXT);
+    CREATE TABLE daily_prices (
+        code TEXT, date TEXT, open REAL, high REAL, low REAL, close REAL,
+        volume REAL, trading_value REAL, market_cap_total REAL, PRIMARY KEY (code, date));
+    CREATE TABLE daily_financials (
+        code TEXT, date TEXT, market_cap REAL, shares_outstanding REAL, per_forecast REAL, pbr_actual REAL,
+        eps_forecast REAL, bps_actual REAL, dividend_yield REAL, min_investment REAL, PRIMARY KEY (code, date));
+    CREATE TABLE weekly_margin (
+        code TEXT, date TEXT, sell_balance_total REAL, buy_balance_total REAL, ratio REAL,
+        sell_balance_ins REAL, buy_balance_ins REAL, sell_balance_gen REAL, buy_balance_gen REAL, PRIMARY KEY (code, date));
+    CREATE TABLE daily_indices (
+        code TEXT NOT NULL, name TEXT, date TEXT NOT NULL, close REAL, change_ratio REAL,
+        market_cap_index REAL, volume REAL, 銘柄数 INTEGER, PRIMARY KEY (code, date));
+"""
+
+
+def build_legacy_db(path: str, dataset: KabuPlusDataset, end: datetime, days: int):
+    """スタブデータから旧スキーマのDBを作成する (バッチと同じく日付順に書き込む)"""
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_DDL)
+    conn.executemany("INSERT INTO companies VALUES (?, ?, ?, ?)",
+                     zip(dataset.codes, dataset.names, dataset.markets, dataset.industries))
+
+    d = end.date() - timedelta(days=int(days * 1.5))
+    written = 0
+    while d <= end.date():
+        if d.weekday() < 5:
+            date_str = d.strftime('%Y%m%d')
+            p = dataset.prices_frame(d)
+            p = p[p['株価'] != '-']
+            conn.executemany("INSERT INTO daily_prices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", zip(
+                p['SC'], [date_str] * len(p), p['始値'].astype(float), p['高値'].astype(float),
+                p['安値'].astype(float), p['株価'].astype(float), p['出来高'], p['売買代金（千円）'], p['時価総額（百万円）']))
+
+            f = dataset.financials_frame(d)
+            conn.executemany("INSERT INTO daily_financials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", zip(
+                f['SC'], [date_str] * len(f), f['時価総額（百万円）'], f['発行済株式数'], f['PER（予想）'],
+                f['PBR（実績）'], f['EPS（予想）'], f['BPS（実績）'], f['配当利回り（予想）'], f['最低投資金額']))
+
+            if d.weekday() == 1:
+                m = dataset.margin_frame(d)
+                conn.executemany("INSERT INTO weekly_margin VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", zip(
+                    m['SC'], [date_str] * len(m), m['信用売残'], m['信用買残'], m['貸借倍率'],
+                    m['制度信用売残'], m['制度信用買残'], m['一般信用売残'], m['一般信用買残']))
+
+            i = dataset.indices_frame(d)
+            conn.executemany("INSERT INTO daily_indices VALUES (?, ?, ?, ?, ?, ?, ?, ?)", zip(
+                i['SC'], i['指数名'], [date_str] * len(i), i['終値'], i['前日比（％）'],
+                i['時価総額（指数用・浮動株ベース）'], i['売買単位換算後株式数'], i['銘柄数']))
+            conn.commit()
+            written += 1
+            if written >= days:
+                break
+        d += timedelta(days=1)
+    conn.close()
+
+
+def _time_queries(path: str, queries: list, repeat: int) -> float:
+    """(SQL, params) のリストを repeat 回実行した平均時間 (ms)"""
+    conn = sqlite3.connect(path)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for sql, params in queries:
+            conn.execute(sql, params).fetchall()
+    elapsed = (time.perf_counter() - t0) * 1000 / (repeat * len(queries))
+    conn.close()
+    return elapsed
+
+
+def measure(path: str, compact: bool, codes: list, dates: list, repeat: int) -> dict:
+    """ファイルサイズ (未チェックポイントの -wal を含む) と代表的な範囲検索の速度を計測する"""
+    size = sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+    result = {'size_mb': round(size / 1024 / 1024, 2)}
+
+    if compact:
+        with sqlite3.connect(path) as conn:
+            ids = dict(conn.execute("SELECT code, code_id FROM companies").fetchall())
+        history = [("SELECT day, close_x10 FROM daily_prices_compact WHERE code_id = ? ORDER BY day", (ids[c],)) for c in codes]
+        cross = [("SELECT code_id, close_x10 FROM daily_prices_compact WHERE day = ?", (db_manager.date_to_day(d),)) for d in dates]
+        view = [("SELECT date, close FROM daily_prices WHERE code = ? ORDER BY date", (c,)) for c in codes]
+        result['view_history_ms'] = round(_time_queries(path, view, repeat), 3)
+    else:
+        history = [("SELECT date, close FROM daily_prices WHERE code = ? ORDER BY date", (c,)) for c in codes]
+        cross = [("SELECT code, close FROM daily_prices WHERE date = ?", (d,)) for d in dates]
+
+    result['code_history_ms'] = round(_time_queries(path, history, repeat), 3)
+    result['date_cross_section_ms'] = round(_time_queries(path, cross, repeat), 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='旧スキーマとコンパクトスキーマのサイズ・範囲検索速度を比較する')
+    parser.add_argument('--codes', type=int, default=4000)
+    parser.add_argument('--days', type=int, default=60, help='作成する営業日数')
+    parser.add_argument('--end-date', default='20240628')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    dataset = KabuPlusDataset(n_codes=args.codes, seed=args.seed)
+    end = datetime.strptime(args.end_date, '%Y%m%d')
+    rng = random.Random(args.seed)
+    sample_codes = rng.sample(list(dataset.codes), 50)
+
+    with tempfile.TemporaryDirectory(prefix='stock_schema_') as workdir:
+        legacy_path = os.path.join(workdir, 'legacy.db')
+        compact_path = os.path.join(workdir, 'compact.db')
+
+        print(f"=== 旧スキーマのDBを作成: {args.codes}銘柄 x {args.days}営業日 ===")
+        build_legacy_db(legacy_path, dataset, end, args.days)
+        with sqlite3.connect(legacy_path) as conn:
+            dates = [r[0] for r in conn.execute("SELECT DISTINCT date FROM daily_indices ORDER BY date")]
+        sample_dates = rng.sample(dates, min(5, len(dates)))
+
+        shutil.copyfile(legacy_path, compact_path)
+        t0 = time.perf_counter()
+        conn = sqlite3.connect(compact_path)
+        db_manager.create_tables(conn)  # 旧スキーマを検出して移行する
+        # create_tables は WAL モードに切り替えるため、移行した内容をDB本体に書き戻してから閉じる
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        migrate_sec = time.perf_counter() - t0
+
+        before = measure(legacy_path, False, sample_codes, sample_dates, args.repeat)
+        after = measure(compact_path, True, sample_codes, sample_dates, args.repeat)
+
+    print(f"\n移行時間: {migrate_sec:.1f}秒")
+    table = pd.DataFrame({'旧スキーマ': before, 'コンパクト': after})
+    table['比率'] = (table['コンパクト'] / table['旧スキーマ']).round(2)
+    print(table.to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,602 @@
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# srcモジュールをインポートできるようにパスを追加
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.kabu_plus_stub import KabuPlusDataset, serve_stub
+from src.gemini_stub import StubGeminiClient
+
+# 再現可能なベンチマーク。
+# ローカルの株・プラス スタブからバックフィルを行い、DBサイズと /analyze 相当の処理のレイテンシを計測する。
+# 結果はコミットごとに履歴ファイルへ追記し、直前の別コミットと比較して劣化を検出する。
+
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'benchmark_history.jsonl')
+STUB_USER = 'bench'
+STUB_PASSWORD = 'bench'
+
+# 指標名 -> 大きいほど良いか
+METRICS = {
+    'backfill_seconds': False,
+    'backfill_rows_per_sec': True,
+    'db_size_mb': False,
+    'peak_rss_backfill_mb': False,
+    'maintenance_seconds': False,
+    'analyze_p50_ms': False,
+    'analyze_p95_ms': False,
+    'peak_rss_analyze_mb': False,
+    'prompt_tokens': False,
+    'prompt_stub_latency_ms': False,
+    'first_text_ms_streaming': False,
+    'compare_ms': False,
+    'quote_upstream_calls': False,
+    'quote_p95_ms': False,
+    'workers_rps': True,
+    'shared_cache_warm_rps': True,
+}
+
+
+def _peak_rss_mb() -> float:
+    """プロセスの最大常駐メモリ (MB)。Linux の ru_maxrss はKB単位"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 if sys.platform != 'darwin' else peak / 1024 / 1024, 1)
+
+
+def _percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    return statistics.quantiles(ordered, n=100, method='inclusive')[int(q) - 1]
+
+
+def _git_commit() -> str:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except Exception:
+        return 'unknown'
+
+
+def _business_day_range(end_date: datetime, days: int):
+    """end_date を含む直近 days 営業日 (土日除く) の開始日を返す"""
+    start = end_date
+    count = 1 if end_date.weekday() < 5 else 0
+    while count < days:
+        start -= timedelta(days=1)
+        if start.weekday() < 5:
+            count += 1
+    return start
+
+
+def _db_size_mb(db_path: str) -> float:
+    size = sum(os.path.getsize(p) for p in (db_path, db_path + '-wal') if os.path.exists(p))
+    return round(size / 1024 / 1024, 2)
+
+
+# --- 1. バックフィル ---
+def bench_backfill(base_url: str, start: datetime, end: datetime) -> dict:
+    from src import batch_loader, db_manager
+
+    batch_loader.KABU_PLUS_BASE_URL = base_url
+    batch_loader.KABU_PLUS_USER = STUB_USER
+    batch_loader.KABU_PLUS_PASSWORD = STUB_PASSWORD
+    batch_loader.REQUEST_INTERVAL = 0
+
+    db_manager.initialize_db()
+
+    t0 = time.perf_counter()
+    batch_loader.run_daily_batch(start.strftime('%Y%m%d'), end.strftime('%Y%m%d'), maintenance=False)
+    elapsed = time.perf_counter() - t0
+
+    with db_manager.get_connection() as conn:
+        rows = sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                   for table in ('daily_prices_compact', 'daily_financials_compact', 'weekly_margin_compact', 'daily_indices_compact'))
+
+    return {
+        'backfill_seconds': round(elapsed, 2),
+        'backfill_rows': rows,
+        'backfill_rows_per_sec': round(rows / elapsed, 1) if elapsed else 0.0,
+        'db_size_mb': _db_size_mb(db_manager.DB_PATH),
+        'peak_rss_backfill_mb': _peak_rss_mb(),
+    }
+
+
+def bench_maintenance() -> dict:
+    """
+    バックフィル直後のDBに、バッチ後の保守の所要時間を計測し、
+    詳細モードの保守ジョブで断片化・キャッシュカバー率 (推定) を計測する
+    """
+    from src.db_maintenance import run_after_batch, run_maintenance
+
+    t0 = time.perf_counter()
+    run_after_batch(retention_days=0)
+    elapsed = time.perf_counter() - t0
+    report = run_maintenance(retention_days=0, detailed=True)
+    prices = report['after']['tables'].get('daily_prices_compact', {})
+    return {
+        'maintenance_seconds': round(elapsed, 2),
+        'prices_out_of_order': prices.get('out_of_order'),
+        'cache_coverage_estimate': report['cache_coverage_estimate'],
+    }
+
+
+# --- 2. /analyze 相当の処理 ---
+def run_analyze_pipeline(code: str) -> dict:
+    """main.on_message の /analyze と同じ順序でデータ取得・チャート生成・AI分析を行う"""
+    from src.data_loader import fetch_data
+    from src.chart_generator import generate_charts
+    from src.analyzer import generate_analysis
+
+    analysis_data = fetch_data(code)
+    if analysis_data.get("error"):
+        return analysis_data
+
+    chart_info = generate_charts(analysis_data['stock_data'], code)
+    return generate_analysis(
+        company_name=analysis_data["company_name"],
+        code=code,
+        summary=analysis_data['company_summary'],
+        stock_data=analysis_data['stock_data'],
+        financial_data=analysis_data['financial_data'],
+        chart_buffer=chart_info['file'],
+        margin_data=analysis_data['margin_data'],
+        sector_data=analysis_data['sector_data']
+    )
+
+
+def bench_analyze(codes: list, runs: int, gemini_latency: float, latency_per_1k: float, seed: int) -> dict:
+    from src import analyzer
+
+    stub = StubGeminiClient(latency=gemini_latency, latency_per_1k_tokens=latency_per_1k)
+    analyzer.client = stub
+
+    rng = random.Random(seed)
+    targets = [rng.choice(codes) for _ in range(runs)]
+
+    run_analyze_pipeline(targets[0])  # ウォームアップ (フォント・モジュールの初回ロード)
+
+    latencies = []
+    for code in targets:
+        t0 = time.perf_counter()
+        result = run_analyze_pipeline(code)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if result.get("error"):
+            raise RuntimeError(f"/analyze {code} が失敗しました: {result['error']}")
+
+    return {
+        'analyze_runs': runs,
+        'analyze_p50_ms': round(_percentile(latencies, 50), 1),
+        'analyze_p95_ms': round(_percentile(latencies, 95), 1),
+        'analyze_prompt_chars': stub.calls[-1]['prompt_chars'] if stub.calls else 0,
+        'peak_rss_analyze_mb': _peak_rss_mb(),
+    }
+
+
+# --- 3. プロンプトサイズ (旧形式との比較) ---
+def legacy_prompt_contents(analysis_data: dict, chart_buffer) -> list:
+    """prompt_builder 導入前の形式 (財務データのMarkdown表 + 原寸PNG) の contents を組み立てる"""
+    from google.genai import types
+
+    stock_data = analysis_data['stock_data']
+    user_prompt = f"""
+    ### 銘柄分析レポート作成依頼
+
+    **銘柄名:** {analysis_data['company_name']}
+    **企業概要:** {analysis_data['company_summary']}
+    **現在の株価:** {stock_data['Close'].iloc[-1]:.2f} 円
+    **過去90日間の平均株価:** {stock_data['Close'].iloc[-90:].mean():.2f} 円
+
+    **【財務データ (過去5年間の主要指標)】**
+    {analysis_data['financial_data'].to_markdown(index=False)}
+
+    **【分析依頼事項】**
+    1.  **株価動向の評価 (テクニカル):** 提供されたチャート画像（ローソク足とRSI）を見て、現在の株価トレンド（上昇/下降/レンジ）と、短期的な売買シグナル（RSIなど）を評価してください。
+    2.  **財務健全性の評価 (ファンダメンタルズ):** 財務データ（売上、利益、EPS、PER、ROE）の推移を見て、企業の成長性、収益性、割安感を評価してください。
+    3.  **総合的な見解:** 上記を踏まえ、この銘柄に対する総合的な投資見解（強気/中立/弱気）と、その理由を簡潔にまとめてください。
+    """
+    return [types.Part.from_bytes(data=chart_buffer.getvalue(), mime_type='image/png'), user_prompt]
+
+
+def prompt_variants(analysis_data: dict, chart_buffer, system_prompt: str = '') -> dict:
+    """同じ入力から旧形式 ('legacy') と prompt_builder ('compact') の contents を組み立てる"""
+    from google.genai import types
+    from src.prompt_builder import build_prompt
+
+    prompt = build_prompt(
+        company_name=analysis_data['company_name'], code=analysis_data['code'], summary=analysis_data['company_summary'],
+        stock_data=analysis_data['stock_data'], financial_data=analysis_data['financial_data'],
+        chart_buffer=chart_buffer, margin_data=analysis_data['margin_data'],
+        sector_data=analysis_data['sector_data'], system_prompt=system_prompt
+    )
+    return {
+        'legacy': legacy_prompt_contents(analysis_data, chart_buffer),
+        'compact': ([types.Part.from_bytes(data=prompt['image'], mime_type='image/png')] if prompt['image'] else []) + [prompt['text']],
+    }
+
+
+def bench_prompt(code: str, gemini_latency: float, latency_per_1k: float) -> dict:
+    """同じ入力で旧形式と prompt_builder のプロンプトサイズ・スタブ応答時間を比較する"""
+    from src.data_loader import fetch_data
+    from src.chart_generator import generate_charts
+    from src.prompt_builder import estimate_contents_tokens
+    from src.analyzer import SYSTEM_PROMPT
+
+    analysis_data = fetch_data(code)
+    chart_buffer = generate_charts(analysis_data['stock_data'], code)['file']
+    stub = StubGeminiClient(latency=gemini_latency, latency_per_1k_tokens=latency_per_1k)
+    variants = prompt_variants({**analysis_data, 'code': code}, chart_buffer, SYSTEM_PROMPT)
+
+    result = {}
+    for name, contents in variants.items():
+        t0 = time.perf_counter()
+        stub.models.generate_content(model='stub', contents=contents)
+        result[name] = {
+            'tokens': estimate_contents_tokens(contents),
+            'latency_ms': round((time.perf_counter() - t0) * 1000, 1),
+        }
+
+    print("\n=== プロンプト比較 (旧形式 -> prompt_builder) ===")
+    for key in ('tokens', 'latency_ms'):
+        print(f"  {key:<12} {result['legacy'][key]:>8} -> {result['compact'][key]:>8}")
+
+    return {
+        'prompt_tokens_legacy': result['legacy']['tokens'],
+        'prompt_tokens': result['compact']['tokens'],
+        'prompt_stub_latency_ms': result['compact']['latency_ms'],
+    }
+
+
+def bench_compare(codes: list, gemini_latency: float, latency_per_1k: float) -> dict:
+    """N銘柄を1銘柄ずつ分析した場合と、まとめて比較レポートを作成した場合の所要時間・リクエスト数を比較する"""
+    from src import analyzer
+    from src.data_loader import fetch_multiple
+    from src.chart_generator import generate_charts_batch
+
+    stub = StubGeminiClient(latency=gemini_latency, latency_per_1k_tokens=latency_per_1k)
+    analyzer.client = stub
+
+    # 逐次: /analyze を銘柄数だけ繰り返す
+    t0 = time.perf_counter()
+    for code in codes:
+        result = run_analyze_pipeline(code)
+        if result.get("error"):
+            raise RuntimeError(f"/analyze {code} が失敗しました: {result['error']}")
+    sequential_ms = (time.perf_counter() - t0) * 1000
+    sequential_calls = len(stub.calls)
+    sequential_tokens = sum(c['prompt_tokens'] for c in stub.calls)
+
+    # 一括: 1回のDB読み出し + 並列描画 + 1回の比較リクエスト
+    stub.calls.clear()
+    t0 = time.perf_counter()
+    data = fetch_multiple(codes)['results']
+    charts = generate_charts_batch({code: data[code]['stock_data'] for code in codes})
+    result = analyzer.generate_comparison([
+        {"company_name": data[code]['company_name'], "code": code, "summary": data[code]['company_summary'],
+         "stock_data": data[code]['stock_data'], "financial_data": data[code]['financial_data'],
+         "chart_buffer": charts[code]['file'], "margin_data": data[code]['margin_data'],
+         "sector_data": data[code]['sector_data']}
+        for code in codes
+    ])
+    if result.get("error"):
+        raise RuntimeError(f"/compare が失敗しました: {result['error']}")
+    compare_ms = (time.perf_counter() - t0) * 1000
+
+    print(f"\n=== 複数銘柄の分析 ({len(codes)}銘柄: 逐次 -> 比較レポート) ===")
+    print(f"  {'elapsed_ms':<14} {sequential_ms:>8.1f} -> {compare_ms:>8.1f}")
+    print(f"  {'gemini_calls':<14} {sequential_calls:>8} -> {len(stub.calls):>8}")
+    print(f"  {'prompt_tokens':<14} {sequential_tokens:>8} -> {stub.calls[-1]['prompt_tokens']:>8}")
+
+    return {
+        'compare_sequential_ms': round(sequential_ms, 1),
+        'compare_ms': round(compare_ms, 1),
+        'compare_prompt_tokens': stub.calls[-1]['prompt_tokens'],
+    }
+
+
+def bench_quotes(dataset, as_of: datetime, requests: int, upstream_latency: float, seed: int) -> dict:
+    """
+    同時に届いた requests 件のコマンド (1〜3銘柄ずつ) の気配取得について、
+    キャッシュなし (リクエストごとに上流を呼ぶ) と QuoteCache の上流呼び出し回数・レイテンシを比較する。
+    """
+    import asyncio
+    from src.quote_provider import StubQuoteProvider, QuoteCache
+
+    rng = random.Random(seed)
+    popular = list(dataset.codes[:30])  # 人気銘柄に要求が集中する想定
+    bursts = [rng.sample(popular, rng.randint(1, 3)) for _ in range(requests)]
+
+    async def timed(coro_factory, target):
+        latencies = []
+
+        async def one(codes):
+            t0 = time.perf_counter()
+            await coro_factory(target, codes)
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+        await asyncio.gather(*(one(codes) for codes in bursts))
+        return latencies
+
+    result = {}
+    provider = StubQuoteProvider(dataset, as_of.date(), latency=upstream_latency)
+    latencies = asyncio.run(timed(lambda p, codes: asyncio.to_thread(p.fetch_quotes, codes), provider))
+    result['direct'] = (len(provider.calls), _percentile(latencies, 95))
+
+    provider = StubQuoteProvider(dataset, as_of.date(), latency=upstream_latency)
+    cache = QuoteCache(provider)
+    latencies = asyncio.run(timed(lambda c, codes: c.get_quotes(codes), cache))
+    result['cached'] = (cache.upstream_calls, _percentile(latencies, 95))
+
+    print(f"\n=== 気配の取得 ({requests}件の同時リクエスト: キャッシュなし -> QuoteCache) ===")
+    print(f"  {'upstream_calls':<14} {result['direct'][0]:>8} -> {result['cached'][0]:>8}")
+    print(f"  {'p95_ms':<14} {result['direct'][1]:>8.1f} -> {result['cached'][1]:>8.1f}")
+
+    return {
+        'quote_upstream_calls_direct': result['direct'][0],
+        'quote_upstream_calls': result['cached'][0],
+        'quote_p95_ms': round(result['cached'][1], 1),
+    }
+
+
+class _FakeMessage:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content):
+        self.content = content
+        self.channel.edits += 1
+
+
+class _FakeChannel:
+    """discord のチャンネルの代替。最初にテキストが表示された時刻と送信・編集回数を記録する"""
+
+    def __init__(self):
+        self.messages = []
+        self.edits = 0
+        self.first_text_at = None
+
+    async def send(self, content):
+        if self.first_text_at is None:
+            self.first_text_at = time.perf_counter()
+        msg = _FakeMessage(self, content)
+        self.messages.append(msg)
+        return msg
+
+
+def bench_streaming(gemini_latency: float, first_token_latency: float) -> dict:
+    """一括送信とストリーミング表示で、最初のAIテキストが表示されるまでの時間を比較する"""
+    import asyncio
+    from src.gemini_stub import DEFAULT_REPORT
+    from src.discord_stream import deliver_stream, split_message, DISCORD_MESSAGE_LIMIT
+
+    # 2,000文字を超える長いレポートで分割送信も確認する
+    report = DEFAULT_REPORT * 15
+    stub = StubGeminiClient(latency=gemini_latency, report=report, first_token_latency=first_token_latency)
+
+    async def blocking(channel):
+        response = await asyncio.to_thread(stub.models.generate_content, model='stub', contents='prompt')
+        for piece in split_message(response.text):
+            await channel.send(piece)
+
+    async def streaming(channel):
+        stream = (chunk.text for chunk in stub.models.generate_content_stream(model='stub', contents='prompt'))
+        await deliver_stream(channel, stream)
+
+    result = {}
+    for name, func in (('blocking', blocking), ('streaming', streaming)):
+        channel = _FakeChannel()
+        t0 = time.perf_counter()
+        asyncio.run(func(channel))
+        total = time.perf_counter() - t0
+        shown = '\n'.join(m.content for m in channel.messages)
+        assert all(len(m.content) <= DISCORD_MESSAGE_LIMIT for m in channel.messages)
+        assert shown.replace('\n', '') == report.replace('\n', '')
+        result[name] = {
+            'first_text_ms': round((channel.first_text_at - t0) * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'messages': len(channel.messages),
+            'edits': channel.edits,
+        }
+
+    print(f"\n=== ストリーミング比較 (レポート{len(report)}文字, 最初のトークン {first_token_latency}s / 生成 {gemini_latency}s) ===")
+    for key in ('first_text_ms', 'total_ms', 'messages', 'edits'):
+        print(f"  {key:<14} {result['blocking'][key]:>8} -> {result['streaming'][key]:>8}")
+
+    return {
+        'first_text_ms_blocking': result['blocking']['first_text_ms'],
+        'first_text_ms_streaming': result['streaming']['first_text_ms'],
+        'stream_messages': result['streaming']['messages'],
+    }
+
+
+def _analyze_cached(code: str) -> float:
+    """main.analyze_codes と同じ経路 (共有キャッシュを使う関数) で1銘柄を分析し、所要時間 (ms) を返す"""
+    from src.data_loader import fetch_multiple
+    from src.chart_generator import generate_charts_batch
+    from src.analyzer import generate_analysis
+
+    t0 = time.perf_counter()
+    data = fetch_multiple([code])['results'][code]
+    chart = generate_charts_batch({code: data['stock_data']})[code]
+    result = generate_analysis(
+        company_name=data['company_name'], code=code, summary=data['company_summary'],
+        stock_data=data['stock_data'], financial_data=data['financial_data'],
+        chart_buffer=chart['file'], margin_data=data['margin_data'], sector_data=data['sector_data']
+    )
+    if result.get("error"):
+        raise RuntimeError(f"/analyze {code} が失敗しました: {result['error']}")
+    return (time.perf_counter() - t0) * 1000
+
+
+def _run_workers(targets: list, processes: int) -> float:
+    """targets を processes 個のプロセス (シャード相当) で分担して処理し、スループット (件/秒) を返す"""
+    import multiprocessing
+    context = multiprocessing.get_context('fork')
+    t0 = time.perf_counter()
+    with context.Pool(processes) as pool:
+        pool.map(_analyze_cached, targets, chunksize=1)
+    return len(targets) / (time.perf_counter() - t0)
+
+
+def bench_workers(codes: list, requests: int, processes: int, gemini_latency: float, latency_per_1k: float,
+                  cache_path: str, seed: int) -> dict:
+    """
+    /analyze のスループットを 1プロセスと processes プロセスで比較し、
+    さらに共有キャッシュを有効にして、別プロセスが作った結果を再利用した場合のスループットを計測する。
+    """
+    from src import analyzer, shared_cache
+
+    analyzer.client = StubGeminiClient(latency=gemini_latency, latency_per_1k_tokens=latency_per_1k)
+
+    rng = random.Random(seed)
+    targets = [rng.choice(codes) for _ in range(requests)]
+
+    # プロセス数によるスケーリング (キャッシュなし)
+    shared_cache.configure(max_mb=0)
+    single_rps = _run_workers(targets, 1)
+    multi_rps = _run_workers(targets, processes)
+
+    # 共有キャッシュ: 1巡目で各プロセスが書き込み、2巡目は担当が入れ替わっても他プロセスの結果を読む
+    cache = shared_cache.configure(path=cache_path)
+    cold_rps = _run_workers(targets, processes)
+    warm_rps = _run_workers(list(reversed(targets)), processes)
+    entries = cache._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+    shared_cache.configure(max_mb=0)
+
+    print(f"\n=== 複数プロセス ({requests}件, CPU {os.cpu_count()}) ===")
+    print(f"  {'1 process':<22} {single_rps:>8.2f} req/s")
+    print(f"  {f'{processes} processes':<22} {multi_rps:>8.2f} req/s (x{multi_rps / single_rps:.2f})")
+    print(f"  {'shared cache (cold)':<22} {cold_rps:>8.2f} req/s")
+    print(f"  {'shared cache (warm)':<22} {warm_rps:>8.2f} req/s ({entries[0]}件, {entries[1] / 1024 / 1024:.1f}MB)")
+
+    return {
+        'workers_single_rps': round(single_rps, 2),
+        'workers_rps': round(multi_rps, 2),
+        'shared_cache_warm_rps': round(warm_rps, 2),
+    }
+
+
+# --- 4. 履歴の記録と比較 ---
+def load_history(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare_with_previous(record: dict, history: list, threshold: float) -> list:
+    """
+    同じパラメータで計測した直前の別コミットと比較し、threshold を超えて悪化した指標を返す。
+    """
+    previous = next((h for h in reversed(history)
+                     if h['params'] == record['params'] and h['commit'] != record['commit']), None)
+    if previous is None:
+        print("\n(比較対象となる過去の計測結果がありません)")
+        return []
+
+    print(f"\n=== 比較: {previous['commit']} -> {record['commit']} ===")
+    regressions = []
+    for name, higher_is_better in METRICS.items():
+        old, new = previous['metrics'].get(name), record['metrics'].get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        mark = '❌' if worse > threshold else ('✅' if worse < -threshold else '  ')
+        print(f"  {mark} {name:<24} {old:>12} -> {new:>12} ({change:+.1%})")
+        if worse > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ローカルスタブを使った再現可能なベンチマーク')
+    parser.add_argument('--codes', type=int, default=4000, help='生成する銘柄数')
+    parser.add_argument('--days', type=int, default=20, help='バックフィルする営業日数')
+    parser.add_argument('--end-date', default='20240628', help='バックフィル最終日 (YYYYMMDD)')
+    parser.add_argument('--analyze-runs', type=int, default=20, help='/analyze の計測回数')
+    parser.add_argument('--gemini-latency', type=float, default=0.05, help='Geminiスタブの応答遅延 (秒)')
+    parser.add_argument('--gemini-latency-per-1k', type=float, default=0.1, help='Geminiスタブの入力1,000トークンあたりの追加遅延 (秒)')
+    parser.add_argument('--compare-codes', type=int, default=3, help='比較レポートの計測に使う銘柄数')
+    parser.add_argument('--quote-requests', type=int, default=50, help='気配取得の同時リクエスト数')
+    parser.add_argument('--quote-latency', type=float, default=0.2, help='気配スタブの上流呼び出し1回あたりの遅延 (秒)')
+    parser.add_argument('--stream-latency', type=float, default=2.0, help='ストリーミング比較でのレポート全体の生成時間 (秒)')
+    parser.add_argument('--stream-first-token-latency', type=float, default=0.3, help='ストリーミング比較での最初のトークンまでの遅延 (秒)')
+    parser.add_argument('--worker-requests', type=int, default=24, help='複数プロセスの計測で処理する /analyze の件数')
+    parser.add_argument('--worker-processes', type=int, default=4, help='複数プロセスの計測で起動するプロセス数')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--history', default=HISTORY_PATH, help='計測履歴 (JSON Lines)')
+    parser.add_argument('--threshold', type=float, default=0.10, help='劣化とみなす変化率')
+    parser.add_argument('--no-record', action='store_true', help='履歴に追記しない')
+    parser.add_argument('--fail-on-regression', action='store_true', help='劣化があれば終了コード1で終了')
+    args = parser.parse_args()
+
+    params = {k: getattr(args, k) for k in ('codes', 'days', 'end_date', 'analyze_runs', 'gemini_latency',
+                                            'gemini_latency_per_1k', 'compare_codes', 'quote_requests',
+                                            'quote_latency', 'stream_latency', 'stream_first_token_latency',
+                                            'worker_requests', 'worker_processes', 'seed')}
+    dataset = KabuPlusDataset(n_codes=args.codes, seed=args.seed)
+    end = datetime.strptime(args.end_date, '%Y%m%d')
+    start = _business_day_range(end, args.days)
+
+    with tempfile.TemporaryDirectory(prefix='stock_bench_') as workdir:
+        # DBは一時ディレクトリに作成し、本番DBには触れない
+        from src import db_manager
+        db_manager.DB_PATH = os.path.join(workdir, 'stock_data.db')
+        # 共有キャッシュは bench_workers 以外では使わない (毎回キャッシュなしの処理時間を計測する)
+        from src import shared_cache
+        shared_cache.configure(max_mb=0)
+
+        with serve_stub(dataset, STUB_USER, STUB_PASSWORD) as base_url:
+            print(f"=== ベンチマーク: {args.codes}銘柄 x {args.days}営業日 (stub: {base_url}) ===")
+            metrics = bench_backfill(base_url, start, end)
+        metrics.update(bench_maintenance())
+
+        metrics.update(bench_analyze(list(dataset.codes), args.analyze_runs, args.gemini_latency,
+                                     args.gemini_latency_per_1k, args.seed))
+        metrics.update(bench_prompt(dataset.codes[0], args.gemini_latency, args.gemini_latency_per_1k))
+        metrics.update(bench_compare(list(dataset.codes[:args.compare_codes]), args.gemini_latency,
+                                     args.gemini_latency_per_1k))
+        metrics.update(bench_quotes(dataset, end, args.quote_requests, args.quote_latency, args.seed))
+        metrics.update(bench_streaming(args.stream_latency, args.stream_first_token_latency))
+        metrics.update(bench_workers(list(dataset.codes), args.worker_requests, args.worker_processes,
+                                     args.gemini_latency, args.gemini_latency_per_1k,
+                                     os.path.join(workdir, 'cache.db'), args.seed))
+
+    record = {
+        'commit': _git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'params': params,
+        'metrics': metrics,
+    }
+
+    print("\n=== 計測結果 ===")
+    for name, value in metrics.items():
+        print(f"  {name:<24} {value}")
+
+    history = load_history(args.history)
+    regressions = compare_with_previous(record, history, args.threshold)
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(args.history), exist_ok=True)
+        with open(args.history, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        print(f"\n✅ 計測結果を記録しました: {args.history}")
+
+    if regressions:
+        print(f"❌ 性能劣化を検出: {', '.join(regressions)}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,13 @@
 import os
 import io
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import mplfinance as mpf
 import pandas as pd
 from datetime import datetime
 import matplotlib.pyplot as plt
+from src.shared_cache import get_cache
 
 def generate_charts(data: pd.DataFrame, code: str) -> dict:
     """
@@ -71,4 +75,73 @@ def generate_charts(data: pd.DataFrame, code: str) -> dict:
         "filename": filename_candle
     }
 
+# 複数銘柄のチャートを並列に描画するワーカー数 (matplotlib はスレッドセーフでないためプロセスで並列化)
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', str(min(4, os.cpu_count() or 1))))
+CHART_CACHE_TTL = 6 * 3600  # 共有キャッシュに置くチャート画像の有効期間 (秒)
+_pool = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """描画用のプロセスプールを返す (初回のみ作成し、以降のコマンドで使い回す)"""
+    global _pool
+    if _pool is None:
+        # スレッドが動いているプロセスからも安全に起動できるよう spawn を使う
+        # (main.py はモジュール読み込み時に Bot を起動しないため、子プロセスでの再読み込みは問題ない)
+        context = multiprocessing.get_context('spawn')
+        _pool = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=context)
+    return _pool
+
+
+def _warm_up():
+    """何もしない。子プロセスでこのモジュール (matplotlib を含む) を読み込ませるために投入する"""
+
+
+def start_pool():
+    """
+    描画用のワーカーを起動しておく。子プロセスでの matplotlib の読み込みを Bot の起動時に済ませ、
+    最初のコマンドで待たないようにする。
+    """
+    if CHART_WORKERS > 1:
+        pool = _get_pool()
+        for future in [pool.submit(_warm_up) for _ in range(CHART_WORKERS)]:
+            future.result()
+
+
+def _chart_key(data: pd.DataFrame, code: str) -> str:
+    """株価データの内容から共有キャッシュのキーを作る (同じデータなら同じチャートになる)"""
+    values = pd.util.hash_pandas_object(data[['Open', 'High', 'Low', 'Close', 'Volume']], index=True).values
+    return f"chart:{code}:{hashlib.sha1(values.tobytes()).hexdigest()}"
+
+
+def generate_charts_batch(stock_data_by_code: dict) -> dict:
+    """
+    複数銘柄のチャートを並列に生成する。他のプロセス (シャード) が同じデータで描画済みの銘柄は共有キャッシュから返す。
+
+    Args:
+        stock_data_by_code: {証券コード: 株価データ}
+
+    Returns:
+        {証券コード: generate_charts と同じ形式の辞書} (入力と同じ順序)
+    """
+    cache = get_cache()
+    keys = {code: _chart_key(data, code) for code, data in stock_data_by_code.items()}
+    charts = {}
+    for code, key in keys.items():
+        cached = cache.get(key)
+        if cached is not None:
+            charts[code] = {"file": io.BytesIO(cached['png']), "filename": cached['filename']}
+
+    todo = {code: data for code, data in stock_data_by_code.items() if code not in charts}
+    if len(todo) <= 1 or CHART_WORKERS <= 1:
+        rendered = {code: generate_charts(data, code) for code, data in todo.items()}
+    else:
+        pool = _get_pool()
+        futures = {code: pool.submit(generate_charts, data, code) for code, data in todo.items()}
+        rendered = {code: future.result() for code, future in futures.items()}
+
+    for code, info in rendered.items():
+        cache.set(keys[code], {'png': info['file'].getvalue(), 'filename': info['filename']}, CHART_CACHE_TTL)
+    charts.update(rendered)
+    return {code: charts[code] for code in stock_data_by_code}
+
 # if __name__でのテストコードは省略
@@ -0,0 +1,124 @@
+import sqlite3
+
+import pandas as pd
+
+from src.db_manager import get_code_ids, date_to_day
+
+# 銘柄マスタ (companies) と属性履歴 (company_history) の管理。
+# 株価CSVには毎日全銘柄の社名・市場・業種が載るが、実際に変わるのはごく一部なので、
+# メモリ上のスナップショットとベクトル化した差分を取り、変化があった銘柄だけを書き込む。
+
+ATTRS = ['name', 'market', 'industry']
+
+
+class CompanySnapshot:
+    """
+    現行の銘柄属性 (index: code, columns: code_id, valid_from, name, market, industry) を保持する。
+    バッチ実行の開始時に1度だけ読み込み、以降は apply() のたびにメモリ上で更新する。
+    """
+
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> 'CompanySnapshot':
+        frame = pd.read_sql_query("""
+            SELECT c.code, c.code_id, h.valid_from, h.name, h.market, h.industry
+            FROM companies c
+            LEFT JOIN company_history h ON h.code_id = c.code_id AND h.valid_to IS NULL
+        """, conn).set_index('code')
+        return cls(frame)
+
+    def diff(self, df: pd.DataFrame, day: int) -> pd.DataFrame:
+        """
+        1日分の株価CSV (code, name, market, industry) と比べ、新規または属性が変わった銘柄を返す。
+        スナップショットより古い日付 (過去分の再取り込み) では現行の履歴を上書きしない。
+        """
+        new = df[['code'] + ATTRS].drop_duplicates(subset=['code']).set_index('code')
+        cur = self.frame.reindex(new.index)
+
+        changed = pd.Series(False, index=new.index)
+        for col in ATTRS:
+            a, b = new[col], cur[col]
+            changed |= (a != b) & ~(a.isna() & b.isna())
+
+        first = cur['valid_from'].isna()
+        stale = cur['valid_from'] > day
+        write = (changed | first) & ~stale
+
+        changes = new[write].copy()
+        changes['is_new'] = first[write]
+        return changes
+
+    def apply(self, conn: sqlite3.Connection, df: pd.DataFrame, date_str: str) -> int:
+        """差分のある銘柄だけを companies / company_history に書き込み、件数を返す"""
+        day = date_to_day(date_str)
+        changes = self.diff(df, day)
+        if changes.empty:
+            return 0
+
+        # 新規銘柄は採番してから書き込む
+        code_ids = get_code_ids(conn, changes.index)
+        changes['code_id'] = changes.index.map(code_ids)
+        changes = changes.where(pd.notnull(changes), None)
+
+        closing = changes[~changes['is_new'].astype(bool)]
+        conn.executemany("""
+            UPDATE company_history SET valid_to = ?
+            WHERE code_id = ? AND valid_to IS NULL
+        """, [(day, code_id) for code_id in closing['code_id']])
+
+        # 同じ日の再実行で属性が変わった場合は、同じ (code_id, valid_from) の行を置き換える
+        conn.executemany("""
+            INSERT OR REPLACE INTO company_history (code_id, valid_from, valid_to, name, market, industry)
+            VALUES (?, ?, NULL, ?, ?, ?)
+        """, [(r.code_id, day, r.name, r.market, r.industry) for r in changes.itertuples()])
+
+        conn.executemany("""
+            UPDATE companies SET name = ?, market = ?, industry = ? WHERE code_id = ?
+        """, [(r.name, r.market, r.industry, r.code_id) for r in changes.itertuples()])
+
+        # スナップショットを更新 (変化のあった行のみ差し替え)
+        updated = changes[['code_id'] + ATTRS].assign(valid_from=day)
+        self.frame = pd.concat([self.frame.drop(index=changes.index, errors='ignore'), updated])
+        return len(changes)
+
+
+# --- 時点指定の参照 (as-of) ---
+def get_company_as_of(conn: sqlite3.Connection, code: str, date_str: str):
+    """
+    指定日時点の銘柄属性を返す。該当がなければ None。
+
+    Returns:
+        {'code', 'name', 'market', 'industry'} の辞書
+    """
+    row = conn.execute("""
+        SELECT c.code, h.name, h.market, h.industry
+        FROM companies c
+        JOIN company_history h ON h.code_id = c.code_id
+        WHERE c.code = ? AND h.valid_from <= ? AND (h.valid_to IS NULL OR h.valid_to > ?)
+        ORDER BY h.valid_from DESC
+        LIMIT 1
+    """, (code, date_to_day(date_str), date_to_day(date_str))).fetchone()
+    if row is None:
+        return None
+    return dict(zip(['code'] + ATTRS, row))
+
+
+def get_companies_as_of(conn: sqlite3.Connection, date_str: str, industry: str = None) -> pd.DataFrame:
+    """
+    指定日時点の全銘柄 (industry 指定時はその業種の銘柄) の属性を返す。
+    過去時点のセクター構成を再現する用途に使う。
+    """
+    day = date_to_day(date_str)
+    query = """
+        SELECT c.code, h.name, h.market, h.industry
+        FROM company_history h
+        JOIN companies c ON c.code_id = h.code_id
+        WHERE h.valid_from <= ? AND (h.valid_to IS NULL OR h.valid_to > ?)
+    """
+    params = [day, day]
+    if industry is not None:
+        query += " AND h.industry = ?"
+        params.append(industry)
+    return pd.read_sql_query(query + " ORDER BY c.code", conn, params=params)
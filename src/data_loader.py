@@ -1,31 +1,20 @@
 import os
+import sqlite3
 import pandas as pd
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
+from src import db_manager
+from src.db_manager import get_connection, SQL_DAY_TO_DATE
+from src.shared_cache import get_cache
 
-# .envから株・プラスの認証情報を取得
-load_dotenv()
-KABU_PLUS_USER = os.getenv('KABU_PLUS_USER')
-KABU_PLUS_PASSWORD = os.getenv('KABU_PLUS_PASSWORD')
+HISTORY_DAYS = 365  # 取得する株価履歴の日数
+SECTOR_LOOKBACK_DAYS = 28  # 業種の騰落率を計算する期間 (暦日。約20営業日)
+DATA_CACHE_TTL = 3600  # 共有キャッシュに置く銘柄データの有効期間 (秒)。キーに最新日を含むためバッチ更新で切り替わる
 
-# NOTE: 実際にはここに株・プラスのAPI接続ロジックが入ります。
-#       以下の関数は、一旦ダミーのデータ（Pandas DataFrame）を返すように記述しています。
+# NOTE: 株価・財務・需給はバッチ (batch_loader) が蓄積したDBから読み出す。
+#       DBにまだデータがない銘柄は、従来どおりダミーのデータ（Pandas DataFrame）を返す。
 
-def fetch_data(code: str) -> dict:
-    """
-    指定された証券コードに基づき、株価、財務、需給データを取得する（ダミー関数）。
-    
-    Args:
-        code: 証券コード (例: '7203')
-        
-    Returns:
-        取得したデータを含む辞書
-    """
-    
-    if not KABU_PLUS_USER or not KABU_PLUS_PASSWORD:
-        return {"error": "株plusの認証情報が設定されていません。"}
-        
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] 株・プラス認証情報確認: OK. 証券コード {code} のデータ取得を開始します。")
+def _dummy_data(code: str) -> dict:
+    """DBに株価がない銘柄用のダミーデータ"""
 
     # --- 1. ダミーの株価データ (テクニカル分析用) ---
     end_date = datetime.now()
@@ -57,14 +46,169 @@ def fetch_data(code: str) -> dict:
     return {
         "stock_data": stock_data,
         "financial_data": pd.DataFrame(financial_data),
+        "margin_data": None,
+        "sector_data": None,
         "company_name": f"銘柄コード {code} のダミー企業",
         "company_summary": "この企業は〇〇事業を主軸とし、特に海外展開に強みがあります。",
         "error": None
     }
 
+
+def _sector_features(conn, industries: list, latest: int) -> dict:
+    """
+    同じ業種 (companies.industry) の銘柄の最新日の財務指標と1ヶ月騰落率から、業種の特徴量を計算する。
+    業種ごとに中央値を取るため、外れ値 (赤字企業の PER など) の影響を受けにくい。
+
+    Returns:
+        {業種名: プロンプトに載せる特徴量の辞書}
+    """
+    if not industries:
+        return {}
+    # 約1ヶ月前 (20営業日前相当) の株価日付
+    prev = conn.execute("SELECT MAX(day) FROM daily_prices_compact WHERE day <= ?", (latest - SECTOR_LOOKBACK_DAYS,)).fetchone()[0]
+    peers = pd.read_sql_query(f"""
+        SELECT c.industry, f.per_forecast, f.pbr_actual, f.dividend_yield,
+               p1.close_x10 * 1.0 / p0.close_x10 - 1 AS return_1m
+        FROM companies c
+        JOIN daily_financials_compact f ON f.code_id = c.code_id AND f.day = ?
+        LEFT JOIN daily_prices_compact p1 ON p1.code_id = c.code_id AND p1.day = ?
+        LEFT JOIN daily_prices_compact p0 ON p0.code_id = c.code_id AND p0.day = ?
+        WHERE c.industry IN ({','.join('?' * len(industries))})
+    """, conn, params=[latest, latest, prev, *industries])
+
+    features = {}
+    for industry, group in peers.groupby('industry'):
+        per = group['per_forecast'][group['per_forecast'] > 0]  # 赤字 (PER なし・負) は除く
+        ret = group['return_1m'].dropna()
+        features[industry] = {
+            '業種': industry,
+            '同業社数': len(group),
+            'PER中央値': round(per.median(), 1) if not per.empty else '-',
+            'PBR中央値': round(group['pbr_actual'].median(), 2) if group['pbr_actual'].notna().any() else '-',
+            '配当利回り中央値': f"{group['dividend_yield'].median():.2f}%" if group['dividend_yield'].notna().any() else '-',
+            '業種1ヶ月騰落率(中央値)': f"{ret.median() * 100:+.1f}%" if not ret.empty else '-',
+        }
+    return features
+
+
+def _load_from_db(codes: list, days: int = HISTORY_DAYS) -> dict:
+    """
+    複数銘柄の株価・財務・信用残を、テーブルごとに1回のクエリでまとめて読み出す。
+    主キー (code_id, day) の範囲検索になるため、銘柄数が増えてもクエリ数は変わらない。
+
+    Returns:
+        {code: 銘柄ごとのデータ辞書} (DBに株価がない銘柄は含まない)
+    """
+    if not os.path.exists(db_manager.DB_PATH):
+        return {}  # バッチ未実行
+
+    with get_connection() as conn:
+        try:
+            companies = pd.read_sql_query(
+                f"SELECT code_id, code, name, market, industry FROM companies WHERE code IN ({','.join('?' * len(codes))})",
+                conn, params=list(codes)
+            )
+            latest = conn.execute("SELECT MAX(day) FROM daily_prices_compact").fetchone()[0]
+        except sqlite3.OperationalError:
+            return {}  # テーブル未作成
+        if companies.empty or latest is None:
+            return {}
+
+        # 同じ最新日のデータを他のプロセス (シャード) が読み出し済みなら共有キャッシュから使う
+        cache = get_cache()
+        results = {}
+        for code in companies['code']:
+            cached = cache.get(f"data:{code}:{latest}")
+            if cached is not None:
+                results[code] = cached
+        companies = companies[~companies['code'].isin(list(results))]
+        if companies.empty:
+            return results
+
+        ids = ','.join(str(int(i)) for i in companies['code_id'])
+        min_day = latest - days
+
+        prices = pd.read_sql_query(f"""
+            SELECT code_id, day, open_x10 / 10.0 AS Open, high_x10 / 10.0 AS High,
+                   low_x10 / 10.0 AS Low, close_x10 / 10.0 AS Close, volume AS Volume
+            FROM daily_prices_compact
+            WHERE code_id IN ({ids}) AND day >= ?
+            ORDER BY code_id, day
+        """, conn, params=[min_day])
+        financials = pd.read_sql_query(f"""
+            SELECT code_id, {SQL_DAY_TO_DATE.format('day')} AS date, market_cap, per_forecast, pbr_actual,
+                   eps_forecast, bps_actual, dividend_yield
+            FROM daily_financials_compact
+            WHERE code_id IN ({ids}) AND day >= ?
+            ORDER BY code_id, day
+        """, conn, params=[min_day])
+        margin = pd.read_sql_query(f"""
+            SELECT code_id, {SQL_DAY_TO_DATE.format('day')} AS date, sell_balance_total, buy_balance_total, ratio
+            FROM weekly_margin_compact
+            WHERE code_id IN ({ids}) AND day >= ?
+            ORDER BY code_id, day
+        """, conn, params=[min_day])
+        sectors = _sector_features(conn, sorted(set(companies['industry'].dropna())), latest)
+
+    prices['Date'] = pd.to_datetime(prices.pop('day'), unit='D')
+    prices_by_id = dict(list(prices.groupby('code_id')))
+    financials_by_id = dict(list(financials.groupby('code_id')))
+    margin_by_id = dict(list(margin.groupby('code_id')))
+
+    for row in companies.itertuples():
+        if row.code_id not in prices_by_id:
+            continue
+        empty = pd.DataFrame()
+        results[row.code] = {
+            "stock_data": prices_by_id[row.code_id].drop(columns='code_id').set_index('Date'),
+            "financial_data": financials_by_id.get(row.code_id, empty).drop(columns='code_id', errors='ignore').reset_index(drop=True),
+            "margin_data": margin_by_id.get(row.code_id, empty).drop(columns='code_id', errors='ignore').reset_index(drop=True),
+            "sector_data": sectors.get(row.industry),
+            "company_name": row.name or f"銘柄コード {row.code}",
+            "company_summary": ' / '.join(x for x in (row.market, row.industry) if x),
+            "error": None
+        }
+        cache.set(f"data:{row.code}:{latest}", results[row.code], DATA_CACHE_TTL)
+    return results
+
+
+def fetch_multiple(codes: list) -> dict:
+    """
+    複数の証券コードのデータをまとめて取得する。DBの読み出しは銘柄数によらずテーブルごとに1回。
+    ローカルのDBを読むだけなので、株・プラスの認証情報は不要 (取得はバッチ側で行う)。
+
+    Args:
+        codes: 証券コードのリスト (例: ['7203', '7267'])
+
+    Returns:
+        {"results": {code: fetch_data と同じ形式の辞書}, "error": None}
+    """
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] 証券コード {', '.join(codes)} のデータ取得を開始します。")
+
+    results = _load_from_db(codes)
+    return {
+        "results": {code: results.get(code) or _dummy_data(code) for code in codes},
+        "error": None
+    }
+
+
+def fetch_data(code: str) -> dict:
+    """
+    指定された証券コードに基づき、株価、財務、需給データを取得する。
+    
+    Args:
+        code: 証券コード (例: '7203')
+        
+    Returns:
+        取得したデータを含む辞書
+    """
+    result = fetch_multiple([code])
+    if result.get("error"):
+        return result
+    return result["results"][code]
+
 # データ取得のテスト用関数（直接実行時）
 if __name__ == '__main__':
-    # .envを読み込まないと認証情報がないため、ここでは読み込みを省略
     data = fetch_data('7203')
     if not data.get("error"):
         print("\n--- 株価データ (一部) ---")
@@ -0,0 +1,303 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+# srcモジュールをインポートできるようにパスを追加
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src import db_manager
+from src.db_manager import date_to_day, day_to_date
+
+# SQLiteの保守ジョブ。バッチの後に実行し、
+#   - 空きページの回収 (incremental vacuum) と統計情報の更新 (ANALYZE / PRAGMA optimize)
+#   - 整合性チェック (quick_check / integrity_check)
+#   - 保持期間を過ぎた行の年別アーカイブ (data/archive/stock_archive_<年>.db) への移動
+# を行い、断片化の状況とキャッシュカバー率の推定値 (cache_size に収まるDBの割合) を報告する。
+# WAL モードで短いトランザクションに分けて実行するため、Bot の読み出しを止めない。
+
+# 保持期間 (日)。0 の場合はアーカイブしない
+RETENTION_DAYS = int(os.getenv('DB_RETENTION_DAYS', '0'))
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'archive')
+VACUUM_CHUNK_PAGES = 2000   # incremental vacuum 1回あたりのページ数 (1トランザクションを短く保つ)
+BUSY_TIMEOUT_MS = 30000
+FRAGMENTATION_WARN = 0.5    # 葉ページの不連続率がこれを超えたら作り直しを勧める
+
+ARCHIVE_TABLES = ['daily_prices_compact', 'daily_financials_compact', 'weekly_margin_compact', 'daily_indices_compact']
+
+
+def connect_for_maintenance(path: str = None) -> sqlite3.Connection:
+    """保守用の接続。他の接続の書き込み中はエラーにせず待つ"""
+    conn = sqlite3.connect(path or db_manager.DB_PATH, isolation_level=None)  # トランザクションは明示的に制御する
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    return conn
+
+
+# --- 1. 断片化・キャッシュの計測 ---
+def fragmentation_report(conn: sqlite3.Connection, detailed: bool = True) -> dict:
+    """
+    空きページの割合と、テーブルごとの葉ページの充填率・不連続率を返す。
+    不連続率は、キー順に並べた葉ページのうち直前のページ番号と連続していない割合
+    (INSERT OR REPLACE による再書き込みやランダム順の挿入で上がり、範囲検索が遅くなる)。
+    detailed の場合は dbstat 仮想テーブルで全ページを走査する (dbstat が無効なビルドでは省略)。
+    """
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    report = {
+        'size_mb': round(page_count * page_size / 1024 / 1024, 2),
+        'page_count': page_count,
+        'freelist_count': freelist,
+        'free_ratio': round(freelist / page_count, 4) if page_count else 0.0,
+        'tables': {},
+    }
+    if not detailed:
+        return report
+
+    try:
+        rows = conn.execute("""
+            SELECT name, pageno, pgsize - unused
+            FROM dbstat
+            WHERE pagetype = 'leaf'
+            ORDER BY name, path
+        """).fetchall()
+    except sqlite3.OperationalError:
+        return report  # dbstat が使えないビルド
+
+    stats = {}
+    prev = {}
+    for name, pageno, used in rows:
+        s = stats.setdefault(name, {'pages': 0, 'used': 0, 'jumps': 0})
+        s['pages'] += 1
+        s['used'] += used
+        if name in prev and pageno != prev[name] + 1:
+            s['jumps'] += 1
+        prev[name] = pageno
+    for name, s in stats.items():
+        if s['pages'] < 2:
+            continue
+        report['tables'][name] = {
+            'pages': s['pages'],
+            'fill': round(s['used'] / (s['pages'] * page_size), 3),
+            'out_of_order': round(s['jumps'] / (s['pages'] - 1), 3),
+        }
+    return report
+
+
+def cache_coverage_estimate(conn: sqlite3.Connection) -> float:
+    """
+    キャッシュカバー率の推定値として、1接続のページキャッシュ (PRAGMA cache_size) の上限に収まるDBの割合を返す。
+    設定値とDBサイズから計算するだけで、実際にキャッシュやOSのページキャッシュに載っている量ではない。
+    1.0 ならDB全体が載りうる。小さい場合は cache_size の引き上げを検討する目安にする。
+    """
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    # cache_size が負の値の場合は KiB 単位、正の値の場合はページ数
+    cache_bytes = -cache_size * 1024 if cache_size < 0 else cache_size * page_size
+    if page_count == 0:
+        return 1.0
+    return round(min(1.0, cache_bytes / (page_count * page_size)), 4)
+
+
+# --- 2. 保守処理 ---
+def rebuild(conn: sqlite3.Connection) -> bool:
+    """
+    VACUUM でDBファイルを主キー順に作り直し、ページの不連続 (断片化) を解消する。
+    あわせて auto_vacuum を INCREMENTAL に切り替える (既存のDBは VACUUM しないと切り替わらない)。
+    WAL モードのため読み出しは止まらないが、DBサイズに応じた時間と一時的な空き容量が必要。
+    """
+    switched = conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return switched
+
+
+def incremental_vacuum(conn: sqlite3.Connection, chunk_pages: int = VACUUM_CHUNK_PAGES) -> int:
+    """空きページを chunk_pages ずつ回収し、回収したページ数を返す (auto_vacuum=INCREMENTAL のときのみ有効)"""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    freed = 0
+    while True:
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if before == 0:
+            break
+        conn.execute(f"PRAGMA incremental_vacuum({chunk_pages})").fetchall()
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        freed += before - after
+        if after >= before:
+            break
+    return freed
+
+
+def refresh_statistics(conn: sqlite3.Connection) -> str:
+    """
+    クエリプランナー用の統計情報を更新する。統計がまだなければ ANALYZE、
+    あれば PRAGMA optimize (変化の大きいテーブルだけを、行数を制限して再分析する)。
+    """
+    has_stats = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+    if not has_stats:
+        conn.execute("ANALYZE")
+        return 'ANALYZE'
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("PRAGMA optimize")
+    return 'PRAGMA optimize'
+
+
+def check_integrity(conn: sqlite3.Connection, full: bool = False) -> list:
+    """quick_check (full の場合は索引の内容まで照合する integrity_check) を行い、問題点のリストを返す"""
+    pragma = 'integrity_check' if full else 'quick_check'
+    rows = [r[0] for r in conn.execute(f"PRAGMA {pragma}").fetchall()]
+    return [] if rows == ['ok'] else rows
+
+
+def archive_old_rows(conn: sqlite3.Connection, retention_days: int, archive_dir: str = ARCHIVE_DIR) -> dict:
+    """
+    最新の株価日付から retention_days より古い行を、年ごとのアーカイブDB (コンパクトスキーマ) へ移動する。
+    年・テーブルごとに1トランザクションで、アーカイブへの書き込み → 本体からの削除を行う。
+    WAL モードでは ATTACH したDBをまたぐトランザクションは原子的でないが、
+    アーカイブ側は INSERT OR REPLACE のため、途中で失敗しても再実行すれば揃う。
+
+    Returns:
+        {テーブル名: 移動した行数}
+    """
+    latest = conn.execute("SELECT MAX(day) FROM daily_prices_compact").fetchone()[0]
+    oldest = conn.execute("SELECT MIN(day) FROM daily_prices_compact").fetchone()[0]
+    moved = {table: 0 for table in ARCHIVE_TABLES}
+    if latest is None or latest - oldest <= retention_days:
+        return moved
+
+    cutoff = latest - retention_days
+    os.makedirs(archive_dir, exist_ok=True)
+    for year in range(int(day_to_date(oldest)[:4]), int(day_to_date(cutoff)[:4]) + 1):
+        lo = date_to_day(f"{year}0101")
+        hi = min(date_to_day(f"{year + 1}0101"), cutoff)
+        path = os.path.join(archive_dir, f"stock_archive_{year}.db")
+
+        with sqlite3.connect(path) as archive:
+            db_manager.create_compact_tables(archive)
+
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        try:
+            conn.execute("BEGIN")
+            conn.execute("INSERT OR REPLACE INTO archive.companies SELECT code_id, code, name, market, industry FROM main.companies")
+            conn.execute("COMMIT")
+            for table in ARCHIVE_TABLES:
+                conn.execute("BEGIN")
+                try:
+                    conn.execute(f"INSERT OR REPLACE INTO archive.{table} SELECT * FROM main.{table} WHERE day >= ? AND day < ?", (lo, hi))
+                    moved[table] += conn.execute(f"DELETE FROM main.{table} WHERE day >= ? AND day < ?", (lo, hi)).rowcount
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        finally:
+            conn.execute("DETACH DATABASE archive")
+
+    # 取り込み時の隔離行は保持期間を過ぎたら削除する (アーカイブしない)
+    conn.execute("DELETE FROM quarantine WHERE date < ?", (day_to_date(cutoff),))
+    return moved
+
+
+def _step(report: dict, name: str, func, *args):
+    """保守処理を1つ実行し、結果と所要時間を report['steps'] に記録する"""
+    t0 = time.perf_counter()
+    result = func(*args)
+    report['steps'][name] = {'result': result, 'seconds': round(time.perf_counter() - t0, 2)}
+    return result
+
+
+def run_after_batch(path: str = None, retention_days: int = None, archive_dir: str = ARCHIVE_DIR) -> dict:
+    """
+    バッチ後に毎回行う軽い保守。空きページの回収と PRAGMA optimize だけを行い、
+    保持期間が設定されている場合はアーカイブも行う。断片化の計測や整合性チェックは CLI (run_maintenance) で行う。
+    """
+    retention_days = RETENTION_DAYS if retention_days is None else retention_days
+    report = {'steps': {}}
+    conn = connect_for_maintenance(path)
+    try:
+        if retention_days > 0:
+            _step(report, 'archive', archive_old_rows, conn, retention_days, archive_dir)
+        _step(report, 'incremental_vacuum', incremental_vacuum, conn)
+        _step(report, 'statistics', refresh_statistics, conn)
+    finally:
+        conn.close()
+    return report
+
+
+def run_maintenance(path: str = None, retention_days: int = None, full: bool = False,
+                    integrity: bool = False, detailed: bool = False, archive_dir: str = ARCHIVE_DIR) -> dict:
+    """
+    保守処理を順に実行し、実行前後の計測結果を返す。
+
+    Args:
+        retention_days: 保持期間 (日)。省略時は DB_RETENTION_DAYS、0 ならアーカイブしない
+        full: VACUUM でファイルを作り直す (断片化の解消と auto_vacuum の切り替え。時間がかかる)
+        integrity: quick_check の代わりに integrity_check を行う
+        detailed: dbstat で全ページを走査してテーブルごとの断片化を計測する
+    """
+    retention_days = RETENTION_DAYS if retention_days is None else retention_days
+    report = {'steps': {}}
+    conn = connect_for_maintenance(path)
+    try:
+        report['before'] = fragmentation_report(conn, detailed)
+        report['cache_coverage_estimate'] = cache_coverage_estimate(conn)
+
+        _step(report, 'integrity', check_integrity, conn, integrity)
+        if retention_days > 0:
+            _step(report, 'archive', archive_old_rows, conn, retention_days, archive_dir)
+        if full:
+            _step(report, 'rebuild', rebuild, conn)
+        else:
+            _step(report, 'incremental_vacuum', incremental_vacuum, conn)
+        _step(report, 'statistics', refresh_statistics, conn)
+        # 読み出し中の接続を待たずにできる範囲で WAL をDB本体へ書き戻す
+        _step(report, 'checkpoint', lambda: conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone())
+
+        report['after'] = fragmentation_report(conn, detailed)
+        report['auto_vacuum'] = {0: 'NONE', 1: 'FULL', 2: 'INCREMENTAL'}[conn.execute("PRAGMA auto_vacuum").fetchone()[0]]
+    finally:
+        conn.close()
+    return report
+
+
+def print_report(report: dict):
+    before, after = report['before'], report['after']
+    print("\n=== DB保守 ===")
+    for name, s in report['steps'].items():
+        print(f"  {name:<26} {s['seconds']:>6.2f}秒  {s['result']}")
+    print(f"\n  サイズ: {before['size_mb']}MB -> {after['size_mb']}MB (auto_vacuum={report['auto_vacuum']})")
+    print(f"  空きページ率: {before['free_ratio']:.1%} -> {after['free_ratio']:.1%}")
+    print(f"  キャッシュカバー率 (推定, cache_size の上限に収まるDBの割合): {report['cache_coverage_estimate']:.1%}")
+    if after['tables']:
+        print("\n  テーブル                       葉ページ  充填率  不連続率")
+        for name, s in sorted(after['tables'].items(), key=lambda x: -x[1]['pages']):
+            print(f"  {name:<30} {s['pages']:>8} {s['fill']:>7.1%} {s['out_of_order']:>8.1%}")
+    if report['auto_vacuum'] != 'INCREMENTAL':
+        print("\n  ⚠️ auto_vacuum が INCREMENTAL ではないため空きページを回収できません。--full で一度だけ切り替えてください。")
+    fragmented = [name for name, s in after['tables'].items() if s['pages'] >= 100 and s['out_of_order'] > FRAGMENTATION_WARN]
+    if fragmented:
+        print(f"\n  ⚠️ 断片化が進んでいます ({', '.join(fragmented)})。範囲検索が遅い場合は --full で作り直してください。")
+    if not after['tables']:
+        print("\n  (テーブルごとの断片化は --detail で計測します)")
+    problems = report['steps']['integrity']['result']
+    if problems:
+        print(f"\n❌ 整合性チェックで問題が見つかりました: {problems[:10]}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SQLiteの保守 (空きページ回収・統計更新・整合性チェック・アーカイブ)')
+    parser.add_argument('--retention-days', type=int, default=None,
+                        help='保持期間 (日)。これより古い行を data/archive へ移動する (既定: DB_RETENTION_DAYS)')
+    parser.add_argument('--full', action='store_true', help='VACUUM でファイルを作り直す (断片化の解消・auto_vacuum の切り替え)')
+    parser.add_argument('--integrity', action='store_true', help='quick_check の代わりに integrity_check を行う')
+    parser.add_argument('--detail', action='store_true', help='dbstat で全ページを走査し、テーブルごとの断片化を計測する')
+    args = parser.parse_args()
+
+    started = datetime.now()
+    result = run_maintenance(retention_days=args.retention_days, full=args.full,
+                             integrity=args.integrity, detailed=args.detail)
+    print_report(result)
+    print(f"\n=== ✅ 保守完了 ({(datetime.now() - started).total_seconds():.1f}秒) ===")
@@ -1,93 +1,418 @@
+import json
 import sqlite3
 import os
-from datetime import datetime
+from datetime import datetime, date
+
+import numpy as np
+
+# 環境変数 STOCK_DB_PATH で上書き可能 (ベンチマーク・検証用の一時DBなど)
+DB_PATH = os.getenv('STOCK_DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'stock_data.db')
+
+# スキーマバージョン (PRAGMA user_version)
+#   0: 旧スキーマ (code/date を TEXT で保持する rowid テーブル)
+#   1: コンパクトスキーマ (整数の銘柄ID・日番号、WITHOUT ROWID、スケーリング整数)
+#   2: 銘柄属性の履歴 (company_history) を追加
+SCHEMA_VERSION = 2
+
+EPOCH = date(1970, 1, 1)
+# SQL内で 'YYYYMMDD' <-> 日番号 (1970-01-01 からの日数) を変換する式
+SQL_DATE_TO_DAY = "CAST(julianday(substr({0},1,4)||'-'||substr({0},5,2)||'-'||substr({0},7,2)) - 2440587.5 AS INTEGER)"
+SQL_DAY_TO_DATE = "strftime('%Y%m%d', {0} + 2440587.5)"
+
+# numpy の整数型をそのままバインドできるようにする (銘柄IDなど)
+sqlite3.register_adapter(np.int64, int)
+sqlite3.register_adapter(np.int32, int)
+
+
+def date_to_day(date_str: str) -> int:
+    """'YYYYMMDD' を日番号 (1970-01-01 からの日数) に変換する"""
+    return (datetime.strptime(date_str, '%Y%m%d').date() - EPOCH).days
+
+
+def day_to_date(day: int) -> str:
+    """日番号を 'YYYYMMDD' に変換する"""
+    return date.fromordinal(EPOCH.toordinal() + int(day)).strftime('%Y%m%d')
 
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'stock_data.db')
 
 def get_connection():
     """SQLite接続オブジェクトを返す"""
     return sqlite3.connect(DB_PATH)
 
-def create_tables(conn: sqlite3.Connection):
-    """データベーステーブルを定義し、作成する"""
-    cursor = conn.cursor()
 
-    # 1. 銘柄マスタ (companies):
+def get_code_ids(conn: sqlite3.Connection, codes) -> dict:
+    """
+    証券コード -> 銘柄ID の対応を返す。companies に存在しないコードは行を追加して採番する。
+    """
+    codes = list(dict.fromkeys(str(c) for c in codes))
+    conn.executemany("INSERT OR IGNORE INTO companies (code) VALUES (?)", [(c,) for c in codes])
+    return dict(conn.execute("SELECT code, code_id FROM companies").fetchall())
+
+
+def _is_legacy(conn: sqlite3.Connection) -> bool:
+    """旧スキーマ (daily_prices が実テーブル) かどうか"""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'daily_prices'").fetchone()
+    return row is not None and row[0] == 'table'
+
+
+def _create_compact_tables(cursor: sqlite3.Cursor):
+    """コンパクトスキーマのテーブル群を作成する"""
+    # 1. 銘柄マスタ (companies): code_id を各テーブルの外部キーとして使う
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS companies (
-            code TEXT PRIMARY KEY,
+            code_id INTEGER PRIMARY KEY,
+            code TEXT NOT NULL UNIQUE,
             name TEXT,
             market TEXT,
             industry TEXT
         );
     """)
 
-    # 2. 日足株価 (daily_prices):
+    # 2. 日足株価 (daily_prices_compact): 4本値は10倍した整数 (呼値0.1円まで表現可能)
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS daily_prices (
-            code TEXT,
-            date TEXT,
-            open REAL,
-            high REAL,
-            low REAL,
-            close REAL,
-            volume REAL,
-            trading_value REAL,
-            market_cap_total REAL,
-            PRIMARY KEY (code, date)
-        );
+        CREATE TABLE IF NOT EXISTS daily_prices_compact (
+            code_id INTEGER,
+            day INTEGER,                -- 1970-01-01 からの日数
+            open_x10 INTEGER,
+            high_x10 INTEGER,
+            low_x10 INTEGER,
+            close_x10 INTEGER,
+            volume INTEGER,
+            trading_value INTEGER,      -- 千円
+            market_cap_total INTEGER,   -- 百万円
+            PRIMARY KEY (code_id, day)
+        ) WITHOUT ROWID;
     """)
+    # 日付単位の参照 (前営業日の終値、全銘柄の横断検索) 用
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_daily_prices_day ON daily_prices_compact (day)")
 
-    # 3. 日足財務指標 (daily_financials): 拡張カラムを追加
+    # 3. 日足財務指標 (daily_financials_compact):
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS daily_financials (
-            code TEXT,
-            date TEXT,
-            market_cap REAL,
-            shares_outstanding REAL,
+        CREATE TABLE IF NOT EXISTS daily_financials_compact (
+            code_id INTEGER,
+            day INTEGER,
+            market_cap INTEGER,
+            shares_outstanding INTEGER,
             per_forecast REAL,
             pbr_actual REAL,
             eps_forecast REAL,
             bps_actual REAL,
             dividend_yield REAL,
-            min_investment REAL,
-            PRIMARY KEY (code, date)
-        );
+            min_investment INTEGER,
+            PRIMARY KEY (code_id, day)
+        ) WITHOUT ROWID;
     """)
 
-    # 4. 週次信用残 (weekly_margin):
+    # 4. 週次信用残 (weekly_margin_compact):
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS weekly_margin (
-            code TEXT,
-            date TEXT,
-            sell_balance_total REAL,
-            buy_balance_total REAL,
+        CREATE TABLE IF NOT EXISTS weekly_margin_compact (
+            code_id INTEGER,
+            day INTEGER,
+            sell_balance_total INTEGER,
+            buy_balance_total INTEGER,
             ratio REAL,
-            sell_balance_ins REAL,   -- 制度信用
-            buy_balance_ins REAL,    -- 制度信用
-            sell_balance_gen REAL,   -- 一般信用
-            buy_balance_gen REAL,    -- 一般信用
-            PRIMARY KEY (code, date)
-        );
+            sell_balance_ins INTEGER,   -- 制度信用
+            buy_balance_ins INTEGER,    -- 制度信用
+            sell_balance_gen INTEGER,   -- 一般信用
+            buy_balance_gen INTEGER,    -- 一般信用
+            PRIMARY KEY (code_id, day)
+        ) WITHOUT ROWID;
     """)
 
-    #　5. 指標データ (sector・index):
+    #　5. 指標データ (daily_indices_compact): 指数コードは銘柄マスタと別体系のため TEXT のまま
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS daily_indices (
+        CREATE TABLE IF NOT EXISTS daily_indices_compact (
             code TEXT NOT NULL,
+            day INTEGER NOT NULL,
             name TEXT,
-            date TEXT NOT NULL,
             close REAL,                 -- 終値
             change_ratio REAL,          -- 前日比（％）
-            market_cap_index REAL,      -- 時価総額（指数用・浮動株ベース）
-            volume REAL,                -- 売買単位換算後株式数 (指標の出来高に相当)
+            market_cap_index INTEGER,   -- 時価総額（指数用・浮動株ベース）
+            volume INTEGER,             -- 売買単位換算後株式数 (指標の出来高に相当)
             銘柄数 INTEGER,             -- 銘柄数
-            PRIMARY KEY (code, date)
+            PRIMARY KEY (code, day)
+        ) WITHOUT ROWID;
+    """)
+
+
+def _create_company_history(cursor: sqlite3.Cursor):
+    """
+    銘柄属性 (社名・市場・業種) の履歴テーブルを作成する。
+    companies は最新の値のみを持ち、変更があった日に company_history へ新しい期間を追加する。
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS company_history (
+            code_id INTEGER,
+            valid_from INTEGER,         -- この属性が有効になった日 (日番号)
+            valid_to INTEGER,           -- 次の変更日 (日番号)。現行の行は NULL
+            name TEXT,
+            market TEXT,
+            industry TEXT,
+            PRIMARY KEY (code_id, valid_from)
+        ) WITHOUT ROWID;
+    """)
+
+    # 履歴導入前のDBは、現在の companies を各銘柄の最初の株価日付から有効な期間として登録する
+    if cursor.execute("SELECT 1 FROM company_history LIMIT 1").fetchone() is None:
+        cursor.execute("""
+            INSERT INTO company_history (code_id, valid_from, valid_to, name, market, industry)
+            SELECT c.code_id,
+                   COALESCE((SELECT MIN(p.day) FROM daily_prices_compact p WHERE p.code_id = c.code_id), 0),
+                   NULL, c.name, c.market, c.industry
+            FROM companies c
+            WHERE c.name IS NOT NULL
+        """)
+
+
+def _create_validation_tables(cursor: sqlite3.Cursor):
+    """データ品質チェック (validator) 用のテーブル群を作成する"""
+    # 6. 取り込み時に除外・警告された行 (quarantine):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS quarantine (
+            run_id TEXT,
+            feed TEXT,
+            code TEXT,
+            date TEXT,
+            severity TEXT,              -- reject: 格納しない / warn: 格納済みだが要確認
+            reason TEXT,                -- ';' 区切りのチェック名
+            raw TEXT                    -- 元の行 (JSON)
         )
     """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_quarantine_run ON quarantine (run_id, feed)")
+
+    # 7. データ品質チェックの実行結果 (validation_runs):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS validation_runs (
+            run_id TEXT,
+            feed TEXT,
+            checked INTEGER,
+            rejected INTEGER,
+            warned INTEGER,
+            PRIMARY KEY (run_id, feed)
+        )
+    """)
+
+
+def _compat_view_statements() -> list:
+    """
+    旧スキーマと同じテーブル名・カラム (code TEXT, date 'YYYYMMDD', REAL) で参照できる互換ビューのDDL。
+    INSTEAD OF トリガーにより、旧来の INSERT 文もそのまま書き込める。
+    """
+    day = SQL_DAY_TO_DATE.format('t.day')
+    new_day = SQL_DATE_TO_DAY.format('NEW.date')
+    code_id = "(SELECT code_id FROM companies WHERE code = NEW.code)"
+    # 未登録の銘柄は採番だけ行う (外側の INSERT OR REPLACE が伝播しても既存行を置き換えない書き方)
+    ensure_company = "INSERT INTO companies (code) SELECT NEW.code WHERE NOT EXISTS (SELECT 1 FROM companies WHERE code = NEW.code);"
+
+    return [
+        f"""
+        CREATE VIEW IF NOT EXISTS daily_prices AS
+        SELECT c.code, {day} AS date,
+               t.open_x10 / 10.0 AS open, t.high_x10 / 10.0 AS high,
+               t.low_x10 / 10.0 AS low, t.close_x10 / 10.0 AS close,
+               t.volume, t.trading_value, t.market_cap_total
+        FROM daily_prices_compact t JOIN companies c ON c.code_id = t.code_id
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS daily_prices_insert INSTEAD OF INSERT ON daily_prices
+        BEGIN
+            {ensure_company}
+            INSERT OR REPLACE INTO daily_prices_compact VALUES (
+                {code_id}, {new_day},
+                ROUND(NEW.open * 10), ROUND(NEW.high * 10), ROUND(NEW.low * 10), ROUND(NEW.close * 10),
+                NEW.volume, NEW.trading_value, NEW.market_cap_total
+            );
+        END
+        """,
+        f"""
+        CREATE VIEW IF NOT EXISTS daily_financials AS
+        SELECT c.code, {day} AS date,
+               t.market_cap, t.shares_outstanding, t.per_forecast, t.pbr_actual,
+               t.eps_forecast, t.bps_actual, t.dividend_yield, t.min_investment
+        FROM daily_financials_compact t JOIN companies c ON c.code_id = t.code_id
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS daily_financials_insert INSTEAD OF INSERT ON daily_financials
+        BEGIN
+            {ensure_company}
+            INSERT OR REPLACE INTO daily_financials_compact VALUES (
+                {code_id}, {new_day},
+                NEW.market_cap, NEW.shares_outstanding, NEW.per_forecast, NEW.pbr_actual,
+                NEW.eps_forecast, NEW.bps_actual, NEW.dividend_yield, NEW.min_investment
+            );
+        END
+        """,
+        f"""
+        CREATE VIEW IF NOT EXISTS weekly_margin AS
+        SELECT c.code, {day} AS date,
+               t.sell_balance_total, t.buy_balance_total, t.ratio,
+               t.sell_balance_ins, t.buy_balance_ins, t.sell_balance_gen, t.buy_balance_gen
+        FROM weekly_margin_compact t JOIN companies c ON c.code_id = t.code_id
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS weekly_margin_insert INSTEAD OF INSERT ON weekly_margin
+        BEGIN
+            {ensure_company}
+            INSERT OR REPLACE INTO weekly_margin_compact VALUES (
+                {code_id}, {new_day},
+                NEW.sell_balance_total, NEW.buy_balance_total, NEW.ratio,
+                NEW.sell_balance_ins, NEW.buy_balance_ins, NEW.sell_balance_gen, NEW.buy_balance_gen
+            );
+        END
+        """,
+        f"""
+        CREATE VIEW IF NOT EXISTS daily_indices AS
+        SELECT t.code, t.name, {day} AS date,
+               t.close, t.change_ratio, t.market_cap_index, t.volume, t.銘柄数
+        FROM daily_indices_compact t
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS daily_indices_insert INSTEAD OF INSERT ON daily_indices
+        BEGIN
+            INSERT OR REPLACE INTO daily_indices_compact VALUES (
+                NEW.code, {new_day}, NEW.name,
+                NEW.close, NEW.change_ratio, NEW.market_cap_index, NEW.volume, NEW.銘柄数
+            );
+        END
+        """,
+    ]
+
+
+def create_compact_tables(conn: sqlite3.Connection):
+    """
+    コンパクトスキーマの実テーブル (companies と *_compact) だけを作成する。
+    互換ビュー・履歴・検証用のテーブルを持たないDB (年別のアーカイブなど) に使う。
+    """
+    _create_compact_tables(conn.cursor())
+    conn.commit()
+
+
+def create_tables(conn: sqlite3.Connection):
+    """データベーステーブルを定義し、作成する"""
+    if conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is None:
+        # 新規DBは削除・置換で空いたページを保守ジョブ (db_maintenance) で回収できるようにする
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # バッチの書き込み中も Bot の読み出しを妨げないよう WAL モードにする (DBファイルに保存される設定)
+    conn.execute("PRAGMA journal_mode = WAL")
+
+    if _is_legacy(conn):
+        # 旧スキーマのDBは先にコンパクトスキーマへ移行する
+        migrate_to_compact(conn)
+
+    cursor = conn.cursor()
+    _create_compact_tables(cursor)
+    _create_company_history(cursor)
+    _create_validation_tables(cursor)
+
+    for statement in _compat_view_statements():
+        cursor.execute(statement)
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
     print("✅ Tables created/verified successfully.")
 
+
+def migrate_to_compact(conn: sqlite3.Connection):
+    """
+    旧スキーマ (TEXT の code/date、rowid テーブル) のデータをコンパクトスキーマへ移行する。
+    1トランザクションで行い、失敗した場合は旧スキーマのまま残る。
+    日付が空・不正な行は主キーに使えないため移行せず、quarantine テーブルに記録して件数を表示する。
+    移行後は旧テーブルの領域を解放するため VACUUM を実行する。
+    """
+    print("🔧 旧スキーマを検出しました。コンパクトスキーマへ移行します...")
+    to_day = SQL_DATE_TO_DAY.format('t.date')
+    code_id = "c.code_id"
+    join = "JOIN companies c ON c.code = t.code"
+
+    conn.commit()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN")
+        for table in ('companies', 'daily_prices', 'daily_financials', 'weekly_margin', 'daily_indices'):
+            cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+
+        _create_compact_tables(cursor)
+        _create_validation_tables(cursor)
+
+        # 日付を日番号に変換できない行は quarantine へ移す (1行のために移行全体を中止しない)
+        run_id = f"migrate_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        skipped = 0
+        for table, feed in (('daily_prices', '株価'), ('daily_financials', '財務指標'),
+                            ('weekly_margin', '信用残'), ('daily_indices', '業種別指数')):
+            rows = cursor.execute(f"SELECT * FROM {table}_legacy t WHERE {to_day} IS NULL").fetchall()
+            columns = [d[0] for d in cursor.description]
+            cursor.executemany("""
+                INSERT INTO quarantine (run_id, feed, code, date, severity, reason, raw)
+                VALUES (?, ?, ?, ?, 'reject', 'invalid_date', ?)
+            """, [(run_id, feed, row[columns.index('code')], row[columns.index('date')],
+                   json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str)) for row in rows])
+            skipped += len(rows)
+
+        # 証券コード順に採番し、マスタにない銘柄 (株価・財務・信用残のみに存在) も登録する
+        cursor.execute("""
+            INSERT INTO companies (code, name, market, industry)
+            SELECT code, name, market, industry FROM companies_legacy ORDER BY code
+        """)
+        cursor.execute("""
+            INSERT INTO companies (code)
+            SELECT code FROM daily_prices_legacy
+            UNION SELECT code FROM daily_financials_legacy
+            UNION SELECT code FROM weekly_margin_legacy
+            EXCEPT SELECT code FROM companies
+            ORDER BY 1
+        """)
+
+        # 主キー順に挿入することで、WITHOUT ROWID の B-tree を断片化させずに構築する
+        cursor.execute(f"""
+            INSERT INTO daily_prices_compact
+            SELECT {code_id}, {to_day},
+                   ROUND(t.open * 10), ROUND(t.high * 10), ROUND(t.low * 10), ROUND(t.close * 10),
+                   t.volume, t.trading_value, t.market_cap_total
+            FROM daily_prices_legacy t {join}
+            WHERE {to_day} IS NOT NULL
+            ORDER BY 1, 2
+        """)
+        cursor.execute(f"""
+            INSERT INTO daily_financials_compact
+            SELECT {code_id}, {to_day},
+                   t.market_cap, t.shares_outstanding, t.per_forecast, t.pbr_actual,
+                   t.eps_forecast, t.bps_actual, t.dividend_yield, t.min_investment
+            FROM daily_financials_legacy t {join}
+            WHERE {to_day} IS NOT NULL
+            ORDER BY 1, 2
+        """)
+        cursor.execute(f"""
+            INSERT INTO weekly_margin_compact
+            SELECT {code_id}, {to_day},
+                   t.sell_balance_total, t.buy_balance_total, t.ratio,
+                   t.sell_balance_ins, t.buy_balance_ins, t.sell_balance_gen, t.buy_balance_gen
+            FROM weekly_margin_legacy t {join}
+            WHERE {to_day} IS NOT NULL
+            ORDER BY 1, 2
+        """)
+        cursor.execute(f"""
+            INSERT INTO daily_indices_compact
+            SELECT t.code, {to_day}, t.name,
+                   t.close, t.change_ratio, t.market_cap_index, t.volume, t.銘柄数
+            FROM daily_indices_legacy t
+            WHERE {to_day} IS NOT NULL
+            ORDER BY 1, 2
+        """)
+
+        for table in ('companies', 'daily_prices', 'daily_financials', 'weekly_margin', 'daily_indices'):
+            cursor.execute(f"DROP TABLE {table}_legacy")
+        for statement in _compat_view_statements():
+            cursor.execute(statement)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+    conn.execute("VACUUM")
+    if skipped:
+        print(f"⚠️ 日付が不正な {skipped} 行を移行せず、quarantine (run_id={run_id}) に記録しました。")
+    print("✅ コンパクトスキーマへの移行が完了しました。")
+
+
 def initialize_db():
     """データベースファイルを初期化し、テーブルを作成する"""
     if not os.path.exists(os.path.dirname(DB_PATH)):
@@ -99,4 +424,3 @@ def initialize_db():
 
 if __name__ == '__main__':
     initialize_db()
-
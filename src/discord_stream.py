@@ -0,0 +1,98 @@
+import asyncio
+import re
+import time
+
+# Gemini のストリーミング応答を Discord に段階的に表示する。
+# 最初の断片はすぐに送信し、以降はメッセージ編集で追記する (編集は一定間隔に間引く)。
+# Discord の1メッセージ上限 (2,000文字) を超える分は、見出しなどの区切りで分割して新しいメッセージに送る。
+
+DISCORD_MESSAGE_LIMIT = 2000
+EDIT_INTERVAL = 1.0  # メッセージ編集の最小間隔 (秒)。Discord のレート制限 (5回/5秒) に収める
+
+# 区切りの優先順位: セクション見出し (### / **1. / 1.) → 段落 → 行
+_SECTION_BREAK = re.compile(r'\n(?=#{1,6} |\*\*\d|\d+\. )')
+_PARAGRAPH_BREAK = re.compile(r'\n\n')
+_LINE_BREAK = re.compile(r'\n')
+
+
+def _find_cut(text: str, limit: int) -> int:
+    """text[:limit] に収まる最後の区切り位置を返す。区切りがなければ limit で切る"""
+    window = text[:limit + 1]  # 区切りの改行がちょうど limit 文字目にある場合も拾う
+    for pattern in (_SECTION_BREAK, _PARAGRAPH_BREAK, _LINE_BREAK):
+        cuts = [m.start() for m in pattern.finditer(window) if 0 < m.start() <= limit]
+        if cuts:
+            return cuts[-1]
+    return limit
+
+
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> list:
+    """
+    limit 文字以下のメッセージに分割する。できるだけセクションの境目で切り、
+    見つからなければ段落 → 行 → 文字数の順に切り方を落とす。
+    先頭から貪欲に切るため、text の末尾に追記しても確定済みの分割位置は変わらない。
+    """
+    pieces = []
+    while len(text) > limit:
+        cut = _find_cut(text, limit)
+        pieces.append(text[:cut].rstrip('\n'))
+        text = text[cut:].lstrip('\n')
+    if text.strip():
+        pieces.append(text)
+    return [p for p in pieces if p.strip()]
+
+
+class StreamingReply:
+    """
+    ストリーミングで届くテキストを Discord のメッセージとして表示する。
+    最初の断片は即座に送信し、以降は edit_interval ごとに変化したメッセージだけを編集、
+    上限を超えた分は新しいメッセージとして送信する。
+    """
+
+    def __init__(self, channel, limit: int = DISCORD_MESSAGE_LIMIT, edit_interval: float = EDIT_INTERVAL):
+        self.channel = channel
+        self.limit = limit
+        self.edit_interval = edit_interval
+        self.text = ''
+        self.messages = []   # 送信済みの discord.Message
+        self._shown = []     # 各メッセージに表示中の本文
+        self._last_flush = 0.0
+
+    async def feed(self, chunk: str):
+        self.text += chunk
+        if not self.messages or time.monotonic() - self._last_flush >= self.edit_interval:
+            await self._flush()
+
+    async def close(self):
+        """最後に残った差分を反映する"""
+        await self._flush()
+
+    async def _flush(self):
+        pieces = split_message(self.text, self.limit)
+        for i, piece in enumerate(pieces):
+            if i < len(self.messages):
+                if self._shown[i] != piece:
+                    await self.messages[i].edit(content=piece)
+                    self._shown[i] = piece
+            else:
+                self.messages.append(await self.channel.send(piece))
+                self._shown.append(piece)
+        self._last_flush = time.monotonic()
+
+
+async def deliver_stream(channel, stream, limit: int = DISCORD_MESSAGE_LIMIT,
+                         edit_interval: float = EDIT_INTERVAL) -> str:
+    """
+    テキスト断片のイテレータ (同期) を Discord に段階的に表示し、全文を返す。
+    イテレータは API 呼び出しでブロックするため、別スレッドで1断片ずつ取り出す。
+    """
+    reply = StreamingReply(channel, limit, edit_interval)
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, stream, None)
+            if chunk is None:
+                break
+            await reply.feed(chunk)
+    finally:
+        # 途中でエラーになっても、届いた分は表示しておく
+        await reply.close()
+    return reply.text
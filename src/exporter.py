@@ -0,0 +1,141 @@
+import argparse
+import csv
+import gzip
+import os
+import sqlite3
+import sys
+
+# srcモジュールをインポートできるようにパスを追加
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.db_manager import get_connection, date_to_day, SQL_DAY_TO_DATE
+
+# Parquet出力は pyarrow がある場合のみ対応
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+PAGE_SIZE = 5000
+
+# 株価 + 財務指標を (code, date) で結合した出力カラム
+EXPORT_COLUMNS = [
+    'code', 'date', 'name', 'market', 'industry',
+    'open', 'high', 'low', 'close', 'volume', 'trading_value', 'market_cap_total',
+    'market_cap', 'shares_outstanding', 'per_forecast', 'pbr_actual',
+    'eps_forecast', 'bps_actual', 'dividend_yield', 'min_investment',
+]
+
+# 1銘柄分を日番号のキーセットで読み出すクエリ (コンパクトスキーマの主キー (code_id, day) を範囲検索する)
+EXPORT_QUERY = f"""
+    SELECT
+        ?, {SQL_DAY_TO_DATE.format('p.day')}, ?, ?, ?,
+        p.open_x10 / 10.0, p.high_x10 / 10.0, p.low_x10 / 10.0, p.close_x10 / 10.0,
+        p.volume, p.trading_value, p.market_cap_total,
+        f.market_cap, f.shares_outstanding, f.per_forecast, f.pbr_actual,
+        f.eps_forecast, f.bps_actual, f.dividend_yield, f.min_investment,
+        p.day
+    FROM daily_prices_compact p
+    LEFT JOIN daily_financials_compact f ON f.code_id = p.code_id AND f.day = p.day
+    WHERE p.code_id = ?
+      AND p.day > ? AND p.day <= ?
+    ORDER BY p.day
+    LIMIT ?
+"""
+
+
+def iter_export_pages(conn: sqlite3.Connection, code_from: str, code_to: str,
+                      date_from: str, date_to: str, page_size: int = PAGE_SIZE):
+    """
+    (code, date) のキーセットページネーションで結合済みの行を最大 page_size 件ずつ返す。
+    OFFSET を使わないため、どのページも主キー索引からの範囲検索になり、メモリ使用量は1ページ分で一定。
+    """
+    companies = conn.execute("""
+        SELECT code_id, code, name, market, industry FROM companies
+        WHERE code BETWEEN ? AND ?
+        ORDER BY code
+    """, (code_from, code_to)).fetchall()
+    # 日付範囲は日番号に変換 (範囲外の値は端に丸める)
+    day_from = date_to_day(max(date_from, '19700101')) - 1
+    day_to = date_to_day(min(date_to, '99991231'))
+
+    page = []
+    for code_id, code, name, market, industry in companies:
+        last_day = day_from
+        while True:
+            limit = page_size - len(page)
+            rows = conn.execute(EXPORT_QUERY, (code, name, market, industry, code_id,
+                                               last_day, day_to, limit)).fetchall()
+            if rows:
+                last_day = rows[-1][-1]
+                page.extend(row[:-1] for row in rows)
+            if len(page) >= page_size:
+                yield page
+                page = []
+            if len(rows) < limit:
+                break  # この銘柄は読み切った
+    if page:
+        yield page
+
+
+def export_csv(path: str, code_from: str, code_to: str, date_from: str, date_to: str,
+               page_size: int = PAGE_SIZE) -> int:
+    """CSVとして書き出す。拡張子が .gz の場合は gzip 圧縮する。書き出した行数を返す"""
+    opener = gzip.open if path.endswith('.gz') else open
+    count = 0
+    with get_connection() as conn, opener(path, 'wt', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in iter_export_pages(conn, code_from, code_to, date_from, date_to, page_size):
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def export_parquet(path: str, code_from: str, code_to: str, date_from: str, date_to: str,
+                   page_size: int = PAGE_SIZE) -> int:
+    """Parquetとして書き出す (1ページ = 1 row group, zstd圧縮)。書き出した行数を返す"""
+    if pa is None:
+        raise ImportError("Parquet出力には pyarrow が必要です (pip install pyarrow)")
+
+    schema = pa.schema(
+        [(name, pa.string()) for name in EXPORT_COLUMNS[:5]]
+        + [(name, pa.float64()) for name in EXPORT_COLUMNS[5:]]
+    )
+    count = 0
+    with get_connection() as conn, pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for rows in iter_export_pages(conn, code_from, code_to, date_from, date_to, page_size):
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema
+            ))
+            count += len(rows)
+    return count
+
+
+def export_data(path: str, code_from: str, code_to: str, date_from: str, date_to: str,
+                fmt: str = 'csv', page_size: int = PAGE_SIZE) -> int:
+    """形式 ('csv' または 'parquet') に応じて書き出す"""
+    if fmt == 'parquet':
+        return export_parquet(path, code_from, code_to, date_from, date_to, page_size)
+    if fmt == 'csv':
+        return export_csv(path, code_from, code_to, date_from, date_to, page_size)
+    raise ValueError(f"未対応の出力形式です: {fmt}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='株価・財務指標の履歴データをストリーミングで書き出す')
+    parser.add_argument('output', help='出力ファイル (.csv / .csv.gz / .parquet)')
+    parser.add_argument('--code-from', default='0000')
+    parser.add_argument('--code-to', default='9999')
+    parser.add_argument('--date-from', default='19700101', help='YYYYMMDD')
+    parser.add_argument('--date-to', default='99999999', help='YYYYMMDD')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default=None,
+                        help='省略時は拡張子から判定')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or ('parquet' if args.output.endswith('.parquet') else 'csv')
+    n = export_data(args.output, args.code_from, args.code_to, args.date_from, args.date_to, fmt, args.page_size)
+    print(f"✅ {n}件を書き出しました: {args.output}")
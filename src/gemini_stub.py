@@ -0,0 +1,80 @@
+import time
+import threading
+from types import SimpleNamespace
+
+from src.prompt_builder import estimate_contents_tokens
+
+# ベンチマーク・動作検証用の Gemini クライアントのスタブ。
+# google.genai.Client と同じ呼び出し形 (client.models.generate_content) を持ち、
+# 指定した遅延 (固定分 + 入力トークン数に比例する分) の後に固定のレポートを返す。
+# generate_content_stream は最初のトークンまでの遅延の後、残りの生成時間に合わせてレポートを断片ずつ返す。
+
+DEFAULT_REPORT = (
+    "### 1. 株価動向の評価 (テクニカル)\n"
+    "直近3ヶ月は緩やかな上昇トレンドにあり、RSIは中立圏で推移しています。\n\n"
+    "### 2. 財務健全性の評価 (ファンダメンタルズ)\n"
+    "売上・利益ともに安定した成長を続けており、PERは業種平均並みです。\n\n"
+    "### 3. 総合的な見解\n"
+    "**中立**。トレンドは良好ですが、割安感は限定的です。\n"
+)
+
+
+def _prompt_chars(contents) -> int:
+    """contents に含まれるテキストの文字数を合計する (画像パートは除く)"""
+    if isinstance(contents, str):
+        return len(contents)
+    return sum(len(part) for part in contents if isinstance(part, str))
+
+
+class _StubModels:
+    def __init__(self, owner: 'StubGeminiClient'):
+        self._owner = owner
+
+    def generate_content(self, model: str, contents, config=None):
+        owner = self._owner
+        tokens = estimate_contents_tokens(contents)
+        with owner._lock:
+            owner.calls.append({"model": model, "prompt_chars": _prompt_chars(contents), "prompt_tokens": tokens})
+        time.sleep(owner.latency + owner.latency_per_1k_tokens * tokens / 1000)
+        return SimpleNamespace(text=owner.report)
+
+    def generate_content_stream(self, model: str, contents, config=None):
+        owner = self._owner
+        tokens = estimate_contents_tokens(contents)
+        with owner._lock:
+            owner.calls.append({"model": model, "prompt_chars": _prompt_chars(contents), "prompt_tokens": tokens})
+        # 入力トークンに比例する分は最初のトークンの前にかかる (プリフィル)
+        time.sleep(owner.first_token_latency + owner.latency_per_1k_tokens * tokens / 1000)
+
+        report = owner.report
+        chunks = [report[i:i + owner.chunk_chars] for i in range(0, len(report), owner.chunk_chars)]
+        # 生成全体の所要時間が generate_content と同じになるよう、残りの時間を断片間に配分する
+        interval = max(0.0, owner.latency - owner.first_token_latency) / max(1, len(chunks) - 1)
+        for i, text in enumerate(chunks):
+            if i:
+                time.sleep(interval)
+            yield SimpleNamespace(text=text)
+
+
+class StubGeminiClient:
+    """
+    google.genai.Client の代替。analyzer.client に差し替えて使う。
+
+    Args:
+        latency: 1リクエストあたりの固定の応答遅延 (秒)
+        report: 返却するレポート本文
+        latency_per_1k_tokens: 入力1,000トークンあたりの追加遅延 (秒)
+        first_token_latency: ストリーミング時の最初の断片までの遅延 (秒)。省略時は latency の1/5
+        chunk_chars: ストリーミング時の1断片あたりの文字数
+    """
+
+    def __init__(self, latency: float = 0.5, report: str = DEFAULT_REPORT, latency_per_1k_tokens: float = 0.0,
+                 first_token_latency: float = None, chunk_chars: int = 40):
+        self.latency = latency
+        self.first_token_latency = latency / 5 if first_token_latency is None else min(first_token_latency, latency)
+        self.chunk_chars = chunk_chars
+        self.latency_per_1k_tokens = latency_per_1k_tokens
+        self.report = report
+        self.calls = []
+        self._lock = threading.Lock()
+        self.models = _StubModels(self)
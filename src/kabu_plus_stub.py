@@ -0,0 +1,295 @@
+import base64
+import io
+import re
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+# ベンチマーク・動作検証用の「株・プラス」スタブ。
+# batch_loader が期待する実ヘッダーを持つ cp932 の CSV を生成し、Basic認証付きのローカルHTTPで配信する。
+
+ENCODING = 'cp932'
+ANCHOR_DATE = date(2020, 1, 1)  # 株価ランダムウォークの起点日
+
+MARKETS = ['東証プライム', '東証スタンダード', '東証グロース']
+INDUSTRIES = [
+    '水産・農林業', '鉱業', '建設業', '食料品', '繊維製品', 'パルプ・紙', '化学', '医薬品',
+    '石油・石炭製品', 'ゴム製品', 'ガラス・土石製品', '鉄鋼', '非鉄金属', '金属製品', '機械',
+    '電気機器', '輸送用機器', '精密機器', 'その他製品', '電気・ガス業', '陸運業', '海運業',
+    '空運業', '倉庫・運輸関連業', '情報・通信業', '卸売業', '小売業', '銀行業', '証券、商品先物取引業',
+    '保険業', 'その他金融業', '不動産業', 'サービス業',
+]
+
+PRICES_HEADER = [
+    'SC', '名称', '市場', '業種', '日付', '時刻', '株価', '前日比', '前日比（％）', '前日終値',
+    '始値', '高値', '安値', 'VWAP', '出来高', '出来高率', '売買代金（千円）', '時価総額（百万円）',
+    '値幅下限', '値幅上限', '高値日付', '年初来高値', '年初来高値乖離率', '安値日付', '年初来安値', '年初来安値乖離率',
+]
+FINANCIALS_HEADER = [
+    'SC', '名称', '市場', '業種', '時価総額（百万円）', '発行済株式数', '配当利回り（予想）', '1株配当（予想）',
+    'PER（予想）', 'PBR（実績）', 'EPS（予想）', 'BPS（実績）', '最低投資金額', '単元株',
+]
+MARGIN_HEADER = [
+    'SC', '公表日', '信用取引区分', '信用売残', '信用売残 前週比', '信用買残', '信用買残 前週比', '貸借倍率',
+    '制度信用売残', '制度信用売残 前週比', '制度信用買残', '制度信用買残 前週比',
+    '一般信用売残', '一般信用売残 前週比', '一般信用買残', '一般信用買残 前週比',
+]
+INDICES_HEADER = [
+    'SC', '指数名', '日付', '終値', '前日比', '前日比（％）', '前日終値', '時価総額（指数用・浮動株ベース）',
+    '時価総額前日比（同左）', '前日時価総額（同左）', '平均時価総額（同左）', '基準時価総額', '銘柄数', '売買単位換算後株式数',
+]
+
+# URLパス: /kabu.plus/csv/<feed>/<daily|weekly>/<feed>_<YYYYMMDD>.csv
+PATH_PATTERN = re.compile(r'/kabu\.plus/csv/(?P<feed>[a-z0-9\-]+)/(?:daily|weekly)/(?P=feed)_(?P<date>\d{8})\.csv$')
+
+
+class KabuPlusDataset:
+    """
+    全銘柄分の擬似データを決定的に生成する。同じ seed・日付なら常に同じCSVになる。
+    """
+
+    def __init__(self, n_codes: int = 4000, seed: int = 42, halt_ratio: float = 0.002):
+        self.seed = seed
+        self.halt_ratio = halt_ratio
+        rng = np.random.default_rng(seed)
+
+        # 実在の証券コード帯 (1300〜9999) からユニークに抽出
+        numeric = np.sort(rng.choice(np.arange(1300, 10000), size=n_codes, replace=False))
+        self.codes = np.array([str(c) for c in numeric])
+        self.names = np.array([f'テスト銘柄{c}' for c in self.codes])
+        self.markets = rng.choice(MARKETS, size=n_codes, p=[0.45, 0.4, 0.15])
+        self.industries = rng.choice(INDUSTRIES, size=n_codes)
+
+        self.base_price = np.round(np.exp(rng.normal(7.3, 0.9, size=n_codes)))  # 中央値 1,500円程度
+        self.shares = np.round(np.exp(rng.normal(17.5, 1.2, size=n_codes)), -3)
+        self.eps = np.round(self.base_price * rng.uniform(0.02, 0.12, size=n_codes), 1)
+        self.bps = np.round(self.base_price * rng.uniform(0.4, 1.8, size=n_codes), 1)
+        self.dps = np.round(self.base_price * rng.uniform(0.0, 0.04, size=n_codes), 1)
+
+        self.index_codes = [f'{i:04d}' for i in range(len(INDUSTRIES) + 1)]
+        self.index_names = ['東証株価指数'] + [f'東証業種別 {name}' for name in INDUSTRIES]
+
+        self._log_returns = {}  # 起点日からの累積対数リターン (日付ordinal -> ndarray)
+
+    # --- 株価系列 ---
+    def _cum_log_return(self, d: date) -> np.ndarray:
+        """起点日から d までの累積対数リターンを返す (営業日のみ変動)"""
+        if d <= ANCHOR_DATE:
+            return np.zeros(len(self.codes))
+        key = d.toordinal()
+        if key in self._log_returns:
+            return self._log_returns[key]
+
+        # 計算済みの直近日から順に積み上げる (なければ起点日から)
+        cached = [k for k in self._log_returns if k < key]
+        day_key = max(cached) if cached else ANCHOR_DATE.toordinal()
+        cur = self._log_returns.get(day_key, np.zeros(len(self.codes)))
+        while day_key < key:
+            day_key += 1
+            if date.fromordinal(day_key).weekday() < 5:
+                rng = np.random.default_rng([self.seed, day_key])
+                cur = cur + rng.normal(0.0003, 0.018, size=len(self.codes))
+            self._log_returns[day_key] = cur
+        return cur
+
+    def closes(self, d: date) -> np.ndarray:
+        raw = self.base_price * np.exp(self._cum_log_return(d))
+        return np.maximum(np.round(raw), 1.0)
+
+    def _prev_business_day(self, d: date) -> date:
+        prev = d - timedelta(days=1)
+        while prev.weekday() >= 5:
+            prev -= timedelta(days=1)
+        return prev
+
+    # --- 各フィードのDataFrame ---
+    def prices_frame(self, d: date) -> pd.DataFrame:
+        rng = np.random.default_rng([self.seed, d.toordinal(), 1])
+        n = len(self.codes)
+        close = self.closes(d)
+        prev_close = self.closes(self._prev_business_day(d))
+        spread = close * rng.uniform(0.0, 0.03, size=n)
+        open_ = np.round(close + rng.uniform(-1, 1, size=n) * spread)
+        high = np.maximum.reduce([open_, close]) + np.round(spread * rng.uniform(0, 1, size=n))
+        low = np.maximum(np.minimum.reduce([open_, close]) - np.round(spread * rng.uniform(0, 1, size=n)), 1)
+        volume = np.round(np.exp(rng.normal(11, 1.5, size=n)), -2)
+        change = close - prev_close
+
+        df = pd.DataFrame({
+            'SC': self.codes, '名称': self.names, '市場': self.markets, '業種': self.industries,
+            '日付': d.strftime('%Y/%m/%d'), '時刻': '15:00',
+            '株価': close, '前日比': change, '前日比（％）': np.round(change / prev_close * 100, 2),
+            '前日終値': prev_close, '始値': open_, '高値': high, '安値': low,
+            'VWAP': np.round((high + low + close) / 3, 2), '出来高': volume,
+            '出来高率': np.round(rng.uniform(0.1, 5, size=n), 2),
+            '売買代金（千円）': np.round(volume * close / 1000),
+            '時価総額（百万円）': np.round(close * self.shares / 1_000_000),
+            '値幅下限': np.round(prev_close * 0.8), '値幅上限': np.round(prev_close * 1.2),
+            '高値日付': d.strftime('%Y/%m/%d'), '年初来高値': high,
+            '年初来高値乖離率': 0.0, '安値日付': d.strftime('%Y/%m/%d'), '年初来安値': low, '年初来安値乖離率': 0.0,
+        }, columns=PRICES_HEADER)
+
+        # 売買停止銘柄: 実データ同様、価格系カラムが '-' になる
+        halted = rng.random(n) < self.halt_ratio
+        if halted.any():
+            price_cols = ['株価', '前日比', '前日比（％）', '始値', '高値', '安値', 'VWAP']
+            df[price_cols] = df[price_cols].astype(object)
+            df.loc[halted, price_cols] = '-'
+            df.loc[halted, ['出来高', '売買代金（千円）']] = 0
+        return df
+
+    def financials_frame(self, d: date) -> pd.DataFrame:
+        close = self.closes(d)
+        return pd.DataFrame({
+            'SC': self.codes, '名称': self.names, '市場': self.markets, '業種': self.industries,
+            '時価総額（百万円）': np.round(close * self.shares / 1_000_000),
+            '発行済株式数': self.shares,
+            '配当利回り（予想）': np.round(self.dps / close * 100, 2),
+            '1株配当（予想）': self.dps,
+            'PER（予想）': np.round(close / np.maximum(self.eps, 0.1), 2),
+            'PBR（実績）': np.round(close / self.bps, 2),
+            'EPS（予想）': self.eps, 'BPS（実績）': self.bps,
+            '最低投資金額': close * 100, '単元株': 100,
+        }, columns=FINANCIALS_HEADER)
+
+    def margin_frame(self, d: date) -> pd.DataFrame:
+        rng = np.random.default_rng([self.seed, d.toordinal(), 3])
+        # 信用残は貸借・信用銘柄のみ (全体の6割程度)
+        mask = np.random.default_rng(self.seed + 3).random(len(self.codes)) < 0.6
+        codes = self.codes[mask]
+        n = len(codes)
+        sell_ins = np.round(np.exp(rng.normal(10, 1.5, size=n)), -2)
+        buy_ins = np.round(np.exp(rng.normal(11, 1.5, size=n)), -2)
+        sell_gen = np.round(sell_ins * rng.uniform(0, 0.3, size=n), -2)
+        buy_gen = np.round(buy_ins * rng.uniform(0, 0.3, size=n), -2)
+        sell = sell_ins + sell_gen
+        buy = buy_ins + buy_gen
+        diff = lambda x: np.round(x * rng.uniform(-0.1, 0.1, size=n), -2)
+        return pd.DataFrame({
+            'SC': codes, '公表日': d.strftime('%Y/%m/%d'),
+            '信用取引区分': rng.choice(['貸借', '信用'], size=n, p=[0.7, 0.3]),
+            '信用売残': sell, '信用売残 前週比': diff(sell),
+            '信用買残': buy, '信用買残 前週比': diff(buy),
+            '貸借倍率': np.round(buy / np.maximum(sell, 1), 2),
+            '制度信用売残': sell_ins, '制度信用売残 前週比': diff(sell_ins),
+            '制度信用買残': buy_ins, '制度信用買残 前週比': diff(buy_ins),
+            '一般信用売残': sell_gen, '一般信用売残 前週比': diff(sell_gen),
+            '一般信用買残': buy_gen, '一般信用買残 前週比': diff(buy_gen),
+        }, columns=MARGIN_HEADER)
+
+    def indices_frame(self, d: date) -> pd.DataFrame:
+        close_all = self.closes(d)
+        prev_all = self.closes(self._prev_business_day(d))
+        cap = close_all * self.shares
+        prev_cap = prev_all * self.shares
+
+        groups = [np.ones(len(self.codes), dtype=bool)] + [self.industries == name for name in INDUSTRIES]
+        rows = []
+        for code, name, mask in zip(self.index_codes, self.index_names, groups):
+            cur, prev = cap[mask].sum(), prev_cap[mask].sum()
+            close = round(cur / 1e9, 2)
+            prev_close = round(prev / 1e9, 2)
+            rows.append([
+                code, name, d.strftime('%Y/%m/%d'), close, round(close - prev_close, 2),
+                round((close / prev_close - 1) * 100, 2) if prev_close else 0.0, prev_close,
+                round(cur / 1e6), round((cur - prev) / 1e6), round(prev / 1e6), round(cur / 1e6),
+                round(cur / 1e6), int(mask.sum()), int(self.shares[mask].sum() // 100),
+            ])
+        return pd.DataFrame(rows, columns=INDICES_HEADER)
+
+    # --- CSVバイト列 ---
+    def csv_bytes(self, feed: str, date_str: str):
+        """フィード名と日付から cp932 のCSVを返す。公開されない日は None"""
+        d = datetime.strptime(date_str, '%Y%m%d').date()
+        if d.weekday() >= 5:
+            return None
+
+        if feed == 'japan-all-stock-prices-2':
+            df = self.prices_frame(d)
+        elif feed == 'japan-all-stock-data':
+            df = self.financials_frame(d)
+        elif feed == 'tosho-stock-margin-transactions-2':
+            if d.weekday() != 1:  # 信用残は火曜公表
+                return None
+            df = self.margin_frame(d)
+        elif feed == 'tosho-index-data':
+            df = self.indices_frame(d)
+        else:
+            return None
+
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False)
+        return buffer.getvalue().encode(ENCODING)
+
+
+def _make_handler(dataset: KabuPlusDataset, user: str, password: str):
+    expected_auth = 'Basic ' + base64.b64encode(f'{user}:{password}'.encode()).decode()
+
+    @lru_cache(maxsize=64)
+    def cached_csv(feed: str, date_str: str):
+        return dataset.csv_bytes(feed, date_str)
+
+    lock = threading.Lock()  # データセットのメモ化は非スレッドセーフなので直列化する
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.headers.get('Authorization') != expected_auth:
+                self.send_response(401)
+                self.send_header('WWW-Authenticate', 'Basic realm="kabu.plus"')
+                self.end_headers()
+                return
+
+            m = PATH_PATTERN.search(self.path)
+            body = None
+            if m:
+                with lock:
+                    body = cached_csv(m.group('feed'), m.group('date'))
+            if body is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', f'text/csv; charset={ENCODING}')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # ベンチマーク出力を汚さない
+
+    return Handler
+
+
+@contextmanager
+def serve_stub(dataset: KabuPlusDataset, user: str = 'bench', password: str = 'bench', port: int = 0):
+    """
+    スタブサーバーをバックグラウンドで起動し、KABU_PLUS_BASE_URL に相当するURLを返す。
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), _make_handler(dataset, user, password))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}/kabu.plus/csv/'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    import time
+
+    dataset = KabuPlusDataset()
+    with serve_stub(dataset, port=8765) as base_url:
+        print(f'✅ 株・プラス スタブ起動: {base_url} (user=bench / password=bench)')
+        print('Ctrl+C で停止します。')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
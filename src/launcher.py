@@ -0,0 +1,94 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+# Bot を複数プロセス (シャード) で起動する。
+# Discord のシャードをプロセスに振り分け (プロセス i はシャード i, i+N, i+2N, ... を担当)、
+# 各プロセスは src/shared_cache.py の共有キャッシュ (チャート・AI分析・銘柄データ) を同じファイルで使う。
+# 異常終了したプロセスは待ち時間を伸ばしながら再起動する (正常終了したプロセスは再起動しない)。
+
+RESTART_BACKOFF = 5       # 再起動までの初回の待ち時間 (秒)。連続で落ちるたびに倍にする
+MAX_BACKOFF = 300
+STABLE_SECONDS = 60       # これ以上動いていれば正常に起動できたとみなし、待ち時間を戻す
+
+
+def shard_assignment(processes: int, shard_count: int) -> list:
+    """プロセスごとの担当シャードのリストを返す"""
+    return [list(range(i, shard_count, processes)) for i in range(processes)]
+
+
+def _spawn(shard_ids: list, shard_count: int, env: dict) -> subprocess.Popen:
+    cmd = [sys.executable, '-m', 'src.main',
+           '--shard-ids', ','.join(map(str, shard_ids)), '--shard-count', str(shard_count)]
+    print(f"🚀 シャード {shard_ids} / 全{shard_count} を起動します。")
+    return subprocess.Popen(cmd, env=env)
+
+
+def run(processes: int, shard_count: int = None):
+    """processes 個の Bot プロセスを起動し、終了するまで監視する"""
+    shard_count = shard_count or processes
+    if shard_count < processes:
+        print("❌ Error: シャード数はプロセス数以上にしてください。")
+        return
+
+    env = dict(os.environ)
+    # チャート描画のプロセスプールは CPU を Bot プロセスで分け合う
+    env.setdefault('CHART_WORKERS', str(max(1, (os.cpu_count() or 1) // processes)))
+
+    assignments = shard_assignment(processes, shard_count)
+    workers = [{"shards": shards, "proc": _spawn(shards, shard_count, env),
+                "started": time.monotonic(), "backoff": RESTART_BACKOFF, "restart_at": None, "done": False}
+               for shards in assignments]
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for w in workers:
+            if w["proc"].poll() is None:
+                w["proc"].send_signal(signum)
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    while not stopping and not all(w["done"] for w in workers):
+        time.sleep(1)
+        now = time.monotonic()
+        for w in workers:
+            if stopping or w["done"]:
+                continue
+            if w["restart_at"] is not None:
+                if now >= w["restart_at"]:
+                    w["proc"] = _spawn(w["shards"], shard_count, env)
+                    w["started"], w["restart_at"] = now, None
+                continue
+            code = w["proc"].poll()
+            if code is None:
+                continue
+            if code == 0:
+                w["done"] = True
+                continue
+            if now - w["started"] >= STABLE_SECONDS:
+                w["backoff"] = RESTART_BACKOFF
+            print(f"⚠️ シャード {w['shards']} が終了しました (code {code})。{w['backoff']}秒後に再起動します。")
+            w["restart_at"] = now + w["backoff"]
+            w["backoff"] = min(w["backoff"] * 2, MAX_BACKOFF)
+
+    for w in workers:
+        try:
+            w["proc"].wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            w["proc"].kill()
+    print("--- 全プロセスを停止しました ---")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='株式分析Bot をシャードごとに複数プロセスで起動します。')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='起動する Bot プロセス数 (既定: CPU数)')
+    parser.add_argument('--shard-count', type=int, default=None, help='全体のシャード数 (既定: プロセス数)')
+    args = parser.parse_args()
+    run(args.processes, args.shard_count)
@@ -1,87 +1,219 @@
 import os
+import argparse
+import asyncio
+import tempfile
+from datetime import datetime
 import discord
 from dotenv import load_dotenv
-from src.data_loader import fetch_data
-from src.chart_generator import generate_charts
-from src.analyzer import generate_analysis
+from src.data_loader import fetch_multiple
+from src.chart_generator import generate_charts_batch, start_pool
+from src.analyzer import generate_analysis_stream, generate_comparison_stream
+from src.discord_stream import deliver_stream
+from src.exporter import export_data
+from src.quote_provider import get_latest_quotes, merge_quote
 
 
 # .envファイルを読み込み、環境変数として設定します
 load_dotenv()
 TOKEN = os.getenv('DISCORD_BOT_TOKEN')
+# Discordの添付ファイル上限 (MB)。ブーストなしのサーバーは8MB
+UPLOAD_LIMIT_MB = float(os.getenv('DISCORD_UPLOAD_LIMIT_MB', '8'))
+# 1回のコマンドで分析できる銘柄数 (Discordの1メッセージの添付ファイル上限は10)
+MAX_CODES = 10
 
 # Discord Botの設定
 intents = discord.Intents.default()
 # コマンドを読み込むためにMESSAGE CONTENT INTENTを有効化
 intents.message_content = True 
-client = discord.Client(intents=intents)
+client = None  # create_client() で作成する (1プロセスにつき1つ)
+
+def _is_valid_date(text: str) -> bool:
+    """YYYYMMDD 形式の実在する日付か"""
+    if len(text) != 8:
+        return False
+    try:
+        datetime.strptime(text, '%Y%m%d')
+    except ValueError:
+        return False
+    return True
 
-@client.event
 async def on_ready():
     print(f'✅ Bot Login Successful: {client.user} としてログインしました。')
-    print("--- 動作確認用Discordで /analyze 証券コード を試してください ---")
+    if client.shard_count:
+        print(f"--- 担当シャード: {sorted(client.shards)} / 全{client.shard_count}シャード (pid {os.getpid()}) ---")
+    print("--- 動作確認用Discordで /analyze 証券コード (複数可) または /compare を試してください ---")
+
+async def analyze_codes(channel, codes: list):
+    """
+    1銘柄以上の分析を行う。DB読み出しは全銘柄まとめて1回、チャートは並列に描画し、
+    2銘柄以上の場合は1回のGeminiリクエストで比較レポートを作成する。
+    """
+    label = ', '.join(codes)
+
+    # --- 1. データ取得フェーズ ---
+    await channel.send(f'**{label}** のデータ取得を開始します。お待ちください...')
+
+    fetched = await asyncio.to_thread(fetch_multiple, codes)
+
+    if fetched.get("error"):
+        # データ取得エラーの場合
+        await channel.send(f'データ取得エラー: {fetched["error"]}')
+        return
+
+    analysis_data = fetched["results"]
+
+    # 当日の株価 (ザラ場) を共有キャッシュ経由でまとめて取得し、日足の末尾に反映する
+    quotes = await get_latest_quotes(codes)
+    for code, quote in quotes.items():
+        analysis_data[code]['stock_data'] = merge_quote(analysis_data[code]['stock_data'], quote)
+    names = ', '.join(f"{analysis_data[code]['company_name']} ({code})" for code in codes)
+
+    # --- 2. グラフ生成・送信フェーズ ---
+    await channel.send(f"### ✅ データ取得成功: {names}\n\n📈 グラフを生成しています。お待ちください...")
+
+    charts = await asyncio.to_thread(generate_charts_batch, {code: analysis_data[code]['stock_data'] for code in codes})
+
+    await channel.send(
+        content=f"**[{label}] ローソク足＆RSIチャート** (直近3ヶ月)",
+        files=[discord.File(charts[code]['file'], filename=charts[code]['filename']) for code in codes]
+    )
+
+    # --- 3. AI分析フェーズ ---
+    items = [
+        {
+            "company_name": analysis_data[code]["company_name"],
+            "code": code,
+            "summary": analysis_data[code]['company_summary'],
+            "stock_data": analysis_data[code]['stock_data'],
+            "financial_data": analysis_data[code]['financial_data'],
+            "chart_buffer": charts[code]['file'],
+            "margin_data": analysis_data[code].get('margin_data'),
+            "sector_data": analysis_data[code].get('sector_data'),
+        }
+        for code in codes
+    ]
+
+    if len(items) == 1:
+        await channel.send("🧠 **Gemini AIによる詳細分析を開始します...**")
+        # プロンプト組み立て (チャート縮小を含む) はイベントループを止めないよう別スレッドで実行
+        analysis_result = await asyncio.to_thread(generate_analysis_stream, **items[0])
+    else:
+        await channel.send(f"🧠 **Gemini AIによる{len(items)}銘柄の比較分析を開始します...**")
+        analysis_result = await asyncio.to_thread(generate_comparison_stream, items)
+
+    if analysis_result.get("error"):
+        await channel.send(f"AI分析エラー: {analysis_result['error']}")
+        return
+
+    # 生成されたテキストを順次Discordに表示 (2,000文字を超える分はセクション単位で分割)
+    try:
+        await deliver_stream(channel, analysis_result['stream'])
+    except Exception as e:
+        await channel.send(f"AI分析エラー: Gemini API実行中にエラーが発生しました: {e}")
 
-@client.event
 async def on_message(message):
     if message.author == client.user:
         return
 
-    # /analyze コマンドの処理
-    if message.content.startswith('/analyze'):
+    # /analyze, /compare コマンドの処理
+    # /analyze 7203 7267 7201 のように複数銘柄を指定した場合は /compare と同じく比較レポートを作成する
+    if message.content.startswith('/analyze') or message.content.startswith('/compare'):
         # すべての処理をこのブロックで囲むことで、実行中はDiscordに「入力中...」を表示し続ける
         async with message.channel.typing():
             try:
-                parts = message.content.split(' ')
-                code = parts[1]
-                
-                # --- 1. データ取得フェーズ ---
-                await message.channel.send(f'**{code}** のデータ取得を開始します。お待ちください...')
-
-                analysis_data = fetch_data(code) 
-                
-                if analysis_data.get("error"):
-                    # 認証エラーやデータ取得エラーの場合
-                    await message.channel.send(f'データ取得エラー: {analysis_data["error"]}')
+                parts = message.content.split()
+                codes = list(dict.fromkeys(parts[1:]))  # 重複を除き、指定順を保つ
+                if not codes:
+                    raise IndexError
+                if parts[0] == '/compare' and len(codes) < 2:
+                    await message.channel.send('エラー: 比較する証券コードを2つ以上入力してください。例: `/compare 7203 7267 7201`')
                     return
-                    
-                company = analysis_data["company_name"]
-                
-                # --- 2. グラフ生成・送信フェーズ ---
-                await message.channel.send(f"### ✅ データ取得成功: {company} ({code})\n\n📈 グラフを生成しています。お待ちください...")
-                    
-                chart_info = generate_charts(analysis_data['stock_data'], code)
-                    
-                await message.channel.send(
-                    content=f"**[{code}] ローソク足＆RSIチャート** (直近3ヶ月)",
-                    file=discord.File(chart_info['file'], filename=chart_info['filename'])
-                )
-
-                # --- 3. AI分析フェーズ ---
-                await message.channel.send("🧠 **Gemini AIによる詳細分析を開始します...**")
-                
-                analysis_result = generate_analysis(
-                    company_name=company,
-                    code=code,
-                    summary=analysis_data['company_summary'],
-                    stock_data=analysis_data['stock_data'],
-                    financial_data=analysis_data['financial_data'],
-                    chart_buffer=chart_info['file']
-                )
-
-                if analysis_result.get("error"):
-                    await message.channel.send(f"AI分析エラー: {analysis_result['error']}")
+                if len(codes) > MAX_CODES:
+                    await message.channel.send(f'エラー: 一度に指定できる証券コードは{MAX_CODES}件までです。')
                     return
+                await analyze_codes(message.channel, codes)
 
-                # AIレポートをDiscordに送信
-                await message.channel.send(analysis_result['report'])
-                                        
             except IndexError:
-                await message.channel.send('エラー: 証券コードを入力してください。例: `/analyze 7203`')
+                await message.channel.send('エラー: 証券コードを入力してください。例: `/analyze 7203` または `/analyze 7203 7267 7201`')
             except Exception as e:
                 # その他の予期せぬエラー
                 await message.channel.send(f'予期せぬエラーが発生しました: {e}')
 
-if TOKEN:
-    client.run(TOKEN)
-else:
-    print("❌ Error: .envファイルにDISCORD_BOT_TOKENが設定されていません。")
+    # /export コマンドの処理
+    elif message.content.startswith('/export'):
+        async with message.channel.typing():
+            try:
+                parts = message.content.split()
+                if len(parts) < 5:
+                    await message.channel.send('エラー: 引数が不足しています。例: `/export 7200 7299 20240101 20241231 [csv|parquet]`')
+                    return
+                code_from, code_to, date_from, date_to = parts[1:5]
+                invalid = [d for d in (date_from, date_to) if not _is_valid_date(d)]
+                if invalid:
+                    await message.channel.send(f'エラー: 日付は YYYYMMDD 形式で指定してください ({", ".join(invalid)})。例: `20240101`')
+                    return
+                if date_from > date_to:
+                    await message.channel.send(f'エラー: 開始日 ({date_from}) が終了日 ({date_to}) より後になっています。')
+                    return
+                fmt = parts[5] if len(parts) > 5 else 'csv'
+                if fmt not in ('csv', 'parquet'):
+                    await message.channel.send('エラー: 出力形式は `csv` または `parquet` を指定してください。')
+                    return
+
+                await message.channel.send(f'**{code_from}〜{code_to}** / **{date_from}〜{date_to}** のデータを書き出しています...')
+
+                filename = f"export_{code_from}-{code_to}_{date_from}-{date_to}." + ('parquet' if fmt == 'parquet' else 'csv.gz')
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    path = os.path.join(tmpdir, filename)
+                    # DB読み出しと圧縮はイベントループを止めないよう別スレッドで実行
+                    count = await asyncio.to_thread(export_data, path, code_from, code_to, date_from, date_to, fmt)
+
+                    if count == 0:
+                        await message.channel.send('該当するデータがありません。')
+                        return
+
+                    size_mb = os.path.getsize(path) / 1024 / 1024
+                    if size_mb > UPLOAD_LIMIT_MB:
+                        await message.channel.send(
+                            f'エラー: ファイルサイズ ({size_mb:.1f}MB) がアップロード上限 ({UPLOAD_LIMIT_MB:.0f}MB) を超えています。'
+                            '範囲を狭めて再実行してください。'
+                        )
+                        return
+
+                    await message.channel.send(
+                        content=f"✅ {count}件を書き出しました ({size_mb:.1f}MB)",
+                        file=discord.File(path, filename=filename)
+                    )
+
+            except ImportError as e:
+                await message.channel.send(f'エラー: {e}')
+            except Exception as e:
+                await message.channel.send(f'予期せぬエラーが発生しました: {e}')
+
+def create_client(shard_ids: list = None, shard_count: int = None) -> discord.Client:
+    """
+    Discordクライアントを作成し、イベントハンドラを登録する。
+    shard_count を指定した場合は AutoShardedClient として、shard_ids のシャードだけに接続する
+    (複数プロセスでシャードを分担する場合。src/launcher.py を参照)。
+    """
+    global client
+    if shard_count:
+        client = discord.AutoShardedClient(intents=intents, shard_ids=shard_ids, shard_count=shard_count)
+    else:
+        client = discord.Client(intents=intents)
+    client.event(on_ready)
+    client.event(on_message)
+    return client
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='株式分析Discord Bot')
+    parser.add_argument('--shard-ids', default=None, help='このプロセスが担当するシャード (例: 0,2)')
+    parser.add_argument('--shard-count', type=int, default=None, help='全体のシャード数')
+    args = parser.parse_args()
+    shard_ids = [int(x) for x in args.shard_ids.split(',')] if args.shard_ids else None
+
+    if TOKEN:
+        start_pool()  # 描画用のワーカーを先に起動しておく
+        create_client(shard_ids, args.shard_count).run(TOKEN)
+    else:
+        print("❌ Error: .envファイルにDISCORD_BOT_TOKENが設定されていません。")
@@ -0,0 +1,306 @@
+import hashlib
+import io
+import math
+import os
+from collections import OrderedDict
+
+import pandas as pd
+from PIL import Image
+
+# Gemini へのプロンプト組み立て。
+# 生のDataFrameを埋め込む代わりに、事前計算した指標から決定的で短い要約を作り、
+# チャート画像は設定した解像度に縮小 (同じ画像は再利用) したうえで、トークン予算内に収める。
+
+# 環境変数で上書き可能な設定
+TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '1500'))   # テキスト + 画像の合計トークン上限
+CHART_WIDTH = int(os.getenv('PROMPT_CHART_WIDTH', '768'))      # 送信するチャート画像の最大幅 (px)
+
+# Gemini の画像トークン: 両辺384px以下なら258トークン、それ以上は768pxタイルごとに258トークン
+IMAGE_TOKENS_PER_TILE = 258
+SMALL_IMAGE_SIDE = 384
+TILE_SIDE = 768
+
+_CHART_CACHE_SIZE = 32
+_chart_cache = OrderedDict()  # (画像ハッシュ, 幅) -> (PNGバイト列, (幅, 高さ))
+
+
+# --- トークン見積もり ---
+def estimate_tokens(text: str) -> int:
+    """
+    テキストのトークン数を見積もる (ローカル計算)。
+    英数字は約4文字で1トークン、日本語などの非ASCII文字は1文字1トークンとみなす。
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """画像サイズから Gemini の画像トークン数を見積もる"""
+    if width <= SMALL_IMAGE_SIDE and height <= SMALL_IMAGE_SIDE:
+        return IMAGE_TOKENS_PER_TILE
+    return math.ceil(width / TILE_SIDE) * math.ceil(height / TILE_SIDE) * IMAGE_TOKENS_PER_TILE
+
+
+def estimate_contents_tokens(contents) -> int:
+    """generate_content に渡す contents (文字列と画像パートのリスト) のトークン数を見積もる"""
+    if isinstance(contents, str):
+        return estimate_tokens(contents)
+    total = 0
+    for part in contents:
+        if isinstance(part, str):
+            total += estimate_tokens(part)
+            continue
+        data = getattr(getattr(part, 'inline_data', None), 'data', None)
+        if data:
+            with Image.open(io.BytesIO(data)) as img:
+                total += estimate_image_tokens(*img.size)
+    return total
+
+
+# --- チャート画像 ---
+def prepare_chart(chart_buffer: io.BytesIO, max_width: int = None):
+    """
+    チャート画像を max_width 以下に縮小した PNG を返す。同じ画像・幅の組み合わせはキャッシュを再利用する。
+
+    Returns:
+        (PNGバイト列, (幅, 高さ))
+    """
+    max_width = max_width or CHART_WIDTH
+    data = chart_buffer.getvalue()
+    key = (hashlib.sha1(data).hexdigest(), max_width)
+    if key in _chart_cache:
+        _chart_cache.move_to_end(key)
+        return _chart_cache[key]
+
+    with Image.open(io.BytesIO(data)) as img:
+        if img.width > max_width:
+            height = max(1, round(img.height * max_width / img.width))
+            img = img.convert('RGB').resize((max_width, height), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format='PNG', optimize=True)
+        result = (out.getvalue(), img.size)
+
+    _chart_cache[key] = result
+    if len(_chart_cache) > _CHART_CACHE_SIZE:
+        _chart_cache.popitem(last=False)
+    return result
+
+
+# --- 要約の作成 ---
+def _pct(a, b) -> str:
+    if b is None or pd.isna(b) or b == 0 or pd.isna(a):
+        return '-'
+    return f"{(a / b - 1) * 100:+.1f}%"
+
+
+def _num(x, digits: int = 1) -> str:
+    if x is None or pd.isna(x):
+        return '-'
+    return f"{x:,.{digits}f}"
+
+
+def price_features(stock_data: pd.DataFrame) -> dict:
+    """株価データ (Close/Volume 列) からテクニカル指標を計算する"""
+    close = stock_data['Close'].dropna()
+    latest = close.iloc[-1]
+
+    def back(n):
+        return close.iloc[-n - 1] if len(close) > n else None
+
+    if 'RSI' in stock_data.columns and not pd.isna(stock_data['RSI'].iloc[-1]):
+        rsi = stock_data['RSI'].iloc[-1]  # チャート生成時に計算済みのものを再利用
+    else:
+        delta = close.diff()
+        avg_gain = delta.clip(lower=0).ewm(com=13, adjust=False).mean()
+        avg_loss = (-delta.clip(upper=0)).ewm(com=13, adjust=False).mean()
+        rsi = (100 - 100 / (1 + avg_gain / avg_loss)).iloc[-1]
+
+    features = {
+        '終値': _num(latest),
+        '前日比': _pct(latest, back(1)),
+        '1週': _pct(latest, back(5)),
+        '1ヶ月': _pct(latest, back(20)),
+        '3ヶ月': _pct(latest, back(60)),
+        'RSI14': _num(rsi),
+        '52週高値': _num(close.iloc[-250:].max()),
+        '52週安値': _num(close.iloc[-250:].min()),
+        '20日ボラ(年率)': f"{close.pct_change().iloc[-20:].std() * (250 ** 0.5) * 100:.1f}%" if len(close) > 20 else '-',
+    }
+    for n in (5, 25, 75):
+        if len(close) >= n:
+            ma = close.iloc[-n:].mean()
+            features[f'MA{n}乖離'] = _pct(latest, ma)
+    if 'Volume' in stock_data.columns and len(stock_data) > 20:
+        volume = stock_data['Volume']
+        features['出来高(20日平均比)'] = f"{volume.iloc[-1] / volume.iloc[-21:-1].mean():.2f}倍"
+    return features
+
+
+def margin_features(margin_data: pd.DataFrame) -> dict:
+    """信用残 (date 昇順, buy_balance_total / sell_balance_total / ratio 列) の特徴量"""
+    latest = margin_data.iloc[-1]
+    prev = margin_data.iloc[-5] if len(margin_data) >= 5 else margin_data.iloc[0]
+    return {
+        '信用倍率': _num(latest.get('ratio'), 2),
+        '買残(4週変化)': _pct(latest.get('buy_balance_total'), prev.get('buy_balance_total')),
+        '売残(4週変化)': _pct(latest.get('sell_balance_total'), prev.get('sell_balance_total')),
+    }
+
+
+def _format_features(features: dict) -> str:
+    """辞書を 'キー:値' のパイプ区切り1行にする (表より少ないトークンで済む)"""
+    return ' | '.join(f"{k}:{v}" for k, v in features.items())
+
+
+def _format_financials(financial_data: pd.DataFrame, rows: int = 5) -> str:
+    """日次の財務指標 (daily_financials) を直近 rows 営業日分のCSVにする (Markdown表より記号が少なくトークンが少ない)"""
+    return financial_data.tail(rows).to_csv(index=False, float_format='%.4g').strip()
+
+
+INSTRUCTIONS = (
+    "【依頼】\n"
+    "1. テクニカル: チャート画像と指標から、トレンド(上昇/下降/レンジ)と短期シグナルを評価\n"
+    "2. ファンダメンタルズ: 直近のPER・PBR・配当利回りなどのバリュエーション指標から割安感を評価\n"
+    "3. 総合見解: 強気/中立/弱気 とその理由を簡潔に"
+)
+
+
+def build_prompt(
+    company_name: str,
+    code: str,
+    summary: str,
+    stock_data: pd.DataFrame,
+    financial_data: pd.DataFrame,
+    chart_buffer: io.BytesIO = None,
+    margin_data: pd.DataFrame = None,
+    sector_data: dict = None,
+    system_prompt: str = '',
+    token_budget: int = None,
+    chart_width: int = None,
+) -> dict:
+    """
+    トークン予算内に収まるプロンプトを組み立てる。
+    必須セクション (銘柄情報・株価指標・依頼事項) を入れた後、優先度順に任意セクションを追加し、
+    予算を超える場合はチャートを縮小 → 低優先度のセクションから省略する。
+
+    Returns:
+        {"text": プロンプト本文, "image": PNGバイト列または None, "tokens": 見積もりトークン数, "omitted": 省略したセクション名}
+    """
+    budget = token_budget or TOKEN_BUDGET
+
+    required = [
+        f"【銘柄】{company_name} ({code})",
+        f"【株価指標】{_format_features(price_features(stock_data))}",
+    ]
+    # (セクション名, 本文) を優先度順に並べる
+    optional = []
+    if financial_data is not None and not financial_data.empty:
+        optional.append(('財務', f"【財務(直近5営業日)】\n{_format_financials(financial_data)}"))
+    if margin_data is not None and not margin_data.empty:
+        optional.append(('需給', f"【需給】{_format_features(margin_features(margin_data))}"))
+    if sector_data:
+        optional.append(('業種', f"【業種】{_format_features(sector_data)}"))
+    if summary:
+        optional.append(('概要', f"【概要】{summary}"))
+
+    used = estimate_tokens(system_prompt) + sum(estimate_tokens(s) for s in required) + estimate_tokens(INSTRUCTIONS)
+
+    # チャート: 指定幅で予算に収まらなければ最小サイズ (1タイル) に落とし、それでも収まらなければ省略
+    image = None
+    if chart_buffer is not None:
+        png, (w, h) = prepare_chart(chart_buffer, chart_width)
+        if used + estimate_image_tokens(w, h) > budget:
+            # 384px四方に収まる幅まで縮小する
+            png, (w, h) = prepare_chart(chart_buffer, max(1, min(SMALL_IMAGE_SIDE, SMALL_IMAGE_SIDE * w // h)))
+        if used + estimate_image_tokens(w, h) <= budget:
+            image = png
+            used += estimate_image_tokens(w, h)
+
+    sections = list(required)
+    omitted = [] if image is not None or chart_buffer is None else ['チャート']
+    for name, text in optional:
+        cost = estimate_tokens(text)
+        if used + cost <= budget:
+            sections.append(text)
+            used += cost
+        else:
+            omitted.append(name)
+
+    sections.append(INSTRUCTIONS)
+    return {"text": '\n'.join(sections), "image": image, "tokens": used, "omitted": omitted}
+
+
+COMPARE_INSTRUCTIONS = (
+    "【依頼】\n"
+    "1. テクニカル: 各銘柄のチャート画像と指標から、トレンドと短期シグナルを比較\n"
+    "2. ファンダメンタルズ: PER・PBR・配当利回りなどのバリュエーション指標から割安感を銘柄間で比較\n"
+    "3. 総合見解: 銘柄ごとに 強気/中立/弱気 を示し、最も魅力的な銘柄とその理由を簡潔に"
+)
+
+
+def build_comparison_prompt(
+    items: list,
+    system_prompt: str = '',
+    token_budget: int = None,
+    chart_width: int = None,
+) -> dict:
+    """
+    複数銘柄を1回のリクエストで比較するプロンプトを組み立てる。
+    items は build_prompt と同じキー (company_name, code, summary, stock_data, financial_data,
+    chart_buffer, margin_data, sector_data) を持つ辞書のリスト。
+    予算の既定値は銘柄数 x TOKEN_BUDGET。チャートは既定で1タイル (384px四方) に縮小し、
+    任意セクションは銘柄横断で優先度順 (全銘柄の財務 → 需給 → ...) に追加する。
+
+    Returns:
+        {"text": プロンプト本文, "images": [(ラベル, PNGバイト列)], "tokens": 見積もりトークン数, "omitted": 省略したセクション名}
+    """
+    budget = token_budget or TOKEN_BUDGET * len(items)
+
+    blocks = []     # 銘柄ごとのセクションのリスト
+    optional = []   # (優先度, 銘柄の位置, セクション名, 本文)
+    for i, item in enumerate(items):
+        blocks.append([
+            f"【銘柄{i + 1}】{item['company_name']} ({item['code']})",
+            f"【株価指標】{_format_features(price_features(item['stock_data']))}",
+        ])
+        financial_data = item.get('financial_data')
+        margin_data = item.get('margin_data')
+        if financial_data is not None and not financial_data.empty:
+            optional.append((0, i, '財務', f"【財務(直近3営業日)】\n{_format_financials(financial_data, rows=3)}"))
+        if margin_data is not None and not margin_data.empty:
+            optional.append((1, i, '需給', f"【需給】{_format_features(margin_features(margin_data))}"))
+        if item.get('sector_data'):
+            optional.append((2, i, '業種', f"【業種】{_format_features(item['sector_data'])}"))
+        if item.get('summary'):
+            optional.append((3, i, '概要', f"【概要】{item['summary']}"))
+
+    used = estimate_tokens(system_prompt) + estimate_tokens(COMPARE_INSTRUCTIONS)
+    used += sum(estimate_tokens(s) for block in blocks for s in block)
+
+    images = []
+    omitted = []
+    for item in items:
+        if item.get('chart_buffer') is None:
+            continue
+        label = f"[チャート] {item['company_name']} ({item['code']})"
+        png, (w, h) = prepare_chart(item['chart_buffer'], chart_width or CHART_WIDTH)
+        if not chart_width:
+            # 384px四方に収まる幅まで縮小する
+            png, (w, h) = prepare_chart(item['chart_buffer'], max(1, min(SMALL_IMAGE_SIDE, SMALL_IMAGE_SIDE * w // h)))
+        cost = estimate_image_tokens(w, h) + estimate_tokens(label)
+        if used + cost <= budget:
+            images.append((label, png))
+            used += cost
+        else:
+            omitted.append(f"チャート({item['code']})")
+
+    for _, i, name, text in sorted(optional, key=lambda x: (x[0], x[1])):
+        cost = estimate_tokens(text)
+        if used + cost <= budget:
+            blocks[i].append(text)
+            used += cost
+        else:
+            omitted.append(f"{name}({items[i]['code']})")
+
+    sections = ['\n'.join(block) for block in blocks] + [COMPARE_INSTRUCTIONS]
+    return {"text": '\n\n'.join(sections), "images": images, "tokens": used, "omitted": omitted}
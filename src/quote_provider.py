@@ -0,0 +1,217 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+import threading
+import time
+from datetime import datetime, date
+
+import pandas as pd
+from dotenv import load_dotenv
+
+# 当日の株価 (ザラ場の気配) の取得。
+# QuoteProvider は複数銘柄を1回の上流呼び出しで取得するインターフェースで、株・プラスの実装とローカルのスタブを持つ。
+# QuoteCache は短いTTLのキャッシュで、同時に届いたリクエストは同じ上流呼び出しに相乗り (coalescing) させ、
+# 短い待ち時間 (BATCH_WINDOW) の間に集まった銘柄をまとめて1回で取得する。
+
+load_dotenv()
+QUOTE_PROVIDER = os.getenv('QUOTE_PROVIDER', 'kabuplus')          # kabuplus / stub / none
+QUOTE_TTL = float(os.getenv('QUOTE_TTL', '60'))                   # 取得した気配の有効期間 (秒)
+BATCH_WINDOW = float(os.getenv('QUOTE_BATCH_WINDOW', '0.05'))     # 上流呼び出しをまとめる待ち時間 (秒)
+MERGE_TAIL = 260  # 気配を反映するときに使う日足の行数 (52週分 + 余裕)
+
+QUOTE_COLUMNS = ['date', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+
+def parse_price_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    株価CSV (japan-all-stock-prices-2 形式) を気配の DataFrame (index: code, columns: QUOTE_COLUMNS) にする。
+    売買停止などで価格が '-' の銘柄は除く。
+    """
+    quotes = pd.DataFrame({
+        'date': pd.to_datetime(df['日付'].astype(str)).dt.strftime('%Y%m%d'),
+        'Open': pd.to_numeric(df['始値'], errors='coerce'),
+        'High': pd.to_numeric(df['高値'], errors='coerce'),
+        'Low': pd.to_numeric(df['安値'], errors='coerce'),
+        'Close': pd.to_numeric(df['株価'], errors='coerce'),
+        'Volume': pd.to_numeric(df['出来高'], errors='coerce'),
+    })
+    quotes.index = df['SC'].astype(str)
+    quotes.index.name = 'code'
+    return quotes.dropna(subset=['Close'])
+
+
+# --- 1. プロバイダ ---
+class QuoteProvider(ABC):
+    """気配の取得元。fetch_quotes は同期関数で、1回の呼び出しで複数銘柄を返す"""
+
+    @abstractmethod
+    def fetch_quotes(self, codes: list) -> pd.DataFrame:
+        """銘柄の気配を返す (index: code, columns: QUOTE_COLUMNS)"""
+
+
+class KabuPlusQuoteProvider(QuoteProvider):
+    """
+    株・プラスの最新の全銘柄株価CSV (日付なしのファイル名で当日分が随時更新される) から気配を取得する。
+    全銘柄が1ファイルに入っているため、何銘柄でも上流呼び出しは1回。
+    """
+
+    def __init__(self):
+        from src import batch_loader
+        self._batch_loader = batch_loader
+        self._session = batch_loader.make_session_with_retries()
+
+    def fetch_quotes(self, codes: list) -> pd.DataFrame:
+        url = f"{self._batch_loader.KABU_PLUS_BASE_URL}japan-all-stock-prices-2/daily/japan-all-stock-prices-2.csv"
+        df = self._batch_loader.fetch_csv_as_dataframe(url, self._session)
+        if df is None:
+            raise RuntimeError("株・プラスから当日の株価を取得できませんでした。")
+        quotes = parse_price_frame(df)
+        return quotes[quotes.index.isin(codes)]
+
+
+class StubQuoteProvider(QuoteProvider):
+    """
+    ローカル用の代替。kabu_plus_stub のデータセットから as_of 日の株価を気配として返す。
+    上流呼び出しの回数と要求された銘柄を記録するので、キャッシュの効果の確認に使える。
+    """
+
+    def __init__(self, dataset=None, as_of: date = None, latency: float = 0.0):
+        if dataset is None:
+            from src.kabu_plus_stub import KabuPlusDataset
+            dataset = KabuPlusDataset()
+        self.dataset = dataset
+        self.as_of = as_of or date.today()
+        self.latency = latency
+        self.calls = []
+        self._lock = threading.Lock()  # データセットのメモ化は非スレッドセーフなので直列化する
+
+    def fetch_quotes(self, codes: list) -> pd.DataFrame:
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls.append(list(codes))
+            quotes = parse_price_frame(self.dataset.prices_frame(self.as_of))
+        return quotes[quotes.index.isin(codes)]
+
+
+def make_provider(name: str = None):
+    """環境変数 QUOTE_PROVIDER に応じたプロバイダを返す。使えない場合は None"""
+    name = name or QUOTE_PROVIDER
+    if name == 'stub':
+        return StubQuoteProvider()
+    if name == 'kabuplus' and os.getenv('KABU_PLUS_USER') and os.getenv('KABU_PLUS_PASSWORD'):
+        return KabuPlusQuoteProvider()
+    return None
+
+
+# --- 2. キャッシュ ---
+class QuoteCache:
+    """
+    気配の短期キャッシュ (プロセス内で全コマンドが共有する)。asyncio のイベントループ上で使う。
+
+    - TTL 内の銘柄は上流を呼ばずに返す
+    - 取得中の銘柄を要求したリクエストは、その取得結果を待つ (同じ銘柄を二重に取得しない)
+    - 未取得の銘柄は batch_window の間集めてから、まとめて1回の fetch_quotes で取得する
+    """
+
+    def __init__(self, provider: QuoteProvider, ttl: float = QUOTE_TTL, batch_window: float = BATCH_WINDOW):
+        self.provider = provider
+        self.ttl = ttl
+        self.batch_window = batch_window
+        self.upstream_calls = 0
+        self._entries = {}     # code -> (取得時刻, 気配の辞書 または None)
+        self._inflight = {}    # code -> 取得結果を待つ Future
+        self._pending = set()  # 次の上流呼び出しで取得する銘柄
+        self._flush_task = None
+
+    async def get_quotes(self, codes: list) -> pd.DataFrame:
+        """銘柄の気配を返す (index: code)。上流にない銘柄は結果に含まれない"""
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        waiting = []
+        for code in dict.fromkeys(codes):
+            entry = self._entries.get(code)
+            if entry is not None and now - entry[0] < self.ttl:
+                continue
+            future = self._inflight.get(code)
+            if future is None:
+                future = loop.create_future()
+                self._inflight[code] = future
+                self._pending.add(code)
+            waiting.append(future)
+
+        if self._pending and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+        if waiting:
+            await asyncio.gather(*waiting)
+
+        rows = {code: self._entries[code][1] for code in codes
+                if code in self._entries and self._entries[code][1] is not None}
+        return pd.DataFrame.from_dict(rows, orient='index', columns=QUOTE_COLUMNS)
+
+    async def _flush(self):
+        await asyncio.sleep(self.batch_window)
+        codes = sorted(self._pending)
+        self._pending = set()
+        self._flush_task = None  # 取得中に届いた新しい銘柄は次のバッチに回す
+
+        try:
+            quotes = await asyncio.to_thread(self.provider.fetch_quotes, codes)
+        except Exception as e:
+            for code in codes:
+                self._inflight.pop(code).set_exception(e)
+            return
+        finally:
+            self.upstream_calls += 1
+
+        fetched_at = time.monotonic()
+        for code in codes:
+            row = quotes.loc[code].to_dict() if code in quotes.index else None
+            self._entries[code] = (fetched_at, row)  # 上流にない銘柄も TTL の間は再取得しない
+            self._inflight.pop(code).set_result(row)
+
+
+_cache = None
+
+
+async def get_latest_quotes(codes: list) -> dict:
+    """
+    既定のプロバイダ・共有キャッシュから気配を取得する。
+    取得に失敗した場合やプロバイダが設定されていない場合は空の辞書を返す (日足だけで分析を続ける)。
+
+    Returns:
+        {code: 気配の辞書}
+    """
+    global _cache
+    if _cache is None:
+        provider = make_provider()
+        if provider is None:
+            return {}
+        _cache = QuoteCache(provider)
+    try:
+        quotes = await _cache.get_quotes(codes)
+    except Exception as e:
+        print(f"⚠️ 当日の株価の取得に失敗しました: {e}")
+        return {}
+    return quotes.to_dict(orient='index')
+
+
+# --- 3. 日足への反映 ---
+def merge_quote(history: pd.DataFrame, quote: dict, tail: int = MERGE_TAIL) -> pd.DataFrame:
+    """
+    日足の履歴 (index: Date) に当日の気配を1行追加した DataFrame を返す。
+    履歴全体はコピーせず、末尾 tail 行のスライスと気配の1行だけを連結する (元の履歴は変更しない)。
+    履歴に同じ日付の足があれば気配で置き換え、気配が履歴の最終日より古ければ履歴をそのまま返す。
+    """
+    if not quote or history.empty:
+        return history
+    ts = pd.Timestamp(datetime.strptime(quote['date'], '%Y%m%d'))
+    last = history.index[-1]
+    if ts < last.normalize():
+        return history
+
+    base = history.iloc[-tail:]
+    if ts == last.normalize():
+        base = base.iloc[:-1]
+    row = pd.DataFrame([{col: quote.get(col) for col in history.columns}],
+                       index=pd.DatetimeIndex([ts], name=history.index.name))
+    return pd.concat([base, row])
@@ -0,0 +1,141 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+# 複数の Bot プロセス (シャード) で共有するディスクキャッシュ。
+# チャート画像・AI分析結果・銘柄データのスナップショットを SQLite の1ファイルに保存し、
+# どのプロセスが作った結果でも再利用できるようにする。
+#   - WAL + busy_timeout により、読み出しは書き込み中のプロセスを待たない (書き込み同士は SQLite のロックで直列化)
+#   - 値ごとに有効期限 (TTL) を持ち、合計サイズが上限を超えたら期限切れ → 最終アクセスが古い順に削除する
+#   - 読み出しは mmap 経由 (PRAGMA mmap_size) で、プロセス間で OS のページキャッシュを共有する
+
+CACHE_PATH = os.getenv('SHARED_CACHE_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'cache.db')
+CACHE_MAX_MB = float(os.getenv('SHARED_CACHE_MB', '256'))   # 0 の場合はキャッシュを無効にする
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 256 * 1024 * 1024
+EVICT_CHECK_INTERVAL = 50   # この回数の書き込みごとに合計サイズを確認する
+TOUCH_INTERVAL = 60         # 最終アクセス時刻の更新間隔 (秒)。読み出しのたびに書き込まないため
+
+
+class SharedCache:
+    """
+    SQLite をバックエンドにしたプロセス間共有の KV キャッシュ。値は pickle で保存する。
+    接続はプロセス・スレッドごとに作る (fork 後の子プロセスでは作り直す)。
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_mb: float = CACHE_MAX_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")  # キャッシュなので電源断時に直近の書き込みが失われてもよい
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB,
+                size INTEGER,
+                expires_at REAL,
+                accessed_at REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed_at)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: str, default=None):
+        """値を返す。ないか期限切れなら default"""
+        if not self.enabled:
+            return default
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires_at, accessed_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < now:
+            self.misses += 1
+            return default
+        if now - row[2] > TOUCH_INTERVAL:
+            conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key: str, value, ttl: float):
+        """値を ttl 秒間保存する"""
+        if not self.enabled:
+            return
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._conn()
+        conn.execute("""
+            INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (key, blob, len(blob), now + ttl, now))
+        self._writes += 1
+        if self._writes % EVICT_CHECK_INTERVAL == 0:
+            self.evict()
+
+    def evict(self, target_ratio: float = 0.9) -> int:
+        """
+        合計サイズが上限を超えていれば、期限切れ → 最終アクセスが古い順に削除し、上限の target_ratio まで減らす。
+        削除した件数を返す。
+        """
+        conn = self._conn()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+
+        removed = conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        excess = total - int(self.max_bytes * target_ratio)
+        if excess > 0:
+            keys = []
+            for key, size in conn.execute("SELECT key, size FROM cache ORDER BY accessed_at"):
+                keys.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM cache WHERE key = ?", keys)
+            removed += len(keys)
+        return removed
+
+    def clear(self):
+        if self.enabled:
+            self._conn().execute("DELETE FROM cache")
+
+
+_cache = None
+
+
+def get_cache() -> SharedCache:
+    """プロセス内で共有する SharedCache を返す"""
+    global _cache
+    if _cache is None:
+        _cache = SharedCache()
+    return _cache
+
+
+def configure(path: str = None, max_mb: float = None) -> SharedCache:
+    """保存先・上限を変更する (ベンチマークや検証用の一時ファイルなど)。max_mb=0 で無効"""
+    global _cache
+    _cache = SharedCache(path or CACHE_PATH, CACHE_MAX_MB if max_mb is None else max_mb)
+    return _cache
@@ -0,0 +1,220 @@
+import re
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from src.db_manager import date_to_day
+
+# 取り込み時のデータ品質チェック。
+# 1日分のDataFrameに対してベクトル化したチェックを行い、不正な行は quarantine テーブルへ退避する。
+#   - reject: DBに格納しない (指標・AIプロンプトを汚染するため)
+#   - warn:   DBには格納するが、quarantine に記録して後から確認できるようにする
+
+CODE_PATTERN = r'^\d{3}[0-9A-Z]$'  # 4桁の数字、または新形式の英字入りコード (例: 130A)
+MAX_DAILY_JUMP = 0.5         # 前日終値からの変化率がこれを超えたら警告 (株式分割などの可能性)
+MAX_MARKET_CAP_GAP = 0.05    # 株価CSVと財務CSVの時価総額の乖離がこれを超えたら警告
+
+PRICE_COLS = ['open', 'high', 'low', 'close', 'volume', 'trading_value', 'market_cap_total']
+FINANCIAL_COLS = ['market_cap', 'shares_outstanding', 'per_forecast', 'pbr_actual',
+                  'eps_forecast', 'bps_actual', 'dividend_yield', 'min_investment']
+MARGIN_COLS = ['sell_balance_total', 'buy_balance_total', 'ratio',
+               'sell_balance_ins', 'buy_balance_ins', 'sell_balance_gen', 'buy_balance_gen']
+INDEX_COLS = ['close', 'change_ratio', 'market_cap_index', 'volume', '銘柄数']
+
+
+class ValidationReport:
+    """1回のバッチ実行分のチェック結果を集計する"""
+
+    def __init__(self, run_id: str = None):
+        self.run_id = run_id or datetime.now().strftime('%Y%m%d%H%M%S')
+        self.stats = {}  # feed -> {'checked', 'rejected', 'warned', 'reasons': {reason: count}}
+
+    def add(self, feed: str, checked: int, issues: pd.DataFrame):
+        stat = self.stats.setdefault(feed, {'checked': 0, 'rejected': 0, 'warned': 0, 'reasons': {}})
+        stat['checked'] += checked
+        if issues is None or issues.empty:
+            return
+        stat['rejected'] += int((issues['severity'] == 'reject').sum())
+        stat['warned'] += int((issues['severity'] == 'warn').sum())
+        for reasons in issues['reason']:
+            for reason in reasons.split(';'):
+                stat['reasons'][reason] = stat['reasons'].get(reason, 0) + 1
+
+    def print_summary(self):
+        print(f"\n=== データ品質チェック結果 (run: {self.run_id}) ===")
+        if not self.stats:
+            print("  (チェック対象なし)")
+        for feed, stat in self.stats.items():
+            print(f"  - {feed}: {stat['checked']}件中 除外 {stat['rejected']}件 / 警告 {stat['warned']}件")
+            for reason, count in sorted(stat['reasons'].items(), key=lambda x: -x[1]):
+                print(f"      {reason}: {count}")
+
+    def save(self, conn: sqlite3.Connection):
+        """集計結果を validation_runs テーブルに記録する"""
+        conn.executemany("""
+            INSERT OR REPLACE INTO validation_runs (run_id, feed, checked, rejected, warned)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(self.run_id, feed, s['checked'], s['rejected'], s['warned']) for feed, s in self.stats.items()])
+
+
+# --- 共通処理 ---
+def _normalize_header(name: str) -> str:
+    """全角括弧・空白の揺れを吸収して比較する"""
+    return re.sub(r'\s', '', str(name)).replace('(', '（').replace(')', '）')
+
+
+def align_header(df: pd.DataFrame, candidates: list, label: str) -> pd.DataFrame:
+    """
+    CSVの列を期待するヘッダー (candidates のいずれかの列名リスト) にそろえた DataFrame を返す。
+    期待する列名がすべて (空白・括弧の表記揺れを除いて) 含まれていれば、位置ではなく列名で選び出すため、
+    列の並び替えや余分な列があっても値を取り違えない (並びがそのままのファイルは位置どおりの対応になる)。
+    足りない列がある場合は列ずれ・仕様変更とみなし、位置で付け替えずに KeyError を送出する。
+    """
+    normalized = [_normalize_header(c) for c in df.columns]
+    for expected in candidates:
+        wanted = [_normalize_header(c) for c in expected]
+        if all(w in normalized for w in wanted):
+            aligned = df.iloc[:, [normalized.index(w) for w in wanted]].copy()
+            aligned.columns = expected
+            return aligned
+    missing = [c for c in candidates[0] if _normalize_header(c) not in normalized]
+    raise KeyError(f"{label}: 期待する列がCSVにありません: {missing}")
+
+
+def to_numeric(df: pd.DataFrame, cols: list):
+    """'-' などのプレースホルダーを NaN に変換して数値型にそろえる"""
+    for col in cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+
+def _collect_issues(df: pd.DataFrame, checks: dict, severity: str) -> pd.DataFrame:
+    """
+    checks ({理由: boolマスク}) のいずれかに該当する行を抜き出し、理由を ';' 区切りで付与する。
+    判定はベクトル演算で行い、文字列の組み立ては該当行 (ごく少数) のみで行う。
+    """
+    masks = pd.DataFrame(checks, index=df.index).fillna(False).astype(bool)
+    hit = masks.any(axis=1)
+    if not hit.any():
+        return pd.DataFrame(columns=['code', 'severity', 'reason', 'raw'])
+
+    names = np.array(masks.columns)
+    hit_masks = masks[hit].to_numpy()
+    reasons = [';'.join(names[row]) for row in hit_masks]
+    rows = df[hit]
+    return pd.DataFrame({
+        'code': rows['code'].astype(str),
+        'severity': severity,
+        'reason': reasons,
+        'raw': [r.to_json(force_ascii=False) for _, r in rows.iterrows()],
+    }, index=rows.index)
+
+
+def _split(df: pd.DataFrame, rejects: dict, warns: dict):
+    """reject/warn のチェックを適用し、(格納する行, 問題のある行) を返す"""
+    rejected = _collect_issues(df, rejects, 'reject')
+    clean = df.drop(index=rejected.index)
+    warned = _collect_issues(clean, {k: v.reindex(clean.index) for k, v in warns.items()}, 'warn')
+    return clean, pd.concat([rejected, warned])
+
+
+def _code_invalid(df: pd.DataFrame) -> pd.Series:
+    return ~df['code'].astype(str).str.match(CODE_PATTERN)
+
+
+# --- フィード別チェック ---
+def validate_prices(df: pd.DataFrame, prev_close: pd.Series):
+    """
+    日足株価のチェック。prev_close は前営業日の終値 (index: code)。
+    """
+    to_numeric(df, PRICE_COLS)
+    rejects = {
+        'invalid_code': _code_invalid(df),
+        'missing_close': df['close'].isna(),
+        'non_positive_price': (df[['open', 'high', 'low', 'close']] <= 0).any(axis=1),
+        'ohlc_inconsistent': (df['high'] < df['low'])
+                             | (df['close'] > df['high']) | (df['close'] < df['low']),
+        'negative_volume': df['volume'] < 0,
+    }
+    prev = df['code'].map(prev_close)
+    warns = {
+        'daily_jump': ((df['close'] / prev - 1).abs() > MAX_DAILY_JUMP),
+    }
+    return _split(df, rejects, warns)
+
+
+def validate_financials(df: pd.DataFrame, prices_df: pd.DataFrame = None, price_rejected_codes: set = None):
+    """
+    財務指標のチェック。prices_df があれば同日の株価CSVとの整合性も確認する。
+    price_rejected_codes は株価のチェックで除外済みの銘柄 (売買停止など)。株価CSVには載っているため not_in_prices の対象外にする。
+    """
+    to_numeric(df, FINANCIAL_COLS)
+    rejects = {
+        'invalid_code': _code_invalid(df),
+        'non_positive_market_cap': df['market_cap'] <= 0,
+        'non_positive_shares': df['shares_outstanding'] <= 0,
+        'negative_pbr': df['pbr_actual'] < 0,
+        'dividend_yield_out_of_range': (df['dividend_yield'] < 0) | (df['dividend_yield'] > 100),
+    }
+    warns = {}
+    if prices_df is not None and not prices_df.empty:
+        price_cap = df['code'].map(prices_df.drop_duplicates('code').set_index('code')['market_cap_total'])
+        warns['not_in_prices'] = ~df['code'].isin(prices_df['code']) & ~df['code'].isin(price_rejected_codes or ())
+        warns['market_cap_mismatch'] = (df['market_cap'] / price_cap - 1).abs() > MAX_MARKET_CAP_GAP
+    return _split(df, rejects, warns)
+
+
+def validate_margin(df: pd.DataFrame):
+    """信用残のチェック"""
+    to_numeric(df, MARGIN_COLS)
+    balance_cols = [c for c in MARGIN_COLS if c != 'ratio']
+    rejects = {
+        'invalid_code': _code_invalid(df),
+        'negative_balance': (df[balance_cols] < 0).any(axis=1),
+    }
+    expected_ratio = df['buy_balance_total'] / df['sell_balance_total'].where(df['sell_balance_total'] > 0)
+    warns = {
+        'ratio_mismatch': (df['ratio'] - expected_ratio).abs() > 0.05 * expected_ratio.abs() + 0.01,
+    }
+    return _split(df, rejects, warns)
+
+
+def validate_indices(df: pd.DataFrame):
+    """指数データのチェック"""
+    to_numeric(df, INDEX_COLS)
+    rejects = {
+        'missing_close': df['close'].isna(),
+        'non_positive_close': df['close'] <= 0,
+    }
+    warns = {
+        'daily_jump': df['change_ratio'].abs() > MAX_DAILY_JUMP * 100,
+    }
+    return _split(df, rejects, warns)
+
+
+# --- DB入出力 ---
+def load_previous_close(conn: sqlite3.Connection, date_str: str) -> pd.Series:
+    """date_str より前の直近営業日の終値 (index: code) を返す"""
+    # 日番号の索引で直近日を引き、その日の終値だけを読む
+    df = pd.read_sql_query("""
+        SELECT c.code, p.close_x10 / 10.0 AS close
+        FROM daily_prices_compact p JOIN companies c ON c.code_id = p.code_id
+        WHERE p.day = (SELECT MAX(day) FROM daily_prices_compact WHERE day < ?)
+    """, conn, params=(date_to_day(date_str),))
+    return df.set_index('code')['close']
+
+
+def quarantine(conn: sqlite3.Connection, report: ValidationReport, feed: str, date_str: str,
+               checked: int, issues: pd.DataFrame):
+    """問題のある行を quarantine テーブルへ書き込み、集計に加える"""
+    report.add(feed, checked, issues)
+    if issues.empty:
+        return
+    records = [(report.run_id, feed, code, date_str, severity, reason, raw)
+               for code, severity, reason, raw in issues[['code', 'severity', 'reason', 'raw']].itertuples(index=False)]
+    conn.executemany("""
+        INSERT INTO quarantine (run_id, feed, code, date, severity, reason, raw)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, records)
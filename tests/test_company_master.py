@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src import db_manager
+from src.company_master import CompanySnapshot, get_companies_as_of, get_company_as_of
+
+
+def _prices(rows: list) -> pd.DataFrame:
+    """株価CSVのうち銘柄属性の列 (code, name, market, industry)"""
+    return pd.DataFrame(rows, columns=['code', 'name', 'market', 'industry'])
+
+
+DAY1 = _prices([('1301', '極洋', '東証プライム', '水産・農林業'),
+                ('7203', 'トヨタ自動車', '東証プライム', '輸送用機器'),
+                ('9999', 'テスト', '東証グロース', np.nan)])
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'stock.db')
+    db_manager.create_tables(conn)
+    yield conn
+    conn.close()
+
+
+def _history(conn, code: str) -> list:
+    return conn.execute("""
+        SELECT h.valid_from, h.valid_to, h.name, h.market, h.industry
+        FROM company_history h JOIN companies c ON c.code_id = h.code_id
+        WHERE c.code = ? ORDER BY h.valid_from
+    """, (code,)).fetchall()
+
+
+def test_first_load_registers_every_company(conn):
+    snapshot = CompanySnapshot.load(conn)
+    assert snapshot.apply(conn, DAY1, '20240603') == 3
+    assert conn.execute("SELECT code, name, industry FROM companies ORDER BY code").fetchall() == [
+        ('1301', '極洋', '水産・農林業'), ('7203', 'トヨタ自動車', '輸送用機器'), ('9999', 'テスト', None)]
+    assert _history(conn, '1301') == [(db_manager.date_to_day('20240603'), None, '極洋', '東証プライム', '水産・農林業')]
+
+
+def test_unchanged_rows_and_nan_attributes_are_not_rewritten(conn):
+    snapshot = CompanySnapshot.load(conn)
+    snapshot.apply(conn, DAY1, '20240603')
+    # 業種が空 (NaN) のままの銘柄も「変化なし」として扱う
+    assert snapshot.apply(conn, DAY1, '20240604') == 0
+    # DBから読み直したスナップショットでも同じ (空の属性は None で保存されている)
+    assert CompanySnapshot.load(conn).apply(conn, DAY1, '20240604') == 0
+
+    # 空だった属性に値が入るのは変化
+    day = DAY1.copy()
+    day.loc[day['code'] == '9999', 'industry'] = '情報・通信業'
+    assert snapshot.apply(conn, day, '20240605') == 1
+
+
+def test_attribute_change_closes_previous_row(conn):
+    snapshot = CompanySnapshot.load(conn)
+    snapshot.apply(conn, DAY1, '20240603')
+    day = DAY1.copy()
+    day.loc[day['code'] == '1301', 'market'] = '東証スタンダード'
+    assert snapshot.apply(conn, day, '20240610') == 1
+
+    d1, d2 = db_manager.date_to_day('20240603'), db_manager.date_to_day('20240610')
+    assert _history(conn, '1301') == [(d1, d2, '極洋', '東証プライム', '水産・農林業'),
+                                      (d2, None, '極洋', '東証スタンダード', '水産・農林業')]
+    assert len(_history(conn, '7203')) == 1
+
+
+def test_same_day_rerun_replaces_the_row_instead_of_adding_one(conn):
+    snapshot = CompanySnapshot.load(conn)
+    snapshot.apply(conn, DAY1, '20240603')
+    day = DAY1.copy()
+    day.loc[day['code'] == '7203', 'name'] = 'トヨタ'
+    snapshot.apply(conn, day, '20240610')
+    day.loc[day['code'] == '7203', 'name'] = 'トヨタ自動車(訂正)'
+    assert snapshot.apply(conn, day, '20240610') == 1
+
+    d1, d2 = db_manager.date_to_day('20240603'), db_manager.date_to_day('20240610')
+    assert [(f, t, n) for f, t, n, _, _ in _history(conn, '7203')] == [(d1, d2, 'トヨタ自動車'), (d2, None, 'トヨタ自動車(訂正)')]
+
+
+def test_stale_dates_do_not_overwrite_current_attributes(conn):
+    snapshot = CompanySnapshot.load(conn)
+    snapshot.apply(conn, DAY1, '20240610')
+    # 過去分の再取り込み: 既存銘柄は書き換えないが、新しく現れた銘柄は登録する
+    old = pd.concat([DAY1.assign(name='旧社名'), _prices([('2000', '新規', '東証スタンダード', '食料品')])])
+    assert snapshot.apply(conn, old, '20240603') == 1
+
+    assert conn.execute("SELECT name FROM companies WHERE code = '1301'").fetchone() == ('極洋',)
+    assert len(_history(conn, '1301')) == 1
+    assert get_company_as_of(conn, '2000', '20240603')['name'] == '新規'
+
+
+def test_get_company_as_of(conn):
+    snapshot = CompanySnapshot.load(conn)
+    snapshot.apply(conn, DAY1, '20240603')
+    day = DAY1.copy()
+    day.loc[day['code'] == '1301', 'industry'] = '食料品'
+    snapshot.apply(conn, day, '20240610')
+
+    assert get_company_as_of(conn, '1301', '20240531') is None
+    assert get_company_as_of(conn, '1301', '20240603')['industry'] == '水産・農林業'
+    assert get_company_as_of(conn, '1301', '20240607')['industry'] == '水産・農林業'
+    assert get_company_as_of(conn, '1301', '20240610') == {'code': '1301', 'name': '極洋', 'market': '東証プライム',
+                                                           'industry': '食料品'}
+    assert get_company_as_of(conn, '0000', '20240610') is None
+
+    assert list(get_companies_as_of(conn, '20240607', industry='水産・農林業')['code']) == ['1301']
+    assert list(get_companies_as_of(conn, '20240610', industry='水産・農林業')['code']) == []
@@ -0,0 +1,39 @@
+import os
+import sqlite3
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src import db_manager
+from src.db_maintenance import archive_old_rows, connect_for_maintenance
+
+DATES = ['20231228', '20231229', '20240104', '20240105', '20240401', '20240402']
+
+
+def test_archive_moves_old_rows_into_yearly_files(tmp_path):
+    path = str(tmp_path / 'stock.db')
+    conn = sqlite3.connect(path)
+    db_manager.create_tables(conn)
+    for code in ('1301', '7203'):
+        for date in DATES:
+            conn.execute("INSERT INTO daily_prices (code, date, open, high, low, close, volume, trading_value, "
+                         "market_cap_total) VALUES (?, ?, 100, 110, 90, 105, 1000, 100, 10)", (code, date))
+    conn.commit()
+    conn.close()
+
+    conn = connect_for_maintenance(path)
+    archive_dir = str(tmp_path / 'archive')
+    moved = archive_old_rows(conn, retention_days=30, archive_dir=archive_dir)
+
+    # 最新日 (2024-04-02) から30日より前の行が、年ごとのファイルへ移る
+    assert moved['daily_prices_compact'] == 8
+    assert conn.execute("SELECT code, date FROM daily_prices ORDER BY code, date").fetchall() == [
+        ('1301', '20240401'), ('1301', '20240402'), ('7203', '20240401'), ('7203', '20240402')]
+    conn.close()
+
+    for year, dates in (('2023', DATES[:2]), ('2024', DATES[2:4])):
+        with sqlite3.connect(os.path.join(archive_dir, f"stock_archive_{year}.db")) as archive:
+            rows = archive.execute("""
+                SELECT c.code, t.day FROM daily_prices_compact t JOIN companies c ON c.code_id = t.code_id
+                ORDER BY c.code, t.day
+            """).fetchall()
+        assert rows == [(code, db_manager.date_to_day(d)) for code in ('1301', '7203') for d in dates]
@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src import db_manager
+from src.bench_schema import build_legacy_db
+from src.kabu_plus_stub import KabuPlusDataset
+
+TABLES = ['daily_prices', 'daily_financials', 'weekly_margin', 'daily_indices']
+# 日番号に変換できない日付の行 (テーブル, code, date)
+BAD_ROWS = [('daily_prices', '1301', ''), ('daily_prices', '1332', '2024-6-2'),
+            ('daily_financials', '1301', '2024ab01'), ('weekly_margin', '1301', None)]
+
+
+def _counts(conn) -> dict:
+    return {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in TABLES}
+
+
+@pytest.fixture
+def migrated(tmp_path):
+    """旧スキーマのDBに不正な日付の行を混ぜてから移行し、(接続, 移行前の件数, 移行前の株価) を返す"""
+    path = str(tmp_path / 'stock.db')
+    build_legacy_db(path, KabuPlusDataset(n_codes=30, seed=1), datetime(2024, 6, 28), 5)
+    conn = sqlite3.connect(path)
+    before = _counts(conn)
+    prices = conn.execute("SELECT code, date, close, volume FROM daily_prices ORDER BY code, date").fetchall()
+    for table, code, date in BAD_ROWS:
+        conn.execute(f"INSERT INTO {table} (code, date) VALUES (?, ?)", (code, date))
+    conn.commit()
+
+    db_manager.create_tables(conn)
+    yield conn, before, prices
+    conn.close()
+
+
+def test_migration_preserves_rows_and_values(migrated):
+    conn, before, prices = migrated
+    assert _counts(conn) == before
+    assert conn.execute("SELECT type FROM sqlite_master WHERE name = 'daily_prices'").fetchone() == ('view',)
+
+    after = conn.execute("SELECT code, date, close, volume FROM daily_prices ORDER BY code, date").fetchall()
+    assert [(c, d, v) for c, d, _, v in after] == [(c, d, v) for c, d, _, v in prices]
+    # 株価は10倍の整数で保存するため、0.1円単位に丸められる
+    assert all(abs(a[2] - p[2]) <= 0.05 for a, p in zip(after, prices))
+
+
+def test_migration_quarantines_rows_with_invalid_dates(migrated):
+    conn, _, _ = migrated
+    rows = conn.execute("SELECT run_id, feed, code, date, severity, reason FROM quarantine ORDER BY rowid").fetchall()
+    assert [(feed, code, date) for _, feed, code, date, _, _ in rows] == [
+        ('株価', '1301', ''), ('株価', '1332', '2024-6-2'), ('財務指標', '1301', '2024ab01'), ('信用残', '1301', None)]
+    assert all(r[0].startswith('migrate_') and r[4:] == ('reject', 'invalid_date') for r in rows)
+
+
+def test_migration_sets_schema_version_and_is_idempotent(migrated):
+    conn, before, _ = migrated
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == db_manager.SCHEMA_VERSION
+
+    db_manager.create_tables(conn)
+    assert _counts(conn) == before
+    assert conn.execute("SELECT COUNT(*) FROM quarantine").fetchone()[0] == len(BAD_ROWS)
+
+
+def test_compat_views_accept_legacy_inserts(migrated):
+    conn, _, _ = migrated
+    # 未登録の銘柄は採番され、同じキーへの INSERT OR REPLACE は上書きになる
+    conn.execute("INSERT INTO daily_prices (code, date, open, high, low, close, volume, trading_value, market_cap_total) "
+                 "VALUES ('99990', '20240701', 100.04, 101, 99, 100.26, 5000, 500, 10)")
+    conn.execute("INSERT OR REPLACE INTO daily_prices (code, date, open, high, low, close, volume, trading_value, "
+                 "market_cap_total) VALUES ('99990', '20240701', 100, 101, 99, 100.5, 6000, 600, 10)")
+    conn.execute("INSERT INTO weekly_margin (code, date, sell_balance_total, buy_balance_total, ratio) "
+                 "VALUES ('99990', '20240702', 10, 30, 3.0)")
+    conn.execute("INSERT INTO daily_indices (code, name, date, close) VALUES ('I001', '水産', '20240701', 123.4)")
+
+    code_id = conn.execute("SELECT code_id FROM companies WHERE code = '99990'").fetchone()[0]
+    assert conn.execute("SELECT COUNT(*) FROM companies WHERE code = '99990'").fetchone()[0] == 1
+    assert conn.execute("SELECT close_x10, volume FROM daily_prices_compact WHERE code_id = ? AND day = ?",
+                        (code_id, db_manager.date_to_day('20240701'))).fetchall() == [(1005, 6000)]
+    assert conn.execute("SELECT date, close FROM daily_prices WHERE code = '99990'").fetchall() == [('20240701', 100.5)]
+    assert conn.execute("SELECT sell_balance_total, buy_balance_total FROM weekly_margin WHERE code = '99990'").fetchall() == [(10, 30)]
+    assert conn.execute("SELECT name, close FROM daily_indices WHERE code = 'I001' AND date = '20240701'").fetchall() == [('水産', 123.4)]
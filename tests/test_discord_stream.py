@@ -0,0 +1,79 @@
+import asyncio
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.discord_stream import DISCORD_MESSAGE_LIMIT, deliver_stream, split_message
+
+
+def _report(sections: int = 12, seed: int = 0) -> str:
+    """見出し・段落・長い行が混ざった、上限を何度も超える長さのレポート"""
+    rng = random.Random(seed)
+    parts = []
+    for i in range(1, sections + 1):
+        parts.append(f"### {i}. セクション{i}")
+        for _ in range(rng.randint(1, 4)):
+            parts.append('\n'.join('分析' * rng.randint(5, 200) for _ in range(rng.randint(1, 4))))
+    return '\n\n'.join(parts)
+
+
+def test_split_respects_limit_and_keeps_text():
+    text = _report()
+    pieces = split_message(text)
+    assert len(pieces) > 1
+    assert all(0 < len(p) <= DISCORD_MESSAGE_LIMIT for p in pieces)
+    # 区切りの改行以外は失われない
+    assert ''.join(pieces).replace('\n', '') == text.replace('\n', '')
+
+
+def test_split_prefers_section_breaks():
+    section = "### 見出し\n" + '本文' * 300
+    pieces = split_message(section + '\n' + section + '\n' + section)
+    assert all(p.startswith('### 見出し') for p in pieces)
+
+
+def test_appending_text_does_not_move_earlier_cuts():
+    # ストリーミング中は末尾に追記されるだけなので、確定済みのメッセージ (最後以外) は変わってはならない
+    text = _report(seed=1)
+    previous = []
+    for end in range(1, len(text) + 1, 37):
+        pieces = split_message(text[:end])
+        assert pieces[:len(previous) - 1] == previous[:-1]
+        previous = pieces
+
+
+def test_text_without_break_points_is_cut_at_the_limit():
+    text = 'あ' * (DISCORD_MESSAGE_LIMIT * 2 + 10)
+    pieces = split_message(text)
+    assert [len(p) for p in pieces] == [DISCORD_MESSAGE_LIMIT, DISCORD_MESSAGE_LIMIT, 10]
+
+
+class _Message:
+    def __init__(self, channel, content):
+        self.channel, self.content = channel, content
+
+    async def edit(self, content):
+        self.channel.edits += 1
+        self.content = content
+
+
+class _Channel:
+    def __init__(self):
+        self.messages, self.edits = [], 0
+
+    async def send(self, content):
+        message = _Message(self, content)
+        self.messages.append(message)
+        return message
+
+
+def test_deliver_stream_shows_whole_report_across_messages():
+    text = _report(seed=2)
+    chunks = iter([text[i:i + 50] for i in range(0, len(text), 50)])
+    channel = _Channel()
+
+    result = asyncio.run(deliver_stream(channel, chunks, edit_interval=0.0))
+
+    assert result == text
+    assert [m.content for m in channel.messages] == split_message(text)
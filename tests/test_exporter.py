@@ -0,0 +1,86 @@
+import csv
+import gzip
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src import db_manager, exporter
+from src.exporter import EXPORT_COLUMNS, iter_export_pages
+
+CODES = ['1301', '1332', '1333', '7203', '9984']
+DATES = ['20240603', '20240604', '20240605', '20240606', '20240607', '20240610']
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'stock.db')
+    conn = sqlite3.connect(path)
+    db_manager.create_tables(conn)
+    conn.executemany("INSERT INTO companies (code, name, market, industry) VALUES (?, ?, 'プライム', '業種')",
+                     [(code, f"社名{code}") for code in CODES + ['8000']])  # 8000 は株価なし
+    for i, code in enumerate(CODES):
+        # 銘柄ごとに日数を変え、財務指標は一部の日だけにする
+        for j, date in enumerate(DATES[:len(DATES) - i % 3]):
+            conn.execute("INSERT INTO daily_prices (code, date, open, high, low, close, volume, trading_value, "
+                         "market_cap_total) VALUES (?, ?, 100, 110, 90, ?, 1000, 100, 10)", (code, date, 100 + i + j / 10))
+            if j % 2 == 0:
+                conn.execute("INSERT INTO daily_financials (code, date, market_cap, per_forecast) VALUES (?, ?, 10, ?)",
+                             (code, date, 15.0 + j))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _expected(conn, code_from, code_to, date_from, date_to) -> list:
+    """互換ビューを素直に結合した期待値 (code, date) 順"""
+    return conn.execute("""
+        SELECT p.code, p.date, c.name, c.market, c.industry,
+               p.open, p.high, p.low, p.close, p.volume, p.trading_value, p.market_cap_total,
+               f.market_cap, f.shares_outstanding, f.per_forecast, f.pbr_actual,
+               f.eps_forecast, f.bps_actual, f.dividend_yield, f.min_investment
+        FROM daily_prices p
+        JOIN companies c ON c.code = p.code
+        LEFT JOIN daily_financials f ON f.code = p.code AND f.date = p.date
+        WHERE p.code BETWEEN ? AND ? AND p.date BETWEEN ? AND ?
+        ORDER BY p.code, p.date
+    """, (code_from, code_to, date_from, date_to)).fetchall()
+
+
+@pytest.mark.parametrize('args', [('0000', '9999', '19000101', '99991231'), ('1332', '7203', '20240604', '20240607')])
+def test_pages_match_full_query_for_any_page_size(db_path, args):
+    conn = sqlite3.connect(db_path)
+    expected = _expected(conn, *args)
+    assert expected
+
+    for page_size in (1, 2, 7, len(expected), len(expected) + 100):
+        pages = list(iter_export_pages(conn, *args, page_size=page_size))
+        rows = [tuple(row) for page in pages for row in page]
+        assert rows == expected
+        assert len(set(r[:2] for r in rows)) == len(rows)
+        # 最後以外のページはちょうど page_size 件
+        assert all(len(page) == page_size for page in pages[:-1])
+        assert 0 < len(pages[-1]) <= page_size
+    conn.close()
+
+
+@pytest.mark.parametrize('args', [('5000', '5999', '19000101', '99991231'), ('7203', '1301', '19000101', '99991231'),
+                                  ('0000', '9999', '20240611', '20241231'), ('8000', '8000', '19000101', '99991231')])
+def test_empty_ranges_yield_no_pages(db_path, args):
+    conn = sqlite3.connect(db_path)
+    assert list(iter_export_pages(conn, *args, page_size=3)) == []
+    conn.close()
+
+
+def test_export_csv_writes_header_and_every_row(db_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(exporter, 'get_connection', lambda: sqlite3.connect(db_path))
+    out = str(tmp_path / 'out.csv.gz')
+
+    count = exporter.export_data(out, '0000', '9999', '20240601', '20240630', fmt='csv', page_size=4)
+
+    with gzip.open(out, 'rt', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == EXPORT_COLUMNS
+    assert count == len(rows) - 1 == len(_expected(sqlite3.connect(db_path), '0000', '9999', '20240601', '20240630'))
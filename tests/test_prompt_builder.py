@@ -0,0 +1,149 @@
+import io
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.benchmark import prompt_variants
+from src.gemini_stub import StubGeminiClient
+from src.prompt_builder import build_prompt, estimate_tokens, estimate_image_tokens, SMALL_IMAGE_SIDE
+
+SYSTEM_PROMPT = "あなたは経験豊富な証券アナリストです。"
+PRIORITY = ['財務', '需給', '業種', '概要']
+SECTION_MARKERS = {'財務': '【財務', '需給': '【需給】', '業種': '【業種】', '概要': '【概要】'}
+
+
+def _inputs() -> dict:
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2024-01-01', periods=300)
+    close = 1000 * np.exp(np.cumsum(rng.normal(0, 0.01, len(dates))))
+    stock_data = pd.DataFrame({'Open': close, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+                               'Volume': rng.integers(1e5, 1e6, len(dates))}, index=dates)
+    financial_data = pd.DataFrame({
+        'date': [f"2024-0{m}-01" for m in range(1, 6)],
+        'market_cap': [50000, 51000, 52000, 53000, 54000],
+        'per_forecast': [15.2, 14.8, 15.5, 16.1, 15.9],
+        'pbr_actual': [1.2, 1.1, 1.3, 1.25, 1.4],
+        'eps_forecast': [120.5, 121.0, 122.3, 125.0, 130.2],
+        'bps_actual': [900.0, 905.5, 910.0, 915.2, 920.8],
+        'dividend_yield': [2.1, 2.2, 2.0, 2.3, 2.4],
+    })
+    margin_data = pd.DataFrame({
+        'date': [f"2024-05-{d:02d}" for d in (3, 10, 17, 24, 31)],
+        'sell_balance_total': [1000, 1100, 1200, 1150, 1300],
+        'buy_balance_total': [5000, 5200, 5100, 5300, 5600],
+        'ratio': [5.0, 4.7, 4.25, 4.6, 4.3],
+    })
+    chart = io.BytesIO()
+    Image.new('RGB', (1200, 800), 'white').save(chart, format='PNG')
+    return {
+        'company_name': 'テスト工業', 'code': '9999', 'summary': 'プライム / 機械',
+        'stock_data': stock_data, 'financial_data': financial_data, 'chart_buffer': chart,
+        'margin_data': margin_data,
+        'sector_data': {'業種': '機械', '同業社数': 42, 'PER中央値': 14.1, 'PBR中央値': 1.05},
+        'system_prompt': SYSTEM_PROMPT,
+    }
+
+
+def _section_costs(text: str) -> dict:
+    """プロンプト本文を【見出し】ごとに分け、任意セクションのトークン数を返す"""
+    costs = {}
+    for section in re.split(r'\n(?=【)', text):
+        for name, marker in SECTION_MARKERS.items():
+            if section.startswith(marker):
+                costs[name] = estimate_tokens(section)
+    return costs
+
+
+def test_generous_budget_keeps_every_section():
+    prompt = build_prompt(**_inputs(), token_budget=100000)
+    assert prompt['omitted'] == []
+    assert prompt['image'] is not None
+    assert set(_section_costs(prompt['text'])) == set(PRIORITY)
+
+
+def test_prompt_stays_within_budget():
+    inputs = _inputs()
+    required = build_prompt(**{**inputs, 'chart_buffer': None, 'financial_data': None, 'margin_data': None,
+                               'sector_data': None, 'summary': ''}, token_budget=100000)['tokens']
+    full = build_prompt(**inputs, token_budget=100000)
+
+    for budget in range(required, full['tokens'] + 100, 25):
+        prompt = build_prompt(**inputs, token_budget=budget)
+        assert prompt['tokens'] <= budget
+        # 報告されたトークン数は、実際の本文・画像・システムプロンプトの見積もりと一致する (セクション間の改行の分の誤差のみ)
+        image_tokens = 0
+        if prompt['image'] is not None:
+            with Image.open(io.BytesIO(prompt['image'])) as img:
+                image_tokens = estimate_image_tokens(*img.size)
+        actual = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt['text']) + image_tokens
+        assert abs(actual - prompt['tokens']) <= len(PRIORITY) + 3
+
+
+def test_sections_are_dropped_lowest_priority_first():
+    full = build_prompt(**_inputs(), token_budget=100000)
+    costs = _section_costs(full['text'])
+    base = full['tokens'] - sum(costs.values())
+
+    # 上位 k 個の任意セクションがちょうど収まる予算では、それより優先度の低いセクションが省略される
+    for k in range(len(PRIORITY) + 1):
+        budget = base + sum(costs[name] for name in PRIORITY[:k])
+        prompt = build_prompt(**_inputs(), token_budget=budget)
+        assert prompt['omitted'] == PRIORITY[k:]
+        assert prompt['tokens'] <= budget
+
+
+def test_chart_is_downscaled_before_sections_are_dropped():
+    inputs = {**_inputs(), 'chart_width': 1536}  # 原寸では 2x2 タイル
+    full = build_prompt(**inputs, token_budget=100000)
+    with Image.open(io.BytesIO(full['image'])) as img:
+        full_image_tokens = estimate_image_tokens(*img.size)
+
+    # 指定幅のチャートは入らないが、1タイルに縮小すれば入る予算
+    assert full_image_tokens > estimate_image_tokens(SMALL_IMAGE_SIDE, SMALL_IMAGE_SIDE)
+    budget = full['tokens'] - full_image_tokens + estimate_image_tokens(SMALL_IMAGE_SIDE, SMALL_IMAGE_SIDE)
+    prompt = build_prompt(**inputs, token_budget=budget)
+    assert prompt['image'] is not None
+    with Image.open(io.BytesIO(prompt['image'])) as img:
+        assert max(img.size) <= SMALL_IMAGE_SIDE
+    assert prompt['omitted'] == []
+    assert prompt['tokens'] <= budget
+
+
+def test_financials_section_is_labelled_as_recent_trading_days():
+    inputs = _inputs()
+    inputs['financial_data'] = pd.concat([inputs['financial_data']] * 2, ignore_index=True)
+    inputs['financial_data']['date'] = [d.strftime('%Y-%m-%d') for d in pd.bdate_range('2024-05-20', periods=10)]
+    text = build_prompt(**inputs, token_budget=100000)['text']
+
+    # DBの財務指標は日次なので、決算期ではなく直近の営業日として渡す
+    section = next(s for s in re.split(r'\n(?=【)', text) if s.startswith('【財務'))
+    assert section.startswith('【財務(直近5営業日)】')
+    assert [line.split(',')[0] for line in section.splitlines()[2:]] == list(inputs['financial_data']['date'][-5:])
+    assert '成長性' not in text and '収益性' not in text
+
+
+def test_compact_prompt_is_smaller_and_not_slower_than_legacy():
+    inputs = _inputs()
+    analysis_data = {'company_name': inputs['company_name'], 'code': inputs['code'],
+                     'company_summary': inputs['summary'], 'stock_data': inputs['stock_data'],
+                     'financial_data': inputs['financial_data'], 'margin_data': inputs['margin_data'],
+                     'sector_data': inputs['sector_data']}
+    variants = prompt_variants(analysis_data, inputs['chart_buffer'], SYSTEM_PROMPT)
+
+    # 応答時間が入力トークン数に比例するスタブで、同じ入力の旧形式と新形式を送り比べる
+    stub = StubGeminiClient(latency=0.0, latency_per_1k_tokens=0.2)
+    latency = {}
+    for name, contents in variants.items():
+        t0 = time.perf_counter()
+        stub.models.generate_content(model='stub', contents=contents)
+        latency[name] = time.perf_counter() - t0
+
+    legacy_tokens, compact_tokens = (call['prompt_tokens'] for call in stub.calls)
+    assert compact_tokens < legacy_tokens
+    assert latency['compact'] <= latency['legacy'] + 0.01
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.quote_provider import QUOTE_COLUMNS, QuoteCache, QuoteProvider, merge_quote
+
+
+class _FakeProvider(QuoteProvider):
+    """要求された銘柄のうち known にあるものの気配を返し、呼び出しを記録する"""
+
+    def __init__(self, known=('1301', '1332', '7203'), latency: float = 0.02, error: Exception = None):
+        self.known = set(known)
+        self.latency = latency
+        self.error = error
+        self.calls = []
+
+    def fetch_quotes(self, codes: list) -> pd.DataFrame:
+        self.calls.append(list(codes))
+        time.sleep(self.latency)
+        if self.error is not None:
+            raise self.error
+        rows = {code: ['20240625', 100.0, 110.0, 90.0, 105.0, 1000] for code in codes if code in self.known}
+        return pd.DataFrame.from_dict(rows, orient='index', columns=QUOTE_COLUMNS)
+
+
+def test_concurrent_requests_share_one_upstream_call():
+    provider = _FakeProvider()
+    cache = QuoteCache(provider, ttl=60, batch_window=0.02)
+
+    async def main():
+        return await asyncio.gather(cache.get_quotes(['1301']), cache.get_quotes(['1301', '1332']),
+                                    cache.get_quotes(['7203', '9999']))
+
+    results = asyncio.run(main())
+
+    assert cache.upstream_calls == 1
+    assert provider.calls == [['1301', '1332', '7203', '9999']]
+    assert [list(r.index) for r in results] == [['1301'], ['1301', '1332'], ['7203']]
+    assert results[1].loc['1332', 'Close'] == 105.0
+
+
+def test_cached_and_missing_codes_are_not_refetched_within_ttl():
+    provider = _FakeProvider()
+    cache = QuoteCache(provider, ttl=60, batch_window=0.0)
+
+    async def main():
+        await cache.get_quotes(['1301', '9999'])
+        return await cache.get_quotes(['1301', '9999'])
+
+    result = asyncio.run(main())
+    assert cache.upstream_calls == 1
+    assert list(result.index) == ['1301']
+
+
+def test_entries_expire_after_ttl():
+    provider = _FakeProvider()
+    cache = QuoteCache(provider, ttl=0.05, batch_window=0.0)
+
+    async def main():
+        await cache.get_quotes(['1301'])
+        await asyncio.sleep(0.1)
+        await cache.get_quotes(['1301'])
+
+    asyncio.run(main())
+    assert cache.upstream_calls == 2
+    assert provider.calls == [['1301'], ['1301']]
+
+
+def test_upstream_error_reaches_every_waiter_and_is_not_cached():
+    provider = _FakeProvider(error=RuntimeError('upstream down'))
+    cache = QuoteCache(provider, ttl=60, batch_window=0.02)
+
+    async def main():
+        return await asyncio.gather(cache.get_quotes(['1301']), cache.get_quotes(['1301', '1332']),
+                                    return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert cache.upstream_calls == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache._inflight == {} and cache._entries == {}
+
+    # 障害が解消すれば、次のリクエストで取得し直す
+    provider.error = None
+    result = asyncio.run(cache.get_quotes(['1301']))
+    assert cache.upstream_calls == 2
+    assert list(result.index) == ['1301']
+
+
+def test_merge_quote_replaces_same_day_bar():
+    history = pd.DataFrame({'Open': [1.0, 2.0], 'High': [1.0, 2.0], 'Low': [1.0, 2.0], 'Close': [1.0, 2.0],
+                            'Volume': [10, 20]}, index=pd.DatetimeIndex(['2024-06-24', '2024-06-25'], name='Date'))
+    quote = {'date': '20240625', 'Open': 3.0, 'High': 3.0, 'Low': 3.0, 'Close': 3.0, 'Volume': 30}
+
+    merged = merge_quote(history, quote)
+    assert list(merged['Close']) == [1.0, 3.0]
+    assert list(history['Close']) == [1.0, 2.0]
+    assert merge_quote(history, {**quote, 'date': '20240621'}) is history
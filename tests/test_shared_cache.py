@@ -0,0 +1,86 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src import shared_cache
+from src.shared_cache import SharedCache
+
+
+class _Clock:
+    """shared_cache.time.time の代わりに使う、手で進める時計"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+def _cache(tmp_path, monkeypatch, max_mb: float = 1.0):
+    clock = _Clock()
+    monkeypatch.setattr(shared_cache.time, 'time', clock.time)
+    return SharedCache(str(tmp_path / 'cache.db'), max_mb=max_mb), clock
+
+
+def test_values_expire_after_ttl(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch)
+    cache.set('chart:7203', {'png': b'x' * 10}, ttl=60)
+
+    clock.now += 59
+    assert cache.get('chart:7203') == {'png': b'x' * 10}
+    clock.now += 2
+    assert cache.get('chart:7203', 'missing') == 'missing'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_values_are_shared_between_instances_on_the_same_file(tmp_path, monkeypatch):
+    cache, _ = _cache(tmp_path, monkeypatch)
+    cache.set('analysis:7203', 'report', ttl=60)
+    assert SharedCache(cache.path, max_mb=1.0).get('analysis:7203') == 'report'
+
+
+def test_evict_removes_expired_then_least_recently_used(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch, max_mb=0.01)  # 約10KB
+    value = b'x' * 2000
+    for i in range(4):
+        cache.set(f'k{i}', value, ttl=1000)
+        clock.now += 100
+    cache.set('expired', value, ttl=1)
+    clock.now += 100
+
+    # k0 を最近使ったことにする (TOUCH_INTERVAL より後に読むと最終アクセス時刻が更新される)
+    assert cache.get('k0') == value
+    cache.set('k4', value, ttl=1000)
+
+    removed = cache.evict(target_ratio=0.6)
+    remaining = {key for key in ['k0', 'k1', 'k2', 'k3', 'k4', 'expired'] if cache.get(key) is not None}
+    # 期限切れが先に消え、その後は最終アクセスが古い k1, k2 の順に消える
+    assert remaining == {'k0', 'k3', 'k4'}
+    assert removed == 3
+
+
+def test_evict_does_nothing_under_the_limit(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch)
+    cache.set('expired', 'v', ttl=1)
+    clock.now += 10
+    assert cache.evict() == 0
+
+
+def test_writes_trigger_eviction_periodically(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch, max_mb=0.01)
+    for i in range(shared_cache.EVICT_CHECK_INTERVAL):
+        cache.set(f'k{i}', b'x' * 1000, ttl=1000)
+        clock.now += 1
+    total = cache._conn().execute("SELECT SUM(size) FROM cache").fetchone()[0]
+    assert total <= cache.max_bytes
+
+
+def test_disabled_and_oversized_values_are_not_stored(tmp_path, monkeypatch):
+    disabled, _ = _cache(tmp_path, monkeypatch, max_mb=0)
+    disabled.set('k', 'v', ttl=60)
+    assert disabled.get('k') is None
+    assert not (tmp_path / 'cache.db').exists()
+
+    cache = SharedCache(str(tmp_path / 'cache.db'), max_mb=0.001)
+    cache.set('big', b'x' * 2000, ttl=60)
+    assert cache.get('big') is None
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src import batch_loader, db_manager
+from src.validator import align_header, validate_financials, ValidationReport
+
+MARGIN_COLS = ["SC", "公表日", "信用取引区分", "信用売残", "信用売残 前週比", "信用買残", "信用買残 前週比", "貸借倍率",
+               "制度信用売残", "制度信用売残 前週比", "制度信用買残", "制度信用買残 前週比",
+               "一般信用売残", "一般信用売残 前週比", "一般信用買残", "一般信用買残 前週比"]
+
+
+def _margin_frame(columns: list) -> pd.DataFrame:
+    """信用残CSV 1行分 (売残 50,500 / 買残 135,700) を、指定した列の並びで作る"""
+    values = {
+        "SC": "2046", "公表日": "20240625", "信用取引区分": "貸借",
+        "信用売残": 50500, "信用売残 前週比": 100, "信用買残": 135700, "信用買残 前週比": -200, "貸借倍率": 2.69,
+        "制度信用売残": 50000, "制度信用売残 前週比": 0, "制度信用買残": 130000, "制度信用買残 前週比": 0,
+        "一般信用売残": 500, "一般信用売残 前週比": 0, "一般信用買残": 5700, "一般信用買残 前週比": 0,
+    }
+    return pd.DataFrame([[values[c] for c in columns]], columns=columns)
+
+
+def _swapped(columns: list) -> list:
+    """信用売残と信用買残 (と前週比) の位置を入れ替えた並び"""
+    swapped = list(columns)
+    for a, b in (("信用売残", "信用買残"), ("信用売残 前週比", "信用買残 前週比")):
+        i, j = swapped.index(a), swapped.index(b)
+        swapped[i], swapped[j] = swapped[j], swapped[i]
+    return swapped
+
+
+def test_align_header_selects_columns_by_name_when_reordered():
+    df = align_header(_margin_frame(_swapped(MARGIN_COLS)), [MARGIN_COLS], '信用残')
+    assert list(df.columns) == MARGIN_COLS
+    assert df.loc[0, "信用売残"] == 50500
+    assert df.loc[0, "信用買残"] == 135700
+
+
+def test_align_header_ignores_whitespace_and_bracket_variants_and_extra_columns():
+    columns = [c.replace(" ", "") for c in MARGIN_COLS] + ["備考"]
+    df = align_header(_margin_frame(MARGIN_COLS).set_axis(columns[:-1], axis=1).assign(備考="x"), [MARGIN_COLS], '信用残')
+    assert list(df.columns) == MARGIN_COLS
+    assert df.loc[0, "信用買残"] == 135700
+
+
+def test_align_header_uses_the_first_matching_candidate():
+    primary = ["SC", "時価総額前日比（同左）"]
+    alternative = ["SC", "時価総額前日比"]
+    df = align_header(pd.DataFrame([["0001", 1.5]], columns=alternative), [primary, alternative], '業種別指数')
+    assert list(df.columns) == alternative
+
+
+def test_align_header_rejects_missing_columns_instead_of_renaming_by_position():
+    columns = ["列ずれ" if c == "信用買残" else c for c in MARGIN_COLS]
+    with pytest.raises(KeyError, match="信用買残"):
+        align_header(_margin_frame(MARGIN_COLS).set_axis(columns, axis=1), [MARGIN_COLS], '信用残')
+
+
+def test_reordered_margin_csv_is_stored_with_correct_sell_and_buy(tmp_path, monkeypatch):
+    conn = sqlite3.connect(tmp_path / 'stock.db')
+    db_manager.create_tables(conn)
+    monkeypatch.setattr(batch_loader, 'fetch_csv_as_dataframe',
+                        lambda url, session, skiprows=0: _margin_frame(_swapped(MARGIN_COLS)))
+
+    report = ValidationReport()
+    batch_loader.insert_weekly_margin('20240625', conn, session=None, report=report)
+
+    row = conn.execute("SELECT code, sell_balance_total, buy_balance_total FROM weekly_margin").fetchone()
+    assert row == ('2046', 50500, 135700)
+    assert report.stats['信用残']['warned'] == 0
+
+
+def test_not_in_prices_skips_codes_rejected_by_the_prices_check():
+    financials = pd.DataFrame({'code': ['1301', '1332'], 'market_cap': [100.0, 200.0], 'shares_outstanding': [1, 1],
+                               'pbr_actual': [1.0, 1.0], 'dividend_yield': [1.0, 1.0]})
+    prices = pd.DataFrame({'code': ['1301'], 'market_cap_total': [100.0]})
+
+    _, issues = validate_financials(financials.copy(), prices)
+    assert list(issues['code']) == ['1332']
+
+    _, issues = validate_financials(financials.copy(), prices, price_rejected_codes={'1332'})
+    assert issues.empty